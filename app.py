@@ -5,11 +5,12 @@ import predictor
 import config
 import json
 import os
+import threading
 import time
 import database
+import bar_store
 import plotly.graph_objects as go
 from plotly.subplots import make_subplots
-import akshare as ak
 
 # --- Configuration & Utility Functions ---
 st.set_page_config(page_title="Stock Manager AI", page_icon="📈", layout="wide")
@@ -37,6 +38,66 @@ def get_fund_flow_data_cached(period):
     """
     return rf.get_fund_flow_data(period=period)
 
+def get_fund_flow_data_progressive(period, refresh=False):
+    """
+    即时数据在后台线程获取，主力资金流抓取期间定时显示临时排名和完成度
+    直接返回后台线程的结果（为空或抛出异常时同样返回/抛出，不在页面线程再抓取一次）
+    :param refresh: 跳过缓存重新从API获取（获取成功后才替换缓存）
+    """
+    if period != '即时' or not config.PROGRESSIVE_RANKING_ENABLED:
+        return rf.refresh_fund_flow_data(period) if refresh else get_fund_flow_data_cached(period=period)
+
+    outcome = {}
+
+    def fetch():
+        try:
+            outcome['data'] = rf.refresh_fund_flow_data(period) if refresh else rf.get_fund_flow_data(period)
+        except Exception as e:
+            outcome['error'] = e
+
+    worker = threading.Thread(target=fetch, daemon=True)
+    worker.start()
+    placeholder = st.empty()
+    while worker.is_alive():
+        worker.join(config.PROGRESSIVE_REFRESH_SECONDS)
+        progress = rf.get_main_force_progress(period)
+        # 还没开始抓取，或是上一次已完成的抓取
+        if progress is None or progress.done or not worker.is_alive():
+            continue
+        ranked, info = rf.rank_fund_flow_anytime(progress, top_n=config.TOP_N)
+        with placeholder.container():
+            st.progress(info['completeness'],
+                        text=f"⏳ 主力资金流获取中: 已完成 {info['completeness']:.0%}"
+                             f"（已取得 {info['fetched']}/{info['total']} 只，用时 {info['elapsed']:.0f} 秒），"
+                             f"临时排名前 {info['confirmed']} 名已确定")
+            if not ranked.empty:
+                name_col = '股票简称' if '股票简称' in ranked.columns else '股票名称'
+                cols = [c for c in ['股票代码', name_col, '综合评分', '增仓占比', '涨跌幅', '换手率', '名次已确定']
+                        if c in ranked.columns]
+                st.dataframe(ranked[cols], hide_index=True, use_container_width=True)
+    placeholder.empty()
+    if 'error' in outcome:
+        raise outcome['error']
+    return outcome['data']
+
+@st.fragment(run_every=config.REVALIDATE_POLL_SECONDS)
+def watch_revalidation(period):
+    """后台获取完成后重新运行页面，切换到新数据"""
+    if not rf.is_revalidating(period):
+        st.rerun()
+
+def show_snapshot_status(period, info):
+    """显示当前数据的获取时间和后台刷新状态"""
+    age_minutes = info['age_seconds'] / 60
+    age_text = f"{age_minutes:.0f} 分钟前" if age_minutes >= 1 else "刚刚"
+    if info['revalidating']:
+        st.caption(f"🕒 数据获取于 {info['fetched_at']}（{age_text}）| ⏳ 后台正在获取最新数据，完成后自动切换")
+        watch_revalidation(period)
+    else:
+        st.caption(f"🕒 数据获取于 {info['fetched_at']}（{age_text}）")
+    if info['error']:
+        st.warning(f"后台获取最新数据失败，当前显示的是旧数据: {info['error']}")
+
 def format_money_for_show(val):
     if isinstance(val, (int, float)):
         if abs(val) > 100000000:
@@ -52,9 +113,6 @@ def fetch_and_plot_kline(stock_code, stock_name=None):
         from datetime import datetime
         import time
 
-        end_date = datetime.now().strftime("%Y%m%d")
-        start_date = (datetime.now() - pd.Timedelta(days=120)).strftime("%Y%m%d")
-
         # 添加重试机制以应对网络不稳定
         max_retries = 3
         retry_delay = 1  # 初始延迟1秒
@@ -62,14 +120,8 @@ def fetch_and_plot_kline(stock_code, stock_name=None):
 
         for attempt in range(max_retries):
             try:
-                # 获取日线历史数据
-                df = ak.stock_zh_a_hist(
-                    symbol=stock_code,
-                    period="daily",
-                    start_date=start_date,
-                    end_date=end_date,
-                    adjust="qfq"
-                )
+                # 获取日线历史数据（本地日线库，只补抓缺失的交易日）
+                df = bar_store.get_daily_bars(stock_code, days=120)
 
                 if df is not None and not df.empty:
                     break  # 成功获取数据，跳出重试循环
@@ -176,6 +228,9 @@ with st.sidebar:
         st.success(f"AI 预测: 已启用 ({config.LLM_MODEL})")
     else:
         st.warning("AI 预测: 未开启")
+    cache_stats = rf.get_snapshot_cache_stats()
+    st.caption(f"内存快照缓存: {cache_stats['entries']} 个快照（{cache_stats['bytes'] / 1024 / 1024:.1f} MB）| "
+               f"命中率 {cache_stats['hit_rate']:.0%}（命中 {cache_stats['hits']} / 未命中 {cache_stats['misses']}）")
 
 # --- Page 1: 智能选股 ---
 if selected_page == "🔍 智能选股":
@@ -214,34 +269,30 @@ if selected_page == "🔍 智能选股":
 
     col_ref1, col_ref2 = st.columns([1, 4])
     with col_ref1:
-        refresh = st.button("🔄 刷新数据", help="清除缓存并重新从API获取最新数据")
+        refresh = st.button("🔄 刷新数据", help="重新从API获取最新数据（获取成功后替换缓存）")
     with col_ref2:
         if refresh:
-            st.info("正在清除缓存...")
+            st.info("正在后台获取最新数据..." if config.STALE_WHILE_REVALIDATE_ENABLED else "正在重新获取最新数据...")
 
     if period:
         # 获取数据的Loading状态
         with st.spinner('正在分析全市场资金流向...'):
             try:
+                # 已有成功获取过的数据时立即返回（显示数据时间），刷新或过期时在后台重新获取
+                served, serve_info = (rf.serve_fund_flow_data(period, refresh=refresh)
+                                      if config.STALE_WHILE_REVALIDATE_ENABLED else (None, None))
+                if served is not None:
+                    if '日排行' in period and '增仓占比' not in served.columns:
+                        served = served.assign(增仓占比=float('nan'))
+                    st.session_state[f'df_{period}'] = served
+                    show_snapshot_status(period, serve_info)
                 # 尝试获取数据
-                if refresh or f'df_{period}' not in st.session_state:
-                    # 如果点击了刷新按钮，清除数据库缓存
+                elif refresh or f'df_{period}' not in st.session_state:
+                    # 如果点击了刷新按钮，跳过缓存重新获取；获取成功后才替换缓存，失败时保留现有缓存
                     if refresh:
-                        import sqlite3
-                        import os
-                        db_file = 'stock_data.db'
-                        if os.path.exists(db_file):
-                            try:
-                                conn = sqlite3.connect(db_file)
-                                cursor = conn.cursor()
-                                cursor.execute("DELETE FROM fund_flow_cache WHERE period_type = ?", (period,))
-                                conn.commit()
-                                conn.close()
-                                st.success(f"已清除 {period} 缓存，正在重新获取...")
-                            except Exception as e:
-                                st.warning(f"清除缓存失败: {e}")
-
-                    df = get_fund_flow_data_cached(period=period)
+                        get_fund_flow_data_cached.clear()
+
+                    df = get_fund_flow_data_progressive(period, refresh=refresh)
                     if '日排行' in period and '增仓占比' not in df.columns:
                         df['增仓占比'] = float('nan')
                     st.session_state[f'df_{period}'] = df
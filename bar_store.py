@@ -0,0 +1,134 @@
+# 本地日线库: 按 (股票代码, 复权方式, 日期) 持久化日K线，量比计算、AI预测和K线图共用一份数据
+# 已收盘的日线只抓取一次，之后每次读取只补抓缺失的尾部交易日；盘中的当日K线按时效重新抓取
+
+from datetime import datetime, timedelta
+
+import pandas as pd
+
+import config
+import data_source
+import database
+import single_flight
+from trade_calendar import is_intraday, is_snapshot_stale, last_closed_trade_date
+
+# akshare 日线列名 -> 本地库列名
+AK_COLUMN_MAP = {
+    '日期': 'trade_date',
+    '开盘': 'open',
+    '收盘': 'close',
+    '最高': 'high',
+    '最低': 'low',
+    '成交量': 'volume',
+    '成交额': 'amount',
+    '振幅': 'amplitude',
+    '涨跌幅': 'pct_change',
+    '涨跌额': 'change',
+    '换手率': 'turnover',
+}
+
+# 补抓日线的请求合并：多个线程/会话同时读取同一只股票时只补抓一次，键为 (股票代码, 复权方式, 窗口起点, 日期)
+_TOP_UP_FLIGHTS = single_flight.SingleFlight()
+
+
+def _fetch_bars(stock_code: str, start_date: str, end_date: str, adjust: str) -> pd.DataFrame:
+    """从接口抓取 [start_date, end_date] 的日线，列名转换为本地库列名"""
+    df = data_source.get_provider().stock_zh_a_hist(
+        symbol=stock_code, period="daily",
+        start_date=start_date.replace('-', ''), end_date=end_date.replace('-', ''), adjust=adjust)
+    columns = ['trade_date'] + database.DAILY_BAR_COLUMNS
+    if df is None or df.empty:
+        return pd.DataFrame(columns=columns)
+
+    df = df.rename(columns=AK_COLUMN_MAP)
+    df['trade_date'] = pd.to_datetime(df['trade_date']).dt.strftime("%Y-%m-%d")
+    for col in database.DAILY_BAR_COLUMNS:
+        if col not in df.columns:
+            df[col] = None
+    return df[columns]
+
+
+def _mark_final(df_bars: pd.DataFrame, final_date: str) -> pd.DataFrame:
+    df_bars = df_bars.copy()
+    df_bars['is_final'] = (df_bars['trade_date'] <= final_date).astype(int)
+    return df_bars
+
+
+def _close_changed(old_close, new_close) -> bool:
+    """同一交易日的收盘价不一致（前复权数据在除权除息后会整体变化）"""
+    if pd.isna(old_close) or pd.isna(new_close):
+        return False
+    return abs(float(old_close) - float(new_close)) > 1e-6 * max(1.0, abs(float(old_close)))
+
+
+def _provisional_is_stale(stored: pd.DataFrame, today: str, now: datetime) -> bool:
+    """盘中当日K线缺失或已超过时效（按交易分钟计，午间休市不计时）"""
+    if not is_intraday(now):
+        return False
+    row = stored[stored['trade_date'] == today]
+    if row.empty:
+        return True
+    return is_snapshot_stale(row['fetched_at'].iloc[0], now, config.BAR_INTRADAY_STALE_MINUTES)
+
+
+def _top_up(stock_code: str, start_date: str, now: datetime, adjust: str):
+    """补抓本地缺失的日线：无记录时整段抓取，之后只补前端缺口和尾部新交易日"""
+    today = now.strftime("%Y-%m-%d")
+    fetched_at = now.strftime("%Y-%m-%d %H:%M:%S")
+    final_date = last_closed_trade_date(now)
+    coverage_start, final_through = database.get_daily_bar_coverage(stock_code, adjust)
+
+    if coverage_start is None:
+        bars = _fetch_bars(stock_code, start_date, today, adjust)
+        database.save_daily_bars(stock_code, adjust, _mark_final(bars, final_date),
+                                 coverage_start=start_date, final_through=final_date, fetched_at=fetched_at)
+        return
+
+    # 1. 请求的窗口比已抓取范围更早: 补抓前端缺口
+    if start_date < coverage_start:
+        head_end = (datetime.strptime(coverage_start, "%Y-%m-%d") - timedelta(days=1)).strftime("%Y-%m-%d")
+        bars = _fetch_bars(stock_code, start_date, head_end, adjust)
+        database.save_daily_bars(stock_code, adjust, _mark_final(bars, final_date), coverage_start=start_date,
+                                 fetched_at=fetched_at)
+        coverage_start = start_date
+
+    # 2. 有新收盘的交易日，或盘中当日K线已过时效: 从最后一个定型交易日开始补抓尾部
+    stored = database.get_daily_bars(stock_code, adjust, final_through or coverage_start)
+    if (final_through or '') >= final_date and not _provisional_is_stale(stored, today, now):
+        return
+
+    tail_start = final_through or coverage_start
+    bars = _fetch_bars(stock_code, tail_start, today, adjust)
+
+    # 重叠的交易日收盘价变化说明复权因子已变（除权除息），已存的前复权日线全部失效，整段重抓
+    overlap_old = stored.loc[stored['trade_date'] == tail_start, 'close']
+    overlap_new = bars.loc[bars['trade_date'] == tail_start, 'close']
+    if not overlap_old.empty and not overlap_new.empty and _close_changed(overlap_old.iloc[0], overlap_new.iloc[0]):
+        bars = _fetch_bars(stock_code, coverage_start, today, adjust)
+        database.save_daily_bars(stock_code, adjust, _mark_final(bars, final_date),
+                                 coverage_start=coverage_start, final_through=final_date, replace_all=True,
+                                 fetched_at=fetched_at)
+        return
+
+    database.save_daily_bars(stock_code, adjust, _mark_final(bars, final_date), final_through=final_date,
+                             fetched_at=fetched_at)
+
+
+def get_daily_bars(stock_code: str, days: int, adjust: str = None, now: datetime = None) -> pd.DataFrame:
+    """
+    读取最近 days 个自然日的日K线（先补抓本地缺失部分）
+
+    :param stock_code: 股票代码
+    :param days: 自然日窗口长度
+    :param adjust: 复权方式，默认 config.BAR_ADJUST
+    :return: 与 ak.stock_zh_a_hist 相同列名的DataFrame（日期, 开盘, 收盘, ...），按日期升序
+    """
+    adjust = config.BAR_ADJUST if adjust is None else adjust
+    now = now or datetime.now()
+    start_date = (now - timedelta(days=days)).strftime("%Y-%m-%d")
+
+    _TOP_UP_FLIGHTS.do((stock_code, adjust, start_date, now.strftime("%Y-%m-%d")),
+                       _top_up, stock_code, start_date, now, adjust)
+
+    df = database.get_daily_bars(stock_code, adjust, start_date)
+    df = df.drop(columns=['is_final', 'fetched_at'])
+    return df.rename(columns={v: k for k, v in AK_COLUMN_MAP.items()})
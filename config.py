@@ -13,15 +13,360 @@ DB_PATH = 'stock_data.db'
 # 回测历史数据库路径
 HISTORY_DB_PATH = 'stock_history.db'
 
+# 数据库被其他进程写锁占用时的最长等待时间 (秒)
+DB_BUSY_TIMEOUT = 30
+
+# 每个连接缓存的预编译SQL语句数量
+DB_CACHED_STATEMENTS = 256
+
+# 数据库内存映射大小 (字节)，0 表示关闭
+DB_MMAP_SIZE = 256 * 1024 * 1024
+
 # 分析结果保存目录
 RESULT_DIR = 'analysis_results'
 
 # 历史文件保留天数
 KEEP_DAYS = 7
 
+# 数据库缓存保留天数，过期数据由定期清理任务删除
+CACHE_RETENTION_DAYS = 7
+
+# 两次定期清理之间的最小间隔 (小时)
+RETENTION_INTERVAL_HOURS = 24
+
+# 每批删除的行数 (每批一个短事务，避免长时间占用写锁)
+RETENTION_BATCH_SIZE = 5000
+
+# 每次清理后最多回收的空闲页数 (每页约4KB)
+RETENTION_VACUUM_PAGES = 2000
+
+# 是否在定期清理时把旧数据库（创建时未启用增量回收）转换为增量回收模式
+# 转换需要执行一次整库 VACUUM：耗时与数据库大小成正比，期间阻塞所有读写，默认关闭
+# 不转换时删除的空间会被之后的写入复用，只是文件不会缩小；也可以在空闲时手动执行 database.enable_incremental_vacuum()
+RETENTION_CONVERT_TO_INCREMENTAL = False
+
 # 每次分析取前多少名
 TOP_N = 20
 
+# -----------------
+# 并发抓取配置 (逐只股票请求接口时的自适应限速)
+# -----------------
+
+# 初始请求速率 (请求/秒)，运行中会根据成功率和响应耗时自动调整
+FETCH_INITIAL_RATE = 10
+
+# 速率上下限 (请求/秒)
+FETCH_MIN_RATE = 1
+FETCH_MAX_RATE = 50
+
+# 加性增: 请求顺利时每秒约提高的速率 (请求/秒)
+FETCH_RATE_INCREASE = 5
+
+# 乘性减: 失败或响应变慢时速率乘以该系数
+FETCH_RATE_DECREASE = 0.7
+
+# 响应耗时超过该值(秒)视为接口拥塞，触发降速
+FETCH_LATENCY_TARGET = 3.0
+
+# 令牌桶允许的突发量 (按当前速率计的秒数)
+FETCH_BURST_SECONDS = 0.5
+
+# 同时进行中的请求上限
+FETCH_MAX_IN_FLIGHT = 32
+
+# 单只股票失败后的最大重试次数，以及退避等待时间 (秒)
+FETCH_MAX_RETRIES = 3
+FETCH_BACKOFF_BASE = 0.5
+FETCH_BACKOFF_MAX = 8
+
+# -----------------
+# 原始数据缓存配置
+# -----------------
+
+# 原始资金流快照的存储方式:
+#   'columnar' 按列存储(数值列为真实数值类型，整表一次读出，推荐)
+#   'json'     旧版每只股票一行JSON(逐行序列化/解析，仅用于兼容和性能对比)
+RAW_CACHE_STORAGE = 'columnar'
+
+# 资金流快照按版本写入：新版本完整写入后再在一个事务内切换当前版本指针，读取方始终读到完整的快照；
+# 每个 (周期, 交易日) 保留最近几个版本（含当前版本），供切换前已读取指针的读取方继续读完
+SNAPSHOT_KEEP_VERSIONS = 2
+
+# -----------------
+# 主力资金流缓存配置
+# -----------------
+
+# A股开盘/收盘时间，收盘后抓取的数据当天不再变化
+MARKET_OPEN_TIME = "09:30"
+MARKET_CLOSE_TIME = "15:00"
+MARKET_LUNCH_START = "11:30"
+MARKET_LUNCH_END = "13:00"
+
+# 交易日历未收录的临时休市日 ('YYYY-MM-DD')，节假日休市表见 trade_calendar.py
+EXTRA_MARKET_HOLIDAYS = []
+
+# 盘中获取的资金流排行快照，经过多少交易分钟后重新获取（午休不计时，收盘后获取的快照当天不过期）
+SNAPSHOT_STALE_MINUTES = 30
+
+# 盘中抓取的主力资金流数据超过多少分钟视为过期，重新运行时只重抓过期/缺失/失败的股票
+MAIN_FORCE_STALE_MINUTES = 30
+
+# 获取主力资金流时，把接口已返回的资金流（各档净额和净占比）存入回测历史数据库，供回测和多日特征使用：
+# 全市场排行的今日截面（每只股票一行）+ 逐只获取时的近几个月每日数据（不额外请求，已定稿的交易日不再改写）
+FUND_FLOW_HISTORY_ENABLED = True
+
+# 由资金流历史计算多日主力资金流特征的默认窗口（交易日），及允许的最短、最长窗口
+FLOW_FEATURE_WINDOWS = [3, 5, 10, 20]
+FLOW_FEATURE_MIN_WINDOW = 2
+FLOW_FEATURE_MAX_WINDOW = 60
+
+# N日排行的增仓占比优先由本地资金流历史计算（N日主力净额 / N日成交额）；
+# 窗口内资金流历史或日线成交额不完整的股票仍用即时成交额估算
+FLOW_FEATURE_RANKING_ENABLED = True
+
+# 界面获取即时数据时，主力资金流抓取期间按已取得的股票显示临时排名，及其刷新间隔（秒）
+PROGRESSIVE_RANKING_ENABLED = True
+PROGRESSIVE_REFRESH_SECONDS = 2
+
+# 界面先返回最近一次成功获取的快照（显示数据时间），过期或点击“刷新数据”时在后台重新获取，完成后再切换到新数据；
+# 后台获取期间界面检查是否完成的间隔（秒）
+STALE_WHILE_REVALIDATE_ENABLED = True
+REVALIDATE_POLL_SECONDS = 2
+# 过期触发的后台获取失败后，至少间隔多少秒再自动重试（点击“刷新数据”不受限制）
+REVALIDATE_RETRY_SECONDS = 60
+
+# 先从全市场资金流排行接口一次性获取所有股票的主力资金流（超大单 + 大单），排行中没有的股票再逐只获取
+# 设为 False 则全部逐只获取
+MAIN_FORCE_BULK_ENABLED = True
+
+# 变化驱动刷新：盘中主力资金流缓存过期后，只重抓即时排行中成交额/净额较上次抓取时变化明显的股票，
+# 其余沿用上次数据（结果中的 主力数据时间 为实际抓取时间）
+# 只作用于需要逐只请求的股票：开启 MAIN_FORCE_BULK_ENABLED（默认）时，全市场排行中有的过期股票一次请求就能
+# 取得最新数据，全部使用排行数据、不沿用，变化驱动刷新只减少排行中没有的少数股票的逐只请求；
+# 关闭全市场排行时对所有过期股票生效
+MAIN_FORCE_CHANGE_REFRESH_ENABLED = True
+# 成交额增长超过上次抓取时成交额的比例
+MAIN_FORCE_REFRESH_AMOUNT_DELTA = 0.05
+# 净额变化超过上次抓取时成交额的比例
+MAIN_FORCE_REFRESH_NET_DELTA = 0.01
+# 沿用的数据最多使用多少个交易分钟（午休不计），超过后必须重抓
+MAIN_FORCE_CARRY_MAX_MINUTES = 120
+
+# 分支定界抓取主力资金流：只抓取综合评分有可能进入前N名的股票（增仓评分按最高分估算上界）
+# 保证综合评分前N名（含两步筛选的Top 500候选池）与全量抓取一致；设为 None 则抓取全部股票
+# 注意：被跳过的股票没有增仓占比；按增仓占比排序时（如 main.py 的即时排名）以 get_fund_flow_data(prune=False) 抓取全部股票
+MAIN_FORCE_PRUNE_TOP_N = 500
+
+# 分支定界每批抓取的股票数（首批为前N名）
+MAIN_FORCE_PRUNE_BATCH_SIZE = 200
+
+# -----------------
+# 本地日线库配置 (量比、AI预测、K线图共用)
+# -----------------
+
+# 日线复权方式: 'qfq' 前复权 / 'hfq' 后复权 / '' 不复权
+BAR_ADJUST = 'qfq'
+
+# 盘中的当日K线超过多少分钟重新抓取
+BAR_INTRADAY_STALE_MINUTES = 30
+
+# 两步筛选中计算量比的最长等待时间 (秒)，超时未取到日线的股票使用4维度评分；None 表示等待全部完成
+VOLUME_RATIO_DEADLINE_SECONDS = 60
+
+# -----------------
+# 批处理流水线配置 (main.py)
+# -----------------
+
+# 每日批处理的周期列表: (周期, 排序方式, 文件名前缀)，各周期并发获取、评分和保存
+PIPELINE_PERIODS = [
+    ('即时', 'ratio', '增仓占比'),
+    ('3日排行', 'ratio', '增仓占比'),
+    ('5日排行', 'ratio', '增仓占比'),
+    ('10日排行', 'ratio', '增仓占比'),
+    ('20日排行', 'ratio', '增仓占比'),
+]
+
+# 同时处理的周期数上限
+PIPELINE_MAX_WORKERS = 5
+
+# -----------------
+# 数据源配置 (见 data_source.py)
+# -----------------
+
+# 'live' 直接调用 akshare / 'record' 调用 akshare 并录制返回结果 / 'replay' 从录制结果回放（离线压测）
+DATA_SOURCE = 'live'
+
+# 录制结果的保存目录
+DATA_RECORD_DIR = 'data_recordings'
+
+# 回放时每次请求的模拟延迟 (秒)，可为固定值或 (最小, 最大) 区间
+REPLAY_LATENCY_SECONDS = 0.0
+
+# 回放时模拟请求失败的概率 (0-1)，用于复现限流和重试
+REPLAY_ERROR_RATE = 0.0
+
+# -----------------
+# 进程内快照缓存配置 (资金流排行数据)
+# -----------------
+
+# 快照在内存中的最长保留时间 (秒)，过期后重新读取数据库缓存；None 表示不过期（仍按交易日换键）
+SNAPSHOT_CACHE_TTL_SECONDS = 30 * 60
+
+# 最多缓存多少份快照（周期 x 交易日），超出时淘汰最近最少使用的
+SNAPSHOT_CACHE_MAX_ENTRIES = 16
+
+# 快照缓存的内存上限 (字节)
+SNAPSHOT_CACHE_MAX_BYTES = 512 * 1024 * 1024
+
+# -----------------
+# 评分分档配置 (调整阈值只需修改此处，启动时自动编译为分档查找表)
+# -----------------
+# 分档表格式:
+#   'bins':    [(阈值, 分数, 是否包含阈值), ...]，按阈值从小到大排列
+#              数值 >= 阈值(包含) 或 > 阈值(不包含) 时取该档分数，直到下一档
+#   'below':   低于第一档阈值时的分数
+#   'below_linear': (可选) 低于第一档时改为线性计分: max(floor, intercept + 数值 * slope)
+#   'missing': 数据缺失(NaN)时的分数
+
+# 增仓占比评分 (%)
+POSITION_INCREASE_SCORE_BINS = {
+    'missing': 0,
+    'below': 0,
+    'below_linear': {'intercept': 10, 'slope': 3, 'floor': 0},  # 负增仓: 每-1%扣3分
+    'bins': [
+        (0, 10, True),    # 几乎无增仓
+        (2, 20, True),    # 弱增仓
+        (4, 30, True),    # 微增仓
+        (6, 40, True),    # 小幅增仓
+        (8, 50, True),    # 温和增仓
+        (10, 60, True),   # 中等增仓
+        (12, 70, True),   # 较强增仓
+        (15, 80, True),   # 明显增仓
+        (20, 90, True),   # 强增仓
+        (25, 100, True),  # 超强增仓
+    ],
+}
+
+# 涨跌幅评分 (%)
+PRICE_MOMENTUM_SCORE_BINS = {
+    'missing': 0,
+    'below': 0,           # 暴跌
+    'bins': [
+        (-6, 10, True),   # 大幅下跌
+        (-4, 20, True),   # 明显下跌
+        (-2, 30, True),   # 小幅下跌
+        (0, 40, True),    # 平盘附近
+        (1, 50, True),    # 微涨
+        (2, 60, True),    # 小幅上涨
+        (4, 70, True),    # 温和上涨
+        (6, 80, True),    # 较强上涨
+        (8, 90, True),    # 强势上涨
+        (9.9, 100, True), # 涨停或接近涨停
+    ],
+}
+
+# 换手率评分 (%)，理想范围 5-10%，过低或过高都扣分
+TURNOVER_RATE_SCORE_BINS = {
+    'missing': 0,
+    'below': 20,          # 换手率过低
+    'bins': [
+        (1, 40, True),
+        (2, 60, True),
+        (3, 80, True),
+        (5, 100, True),   # 最理想活跃范围 5-10%
+        (10, 80, False),
+        (15, 60, False),
+        (20, 40, False),
+        (30, 20, False),  # 换手率过高
+    ],
+}
+
+# 成交额评分 (元)
+TURNOVER_AMOUNT_SCORE_BINS = {
+    'missing': 0,
+    'below': 0,                     # 成交额 <= 0
+    'bins': [
+        (0, 20, False),             # < 1亿
+        (1_0000_0000, 40, True),    # >= 1亿
+        (2_0000_0000, 55, True),    # >= 2亿
+        (5_0000_0000, 70, True),    # >= 5亿
+        (10_0000_0000, 85, True),   # >= 10亿
+        (20_0000_0000, 100, True),  # >= 20亿
+    ],
+}
+
+# 量比评分
+VOLUME_RATIO_SCORE_BINS = {
+    'missing': 0,
+    'below': 0,           # 量比 <= 0 视为无数据
+    'bins': [
+        (0, 20, False),   # 缩量
+        (0.8, 40, True),  # 正常
+        (1.2, 60, True),  # 小幅放量
+        (1.5, 70, True),  # 温和放量
+        (2, 80, True),    # 明显放量
+        (3, 90, True),    # 强放量
+        (5, 100, True),   # 巨量
+    ],
+}
+
+# 量比放量等级
+VOLUME_LEVEL_BINS = {
+    'missing': '数据缺失',
+    'below': '数据缺失',
+    'bins': [
+        (0, '萎缩', False),
+        (0.8, '正常', True),
+        (1.2, '温和放量', True),
+        (1.8, '明显放量', True),
+        (2.5, '强放量', True),
+        (5, '巨量', True),
+    ],
+}
+
+# 放量等级（成交额 + 换手率 两级分档）
+# 先按成交额分档，每档内再按换手率分档
+TURNOVER_LEVEL_BINS = {
+    'missing': '数据缺失',
+    'below': {            # 成交额 < 2亿
+        'below': '缩量',
+        'bins': [(5, '正常', True), (15, '温和放量', True)],
+    },
+    'bins': [
+        (2_0000_0000, {   # >= 2亿
+            'below': '正常',
+            'bins': [(10, '温和放量', True), (20, '明显放量', True)],
+        }, True),
+        (5_0000_0000, {   # >= 5亿
+            'below': '正常',
+            'bins': [(5, '温和放量', True), (8, '明显放量', True), (15, '强放量', True)],
+        }, True),
+        (10_0000_0000, {  # >= 10亿
+            'below': '正常',
+            'bins': [(3, '温和放量', True), (5, '明显放量', True), (10, '强放量', True)],
+        }, True),
+    ],
+}
+
+# 综合评分权重 (按顺序累加: 子评分 * 权重)
+COMPREHENSIVE_SCORE_WEIGHTS = {
+    # 有量比数据：5维度评分
+    'with_volume_ratio': [
+        ('增仓评分', 0.45),
+        ('动量评分', 0.18),
+        ('活跃度评分', 0.135),
+        ('流动性评分', 0.135),
+        ('量比评分', 0.10),
+    ],
+    # 无量比数据：4维度评分
+    'without_volume_ratio': [
+        ('增仓评分', 0.50),
+        ('动量评分', 0.20),
+        ('活跃度评分', 0.15),
+        ('流动性评分', 0.15),
+    ],
+}
+
 # -----------------
 # 大模型配置 (用于预测功能)
 # -----------------
@@ -0,0 +1,62 @@
+"""
+测试公共设置（pytest）：检查项输出、临时数据库、临时修改 config
+
+运行离线测试: python -m pytest -q test_xxx.py（加 -s 可看到各项检查的输出）
+每个测试使用独立的临时数据库，并清空 rank_flow 等模块的进程内缓存，测试之间互不影响；
+对模块函数和接口的替换请使用 monkeypatch，测试结束后自动恢复
+"""
+import pytest
+import config
+
+
+class Checker:
+    """逐项检查：打印 [OK]/[X] 及说明，未通过时断言失败"""
+
+    def __call__(self, label, passed, detail=''):
+        print(f"  [{'OK' if passed else 'X'}] {label}{detail}")
+        assert passed, label
+
+    def equal(self, label, actual, expected):
+        """实际值与预期值相等"""
+        self(f"{label}: 实际={actual} 预期={expected}", actual == expected)
+
+
+@pytest.fixture
+def check():
+    return Checker()
+
+
+@pytest.fixture
+def set_config(monkeypatch):
+    """临时修改 config 中的设置，如 set_config(FETCH_MAX_RETRIES=0)，测试结束后恢复"""
+    def apply(**settings):
+        for name, value in settings.items():
+            monkeypatch.setattr(config, name, value)
+    return apply
+
+
+def _reset_process_state():
+    """清空进程内的快照缓存、上次成功的数据、抓取进度和数据源"""
+    import data_source
+    import rank_flow
+
+    rank_flow._SNAPSHOT_CACHE.clear()
+    with rank_flow._SERVE_LOCK:
+        rank_flow._LAST_GOOD.clear()
+        rank_flow._REVALIDATE_ERRORS.clear()
+    rank_flow._PROGRESS.clear()
+    rank_flow._HISTORY_LIMITER = None
+    data_source.set_provider(None)
+
+
+@pytest.fixture
+def temp_db(tmp_path, monkeypatch):
+    """
+    使用临时目录中的主库和历史库（不影响真实缓存），返回临时目录
+    不自动建表，需要模拟旧版数据库的测试可先自行创建
+    """
+    monkeypatch.setattr(config, 'DB_PATH', str(tmp_path / 'stock_data.db'))
+    monkeypatch.setattr(config, 'HISTORY_DB_PATH', str(tmp_path / 'stock_history.db'))
+    _reset_process_state()
+    yield tmp_path
+    _reset_process_state()
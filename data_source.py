@@ -0,0 +1,188 @@
+# 数据源层: 所有 akshare 接口调用统一经由这里的数据源
+# - LiveProvider:      直接调用 akshare（默认）
+# - RecordingProvider: 调用内层数据源，同时把每次的返回结果录制到磁盘
+# - ReplayProvider:    从录制文件回放，可配置模拟延迟和错误率，用于离线压测和复现限流
+# 通过 config.DATA_SOURCE 选择，或在代码中调用 set_provider() 替换
+
+import hashlib
+import json
+import os
+import pickle
+import random
+import time
+from threading import Lock, get_ident
+
+import akshare as ak
+
+import config
+
+# 经由数据源调用的 akshare 接口
+SUPPORTED_APIS = (
+    'stock_fund_flow_individual',   # 资金流排行（即时 / N日排行）
+    'stock_individual_fund_flow',   # 单只股票历史资金流（主力/超大单/大单）
+    'stock_individual_fund_flow_rank',  # 全市场今日资金流排行（主力/超大单/大单）
+    'stock_zh_a_hist',              # 日K线
+    'stock_zh_a_spot_em',           # 全市场实时行情（市盈率等）
+    'stock_individual_info_em',     # 个股基本信息
+    'stock_news_em',                # 个股新闻
+)
+
+
+class RecordingNotFound(KeyError):
+    """回放时找不到对应请求的录制结果"""
+
+
+class DataProvider:
+    """
+    数据源基类：子类实现 call(api, **kwargs)
+    接口按名称调用，如 provider.stock_zh_a_hist(symbol='600000', ...)，只接受关键字参数
+    """
+
+    name = 'base'
+
+    def call(self, api, **kwargs):
+        raise NotImplementedError
+
+    def __getattr__(self, api):
+        if api not in SUPPORTED_APIS:
+            raise AttributeError(api)
+        return lambda **kwargs: self.call(api, **kwargs)
+
+
+class LiveProvider(DataProvider):
+    """直接调用 akshare"""
+
+    name = 'live'
+
+    def call(self, api, **kwargs):
+        return getattr(ak, api)(**kwargs)
+
+
+def request_key(api, kwargs) -> str:
+    """请求的唯一键（接口名 + 排序后的参数）"""
+    payload = json.dumps([api, kwargs], sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha1(payload.encode('utf-8')).hexdigest()[:20]
+
+
+def _recording_path(directory, api, kwargs) -> str:
+    return os.path.join(directory, api, f"{request_key(api, kwargs)}.pkl")
+
+
+class RecordingProvider(DataProvider):
+    """调用内层数据源并录制返回结果（同一请求重复调用时覆盖为最新结果），异常不录制、原样抛出"""
+
+    name = 'record'
+
+    def __init__(self, inner: DataProvider = None, directory: str = None):
+        self.inner = inner or LiveProvider()
+        self.directory = directory or config.DATA_RECORD_DIR
+        self.recorded = 0
+
+    def call(self, api, **kwargs):
+        result = self.inner.call(api, **kwargs)
+        path = _recording_path(self.directory, api, kwargs)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # 先写临时文件再替换，并发录制或中途退出都不会留下半个文件
+        tmp_path = f"{path}.{os.getpid()}.{get_ident()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            pickle.dump({'api': api, 'kwargs': kwargs, 'result': result}, f)
+        os.replace(tmp_path, path)
+        self.recorded += 1
+        return result
+
+
+class ReplayProvider(DataProvider):
+    """
+    从录制文件回放
+
+    :param latency: 每次请求的模拟延迟（秒），可为固定值或 (最小, 最大) 区间
+    :param error_rate: 模拟请求失败（ConnectionError）的概率，用于复现限流和重试
+    :param seed: 随机种子，固定后延迟和失败序列可复现
+    :param missing: 找不到录制结果时 'error' 抛出 RecordingNotFound / 'empty' 返回 None
+    """
+
+    name = 'replay'
+
+    def __init__(self, directory: str = None, latency=None, error_rate=None, seed=None, missing='error'):
+        self.directory = directory or config.DATA_RECORD_DIR
+        self.latency = latency if latency is not None else config.REPLAY_LATENCY_SECONDS
+        self.error_rate = error_rate if error_rate is not None else config.REPLAY_ERROR_RATE
+        self.missing = missing
+        self._random = random.Random(seed)
+        self._loaded = {}
+        self._lock = Lock()
+        self.requests = 0
+        self.errors = 0
+
+    def _delay(self):
+        if isinstance(self.latency, (tuple, list)):
+            low, high = self.latency
+            return self._random.uniform(low, high)
+        return self.latency or 0
+
+    def _load(self, api, kwargs):
+        path = _recording_path(self.directory, api, kwargs)
+        with self._lock:
+            if path in self._loaded:
+                return self._loaded[path]
+        if not os.path.exists(path):
+            raise RecordingNotFound(f"{api}({kwargs}) 没有录制结果")
+        with open(path, 'rb') as f:
+            result = pickle.load(f)['result']
+        with self._lock:
+            self._loaded[path] = result
+        return result
+
+    def call(self, api, **kwargs):
+        with self._lock:
+            self.requests += 1
+            delay = self._delay()
+            fail = self._random.random() < self.error_rate
+        if delay:
+            time.sleep(delay)
+        if fail:
+            with self._lock:
+                self.errors += 1
+            raise ConnectionError(f"[回放] 模拟请求失败: {api}")
+
+        try:
+            result = self._load(api, kwargs)
+        except RecordingNotFound:
+            if self.missing == 'empty':
+                return None
+            raise
+        # 返回副本，调用方修改结果不影响后续回放
+        return result.copy() if hasattr(result, 'copy') else result
+
+
+_PROVIDER = None
+_PROVIDER_LOCK = Lock()
+
+
+def create_provider(kind: str = None) -> DataProvider:
+    """按名称创建数据源: 'live' / 'record' / 'replay'，默认 config.DATA_SOURCE"""
+    kind = kind or config.DATA_SOURCE
+    if kind == 'live':
+        return LiveProvider()
+    if kind == 'record':
+        return RecordingProvider()
+    if kind == 'replay':
+        return ReplayProvider()
+    raise ValueError(f"未知的数据源类型: {kind}")
+
+
+def get_provider() -> DataProvider:
+    """当前使用的数据源（首次调用时按 config.DATA_SOURCE 创建）"""
+    global _PROVIDER
+    with _PROVIDER_LOCK:
+        if _PROVIDER is None:
+            _PROVIDER = create_provider()
+        return _PROVIDER
+
+
+def set_provider(provider: DataProvider):
+    """替换当前数据源（传入 None 时下次调用按配置重新创建），返回之前的数据源"""
+    global _PROVIDER
+    with _PROVIDER_LOCK:
+        previous, _PROVIDER = _PROVIDER, provider
+        return previous
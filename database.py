@@ -1,28 +1,75 @@
 import sqlite3
+import threading
 import pandas as pd
 import config
 from datetime import datetime, timedelta
 import os
 import json
+import time
+import trade_calendar
 
-def get_history_connection():
-    return sqlite3.connect(config.HISTORY_DB_PATH)
+# --- 连接管理 ---
+# 每个线程对每个数据库文件只打开一次连接并复用（sqlite3 连接不能跨线程共享），
+# 建表语句在进程内首次连接时执行一次，之后的读写不再有连接和DDL开销
+_LOCAL = threading.local()
+_SCHEMA_LOCK = threading.Lock()
+_SCHEMA_READY = set()
+
+def _open_connection(path):
+    """打开连接并设置 WAL、同步级别、内存映射等参数"""
+    conn = sqlite3.connect(path, timeout=config.DB_BUSY_TIMEOUT,
+                           cached_statements=config.DB_CACHED_STATEMENTS)
+    # 新建数据库时启用增量回收，清理过期数据后无需整库 VACUUM
+    # （必须在建表和切换 WAL 之前设置；已有数据库需要一次整库 VACUUM 才能转换，见 enable_incremental_vacuum）
+    conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+    # WAL 模式下读写互不阻塞，main.py 和 app.py 同时运行时不再出现 "database is locked"
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute(f"PRAGMA mmap_size={int(config.DB_MMAP_SIZE)}")
+    return conn
+
+def _pooled_connection(path, create_schema):
+    connections = getattr(_LOCAL, 'connections', None)
+    if connections is None:
+        connections = _LOCAL.connections = {}
+
+    key = os.path.abspath(path)
+    conn = connections.get(key)
+    if conn is None:
+        conn = _open_connection(path)
+        connections[key] = conn
+
+    if key not in _SCHEMA_READY:
+        with _SCHEMA_LOCK:
+            if key not in _SCHEMA_READY:
+                create_schema(conn)
+                _SCHEMA_READY.add(key)
+    return conn
 
 def get_connection():
-    return sqlite3.connect(config.DB_PATH)
+    """获取当前线程复用的主数据库连接（无需关闭）"""
+    return _pooled_connection(config.DB_PATH, _create_main_schema)
 
-def init_db():
-    conn = get_connection()
-    c = conn.cursor()
-    
+def get_history_connection():
+    """获取当前线程复用的回测历史数据库连接（无需关闭）"""
+    return _pooled_connection(config.HISTORY_DB_PATH, _create_history_schema)
+
+def close_all_connections():
+    """关闭当前线程打开的所有连接（程序退出或切换数据库路径时调用）"""
+    connections = getattr(_LOCAL, 'connections', None) or {}
+    for conn in connections.values():
+        conn.close()
+    connections.clear()
+
+def _create_main_schema(conn):
     # Watchlist table
-    c.execute('''CREATE TABLE IF NOT EXISTS watchlist (
+    conn.execute('''CREATE TABLE IF NOT EXISTS watchlist (
                     stock_code TEXT PRIMARY KEY,
                     added_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
                 )''')
     
     # Fund flow cache table
-    c.execute('''CREATE TABLE IF NOT EXISTS fund_flow_cache (
+    conn.execute('''CREATE TABLE IF NOT EXISTS fund_flow_cache (
                     stock_code TEXT,
                     period_type TEXT,
                     cache_date TEXT,
@@ -41,7 +88,7 @@ def init_db():
 
     # Daily Top Stocks History table (NEW)
     # 用于保存每天的前20名股票代码，用于后续回测
-    c.execute('''CREATE TABLE IF NOT EXISTS daily_top_history (
+    conn.execute('''CREATE TABLE IF NOT EXISTS daily_top_history (
                     record_date TEXT,
                     stock_code TEXT,
                     stock_name TEXT,
@@ -50,25 +97,26 @@ def init_db():
                     saved_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
                     PRIMARY KEY (record_date, stock_code, period_type)
                 )''')
-                
+
+    # 原始数据表（旧版逐行JSON格式）
+    conn.execute('''CREATE TABLE IF NOT EXISTS raw_fund_flow_cache (
+                    stock_code TEXT,
+                    period_type TEXT,
+                    cache_date TEXT,
+                    data_json TEXT,
+                    PRIMARY KEY (stock_code, period_type, cache_date)
+                )''')
+
+    _create_raw_snapshot_table(conn)
+    _create_main_force_table(conn)
     conn.commit()
-    conn.close()
-    
-    # Init History DB
-    init_history_db()
 
-def init_all_dbs():
-    """初始化所有数据库"""
-    init_db()
-    # init_history_db is called within init_db, but we can be explicit if needed
-    # But currently init_db() calls it at the end.
+    _run_migrations(conn, SCHEMA_MIGRATIONS)
 
-def init_history_db():
-    conn = get_history_connection()
-    c = conn.cursor()
+def _create_history_schema(conn):
     # 历史每日明细数据 (Backtest Data)
     # 记录每个曾入榜股票的每日数据
-    c.execute('''CREATE TABLE IF NOT EXISTS daily_stock_data (
+    conn.execute('''CREATE TABLE IF NOT EXISTS daily_stock_data (
                     trade_date TEXT,
                     stock_code TEXT,
                     stock_name TEXT,
@@ -81,7 +129,207 @@ def init_history_db():
                     PRIMARY KEY (trade_date, stock_code)
                 )''')
     conn.commit()
-    conn.close()
+
+    _run_migrations(conn, HISTORY_SCHEMA_MIGRATIONS)
+
+# --- 版本化迁移 ---
+# 上面的建表语句对应版本0的表结构；之后的每次结构调整都追加为一个迁移，
+# 已执行到的版本号记录在 PRAGMA user_version 中，每个迁移只执行一次
+
+def get_schema_version(conn):
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+def _run_migrations(conn, migrations):
+    """按版本号依次执行尚未执行的迁移，每个迁移在一个事务内完成"""
+    current = get_schema_version(conn)
+    for version, description, migrate in migrations:
+        if version <= current:
+            continue
+        try:
+            conn.execute("BEGIN")
+            migrate(conn)
+            conn.execute(f"PRAGMA user_version = {int(version)}")
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        print(f"[数据库迁移] v{version}: {description}")
+
+def _migrate_main_force_date_key(conn):
+    # 主键由 stock_code 改为 (cache_date, stock_code)，每天的数据不再覆盖前一天
+    conn.execute('''CREATE TABLE main_force_cache_new (
+                        cache_date TEXT NOT NULL,
+                        stock_code TEXT NOT NULL,
+                        超大单净额 REAL,
+                        大单净额 REAL,
+                        主力净流入 REAL,
+                        fetched_at TEXT,
+                        status TEXT,
+                        PRIMARY KEY (cache_date, stock_code)
+                    )''')
+    conn.execute('''INSERT INTO main_force_cache_new
+                        (cache_date, stock_code, 超大单净额, 大单净额, 主力净流入, fetched_at, status)
+                    SELECT cache_date, stock_code, 超大单净额, 大单净额, 主力净流入, fetched_at, status
+                    FROM main_force_cache
+                    WHERE cache_date IS NOT NULL AND stock_code IS NOT NULL''')
+    conn.execute("DROP TABLE main_force_cache")
+    conn.execute("ALTER TABLE main_force_cache_new RENAME TO main_force_cache")
+
+def _migrate_cache_date_indexes(conn):
+    # 缓存读取和清理都按 (日期, 周期) 过滤，原主键以 stock_code 开头用不上
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_fund_flow_cache_date_period ON fund_flow_cache (cache_date, period_type)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_raw_fund_flow_cache_date_period ON raw_fund_flow_cache (cache_date, period_type)")
+    # 回测股票池: SELECT DISTINCT stock_code
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_daily_top_history_code ON daily_top_history (stock_code)")
+
+def _migrate_history_code_index(conn):
+    # 按股票查询历史明细
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_daily_stock_data_code ON daily_stock_data (stock_code, trade_date)")
+
+def _migrate_retention_support(conn):
+    # 原始快照表主键以 period_type 开头，按日期范围清理需要单独的日期索引
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_raw_fund_flow_snapshot_date ON raw_fund_flow_snapshot (cache_date)")
+    # 记录定期维护任务的上次执行时间
+    conn.execute('''CREATE TABLE IF NOT EXISTS maintenance_state (
+                        task TEXT PRIMARY KEY,
+                        last_run_at TEXT
+                    )''')
+
+def _migrate_snapshot_meta(conn):
+    # 每个周期的资金流快照的获取时间，由交易日历判断是否已收盘定稿或盘中过期
+    conn.execute('''CREATE TABLE IF NOT EXISTS fund_flow_snapshot_meta (
+                        cache_date TEXT,
+                        period_type TEXT,
+                        fetched_at TEXT,
+                        PRIMARY KEY (cache_date, period_type)
+                    )''')
+
+def _migrate_main_force_basis(conn):
+    # 抓取主力资金流时该股票在即时排行中的成交额和净额，盘中刷新时据此判断是否有明显成交、需要重抓
+    for col in MAIN_FORCE_BASIS_COLUMNS.values():
+        conn.execute(f"ALTER TABLE main_force_cache ADD COLUMN {col} REAL")
+
+def _add_snapshot_version(conn, table, primary_key):
+    """重建快照表，增加 version 列并加入主键（已有数据为版本0，并设为当前版本）"""
+    columns = conn.execute(f"PRAGMA table_info({table})").fetchall()
+    defs = ",\n".join(f'"{name}" {col_type}' for _, name, col_type, *_ in columns)
+    names = ", ".join(f'"{name}"' for _, name, *_ in columns)
+    pk = ", ".join(f'"{col}"' for col in primary_key)
+    conn.execute(f'''CREATE TABLE {table}_new (
+                        {defs},
+                        version INTEGER NOT NULL DEFAULT 0,
+                        PRIMARY KEY ({pk})
+                    )''')
+    conn.execute(f"INSERT INTO {table}_new ({names}) SELECT {names} FROM {table}")
+    conn.execute(f"DROP TABLE {table}")
+    conn.execute(f"ALTER TABLE {table}_new RENAME TO {table}")
+    conn.execute(f'''INSERT OR IGNORE INTO snapshot_pointer (table_name, cache_date, period_type, version)
+                     SELECT DISTINCT ?, cache_date, period_type, 0 FROM {table}
+                     WHERE cache_date IS NOT NULL AND period_type IS NOT NULL''', (table,))
+
+def _migrate_snapshot_versions(conn):
+    # 快照按版本写入，读取当前版本指针指向的数据；写入新版本时不再先删除当天的旧数据
+    conn.execute('''CREATE TABLE IF NOT EXISTS snapshot_pointer (
+                        table_name TEXT,
+                        cache_date TEXT,
+                        period_type TEXT,
+                        version INTEGER NOT NULL,
+                        PRIMARY KEY (table_name, cache_date, period_type)
+                    )''')
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_snapshot_pointer_date ON snapshot_pointer (cache_date)")
+    _add_snapshot_version(conn, 'fund_flow_cache', ['stock_code', 'period_type', 'cache_date', 'version'])
+    _add_snapshot_version(conn, 'raw_fund_flow_snapshot', ['period_type', 'cache_date', 'version', '股票代码'])
+    _add_snapshot_version(conn, 'raw_fund_flow_cache', ['stock_code', 'period_type', 'cache_date', 'version'])
+    # 重建后原索引随旧表删除，按 (日期, 周期, 版本) 重建
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_fund_flow_cache_date_period ON fund_flow_cache (cache_date, period_type, version)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_raw_fund_flow_cache_date_period ON raw_fund_flow_cache (cache_date, period_type, version)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_raw_fund_flow_snapshot_date ON raw_fund_flow_snapshot (cache_date)")
+
+SCHEMA_MIGRATIONS = [
+    (1, "main_force_cache 主键改为 (cache_date, stock_code)", _migrate_main_force_date_key),
+    (2, "缓存表增加按日期/周期的索引", _migrate_cache_date_indexes),
+    (3, "增加过期数据清理所需的日期索引和维护状态表", _migrate_retention_support),
+    (4, "增加资金流快照获取时间表", _migrate_snapshot_meta),
+    (5, "main_force_cache 增加抓取时的成交额/净额", _migrate_main_force_basis),
+    (6, "资金流快照按版本写入，增加当前版本指针表", _migrate_snapshot_versions),
+]
+
+def _migrate_daily_bars(conn):
+    # 本地日线库: 按 (股票代码, 复权方式, 日期) 存储，量比/预测/K线图共用
+    conn.execute('''CREATE TABLE IF NOT EXISTS daily_bars (
+                        stock_code TEXT NOT NULL,
+                        adjust TEXT NOT NULL,
+                        trade_date TEXT NOT NULL,
+                        open REAL,
+                        close REAL,
+                        high REAL,
+                        low REAL,
+                        volume REAL,
+                        amount REAL,
+                        amplitude REAL,
+                        pct_change REAL,
+                        change REAL,
+                        turnover REAL,
+                        is_final INTEGER NOT NULL DEFAULT 1,
+                        fetched_at TEXT,
+                        PRIMARY KEY (stock_code, adjust, trade_date)
+                    )''')
+    # 每只股票已抓取过的日期范围: start_date 之后、final_through 之前（含）的日线已完整
+    conn.execute('''CREATE TABLE IF NOT EXISTS daily_bar_coverage (
+                        stock_code TEXT NOT NULL,
+                        adjust TEXT NOT NULL,
+                        start_date TEXT,
+                        final_through TEXT,
+                        fetched_at TEXT,
+                        PRIMARY KEY (stock_code, adjust)
+                    )''')
+
+def _migrate_fund_flow_history(conn):
+    # 逐只股票资金流历史: 抓取主力资金流时接口返回的近几个月每日数据（各档净额和净占比），
+    # 按 (股票代码, 日期) 存储，WITHOUT ROWID 使主键即存储顺序，按股票读取连续且不额外占用索引空间
+    conn.execute('''CREATE TABLE IF NOT EXISTS fund_flow_history (
+                        stock_code TEXT NOT NULL,
+                        trade_date TEXT NOT NULL,
+                        close REAL,
+                        pct_change REAL,
+                        main_net REAL,
+                        main_ratio REAL,
+                        super_large_net REAL,
+                        super_large_ratio REAL,
+                        large_net REAL,
+                        large_ratio REAL,
+                        medium_net REAL,
+                        medium_ratio REAL,
+                        small_net REAL,
+                        small_ratio REAL,
+                        is_final INTEGER NOT NULL DEFAULT 1,
+                        fetched_at TEXT,
+                        PRIMARY KEY (stock_code, trade_date)
+                    ) WITHOUT ROWID''')
+    # 按日期截面读取（回测、滚动特征）
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_fund_flow_history_date ON fund_flow_history (trade_date)")
+
+HISTORY_SCHEMA_MIGRATIONS = [
+    (1, "daily_stock_data 增加按股票代码的索引", _migrate_history_code_index),
+    (2, "增加本地日线库 daily_bars", _migrate_daily_bars),
+    (3, "增加逐只股票资金流历史 fund_flow_history", _migrate_fund_flow_history),
+]
+
+def init_db():
+    """确保主数据库和历史数据库的表已创建（每个进程只执行一次建表）"""
+    get_connection()
+    
+    # Init History DB
+    init_history_db()
+
+def init_all_dbs():
+    """初始化所有数据库"""
+    init_db()
+    # init_history_db is called within init_db, but we can be explicit if needed
+    # But currently init_db() calls it at the end.
+
+def init_history_db():
+    get_history_connection()
 
 def get_all_tracked_stocks():
     """获取所有在历史Top榜单中出现过的股票代码"""
@@ -94,8 +342,6 @@ def get_all_tracked_stocks():
     except Exception as e:
         print(f"获取历史Top股票列表失败: {e}")
         return []
-    finally:
-        conn.close()
 
 def save_daily_data_for_backtest(df_filtered):
     """保存筛选后的股票当日数据到历史回测数据库"""
@@ -107,6 +353,7 @@ def save_daily_data_for_backtest(df_filtered):
     
     try:
         data_to_save = []
+        skipped = 0
         for _, row in df_filtered.iterrows():
             code = str(row['股票代码'])
             # 兼容列名
@@ -115,6 +362,10 @@ def save_daily_data_for_backtest(df_filtered):
             change = row.get('涨跌幅', 0)
             net = row.get('净额', 0)
             ratio = row.get('增仓占比', 0)
+            # 没有增仓占比（未取得主力资金流）的股票不写入，避免覆盖当天已保存的有效数据
+            if pd.isna(ratio):
+                skipped += 1
+                continue
             turnover = row.get('成交额', 0)
             mcap = row.get('流通市值', 0)
             
@@ -132,11 +383,12 @@ def save_daily_data_for_backtest(df_filtered):
         
         conn.commit()
         print(f"[Backtest] 已保存 {len(data_to_save)} 只追踪股票的当日数据到 {config.HISTORY_DB_PATH}")
+        if skipped:
+            print(f"[Backtest] {skipped} 只追踪股票缺少增仓占比，未写入")
         
     except Exception as e:
+        conn.rollback()
         print(f"保存回测数据失败: {e}")
-    finally:
-        conn.close()
 
 
 def save_daily_top_list(df: pd.DataFrame, period: str, top_n: int = 20):
@@ -178,28 +430,338 @@ def save_daily_top_list(df: pd.DataFrame, period: str, top_n: int = 20):
         print(f"[{period}] 前 {top_n} 名股票已保存到历史库 (日期: {trade_date})")
         
     except Exception as e:
+        conn.rollback()
         print(f"保存历史排名失败: {e}")
-    finally:
-        conn.close()
+
+# --- 本地日线库 (回测历史数据库) ---
+DAILY_BAR_COLUMNS = ['open', 'close', 'high', 'low', 'volume', 'amount',
+                     'amplitude', 'pct_change', 'change', 'turnover']
+
+def get_daily_bars(stock_code, adjust, start_date=None):
+    """读取本地日线（按日期升序），start_date 为 'YYYY-MM-DD'"""
+    conn = get_history_connection()
+    columns_sql = ", ".join(['trade_date'] + DAILY_BAR_COLUMNS + ['is_final', 'fetched_at'])
+    return pd.read_sql(
+        f"SELECT {columns_sql} FROM daily_bars WHERE stock_code = ? AND adjust = ? AND trade_date >= ? ORDER BY trade_date",
+        conn, params=(stock_code, adjust, start_date or '')
+    )
+
+def save_daily_bars(stock_code, adjust, df_bars, coverage_start=None, final_through=None, replace_all=False,
+                    fetched_at=None):
+    """
+    写入（覆盖）本地日线，并更新已抓取的日期范围
+
+    :param df_bars: 列为 trade_date + DAILY_BAR_COLUMNS + is_final 的DataFrame
+    :param coverage_start: 已完整抓取的起始日期（只会向前扩展）
+    :param final_through: 已收盘定型的最后日期
+    :param replace_all: 先删除该股票的全部日线（复权因子变化后整段重抓时使用）
+    :param fetched_at: 抓取时间，默认当前时间
+    """
+    conn = get_history_connection()
+    fetched_at = fetched_at or datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    columns = ['trade_date'] + DAILY_BAR_COLUMNS + ['is_final']
+    rows = df_bars[columns].astype(object).where(df_bars[columns].notna(), None)
+    try:
+        if replace_all:
+            conn.execute("DELETE FROM daily_bars WHERE stock_code = ? AND adjust = ?", (stock_code, adjust))
+            conn.execute("DELETE FROM daily_bar_coverage WHERE stock_code = ? AND adjust = ?", (stock_code, adjust))
+        conn.executemany(
+            f"INSERT OR REPLACE INTO daily_bars (stock_code, adjust, {', '.join(columns)}, fetched_at) "
+            f"VALUES (?, ?, {', '.join('?' * len(columns))}, ?)",
+            [(stock_code, adjust, *row, fetched_at) for row in rows.itertuples(index=False, name=None)]
+        )
+        conn.execute('''INSERT INTO daily_bar_coverage (stock_code, adjust, start_date, final_through, fetched_at)
+                        VALUES (?, ?, ?, ?, ?)
+                        ON CONFLICT (stock_code, adjust) DO UPDATE SET
+                            start_date = MIN(COALESCE(start_date, excluded.start_date), COALESCE(excluded.start_date, start_date)),
+                            final_through = MAX(COALESCE(final_through, ''), COALESCE(excluded.final_through, '')),
+                            fetched_at = excluded.fetched_at''',
+                     (stock_code, adjust, coverage_start, final_through, fetched_at))
+        conn.commit()
+    except Exception as e:
+        conn.rollback()
+        print(f"保存日线数据失败 {stock_code}: {e}")
+
+def get_daily_bar_amounts(stock_codes=None, start_date=None, end_date=None):
+    """读取本地日线中的每日成交额（成交额与复权方式无关，多种复权取任意一份），列为 stock_code、trade_date、amount"""
+    conn = get_history_connection()
+    conditions, params = ["trade_date >= ?", "trade_date <= ?", "amount IS NOT NULL"], [start_date or '', end_date or '9999-12-31']
+    if stock_codes is not None:
+        stock_codes = list(stock_codes)
+        if not stock_codes:
+            return pd.DataFrame(columns=['stock_code', 'trade_date', 'amount'])
+        conditions.append(f"stock_code IN ({', '.join('?' * len(stock_codes))})")
+        params.extend(stock_codes)
+    return pd.read_sql(
+        f"SELECT stock_code, trade_date, MAX(amount) AS amount FROM daily_bars "
+        f"WHERE {' AND '.join(conditions)} GROUP BY stock_code, trade_date",
+        conn, params=params
+    )
+
+def get_daily_bar_coverage(stock_code, adjust):
+    """读取已抓取的日期范围，返回 (start_date, final_through)，没有记录时返回 (None, None)"""
+    conn = get_history_connection()
+    row = conn.execute("SELECT start_date, final_through FROM daily_bar_coverage WHERE stock_code = ? AND adjust = ?",
+                       (stock_code, adjust)).fetchone()
+    return (row[0], row[1] or None) if row else (None, None)
+
+# --- 逐只股票资金流历史 (回测历史数据库) ---
+FUND_FLOW_HISTORY_COLUMNS = ['close', 'pct_change', 'main_net', 'main_ratio', 'super_large_net', 'super_large_ratio',
+                             'large_net', 'large_ratio', 'medium_net', 'medium_ratio', 'small_net', 'small_ratio']
+
+def _upsert_fund_flow_history(df_history, fetched_at=None):
+    """
+    写入资金流历史：新日期直接插入，已有的未定稿数据被覆盖，已定稿 (is_final=1) 的不再改写
+    :param df_history: 列为 stock_code、trade_date + FUND_FLOW_HISTORY_COLUMNS + is_final 的DataFrame
+    :return: 实际写入（插入或覆盖）的行数
+    """
+    if df_history.empty:
+        return 0
+    conn = get_history_connection()
+    fetched_at = fetched_at or datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    columns = ['stock_code', 'trade_date'] + FUND_FLOW_HISTORY_COLUMNS + ['is_final']
+    rows = df_history[columns].astype(object).where(df_history[columns].notna(), None)
+    updates = ", ".join(f"{col} = excluded.{col}" for col in columns[2:] + ['fetched_at'])
+    before = conn.total_changes
+    conn.executemany(
+        f"INSERT INTO fund_flow_history ({', '.join(columns)}, fetched_at) "
+        f"VALUES ({', '.join('?' * len(columns))}, ?) "
+        f"ON CONFLICT (stock_code, trade_date) DO UPDATE SET {updates} WHERE fund_flow_history.is_final = 0",
+        [(*row, fetched_at) for row in rows.itertuples(index=False, name=None)]
+    )
+    conn.commit()
+    return conn.total_changes - before
+
+def save_fund_flow_history(stock_code, df_history, fetched_at=None):
+    """
+    写入某只股票的资金流历史（已定稿的日期不再改写，未定稿的当日数据被新数据覆盖）
+
+    :param df_history: 列为 trade_date + FUND_FLOW_HISTORY_COLUMNS + is_final 的DataFrame
+    :param fetched_at: 抓取时间，默认当前时间
+    :return: 写入的行数
+    """
+    try:
+        return _upsert_fund_flow_history(df_history.assign(stock_code=stock_code), fetched_at)
+    except Exception as e:
+        get_history_connection().rollback()
+        print(f"保存资金流历史失败 {stock_code}: {e}")
+        return 0
+
+def save_fund_flow_history_snapshot(df_history, fetched_at=None):
+    """
+    写入全市场某一交易日的资金流截面（每只股票一行，规则同 save_fund_flow_history）
+
+    :param df_history: 列为 stock_code、trade_date + FUND_FLOW_HISTORY_COLUMNS + is_final 的DataFrame
+    :return: 写入的行数
+    """
+    try:
+        return _upsert_fund_flow_history(df_history, fetched_at)
+    except Exception as e:
+        get_history_connection().rollback()
+        print(f"保存资金流历史截面失败: {e}")
+        return 0
+
+def get_fund_flow_history(stock_codes=None, start_date=None, end_date=None):
+    """
+    读取资金流历史（按股票代码、日期升序）
+
+    :param stock_codes: 股票代码列表，None 表示全部
+    :param start_date: 起始日期 'YYYY-MM-DD'（含）
+    :param end_date: 结束日期 'YYYY-MM-DD'（含）
+    :return: 列为 stock_code、trade_date、FUND_FLOW_HISTORY_COLUMNS、is_final 的DataFrame
+    """
+    conn = get_history_connection()
+    conditions, params = ["trade_date >= ?", "trade_date <= ?"], [start_date or '', end_date or '9999-12-31']
+    if stock_codes is not None:
+        stock_codes = list(stock_codes)
+        if not stock_codes:
+            return pd.DataFrame(columns=['stock_code', 'trade_date'] + FUND_FLOW_HISTORY_COLUMNS + ['is_final'])
+        conditions.append(f"stock_code IN ({', '.join('?' * len(stock_codes))})")
+        params.extend(stock_codes)
+    columns_sql = ", ".join(['stock_code', 'trade_date'] + FUND_FLOW_HISTORY_COLUMNS + ['is_final'])
+    return pd.read_sql(
+        f"SELECT {columns_sql} FROM fund_flow_history WHERE {' AND '.join(conditions)} ORDER BY stock_code, trade_date",
+        conn, params=params
+    )
 
 def get_stock_trade_date():
-    """获取有效的交易日期（如果是周末则返回上周五）"""
-    now = datetime.now()
-    weekday = now.weekday() # 0=周一, 6=周日
-    
-    if weekday == 5: # 周六
-        trade_date = now - timedelta(days=1)
-    elif weekday == 6: # 周日
-        trade_date = now - timedelta(days=2)
-    else:
-        trade_date = now
-        
-    return trade_date.strftime("%Y-%m-%d")
+    """获取当前行情数据所属的交易日（开盘前、周末和节假日返回上一个交易日，见 trade_calendar）"""
+    return trade_calendar.current_trade_date()
+
+# 原始数据快照的列定义（列名, SQLite类型），按列存储，读取时整表直接还原为DataFrame
+RAW_SNAPSHOT_COLUMNS = [
+    ('股票代码', 'TEXT'),
+    ('股票简称', 'TEXT'),
+    ('最新价', 'REAL'),
+    ('涨跌幅', 'REAL'),
+    ('换手率', 'REAL'),
+    ('净额', 'REAL'),
+    ('成交额', 'REAL'),
+    ('流入资金', 'REAL'),
+    ('流出资金', 'REAL'),
+    ('资金流入净额', 'REAL'),
+    ('连续换手率', 'REAL'),
+    ('阶段涨跌幅', 'REAL'),
+]
+
+def _create_raw_snapshot_table(conn):
+    """创建按列存储的原始数据快照表"""
+    columns_sql = ",\n".join(f'"{col}" {col_type}' for col, col_type in RAW_SNAPSHOT_COLUMNS)
+    conn.execute(f'''CREATE TABLE IF NOT EXISTS raw_fund_flow_snapshot (
+                        period_type TEXT,
+                        cache_date TEXT,
+                        {columns_sql},
+                        PRIMARY KEY (period_type, cache_date, "股票代码")
+                    )''')
 
-def save_raw_fund_flow_cache(df, period):
+def _to_snapshot_frame(df):
+    """整列转换为快照表的类型：百分比字符串('3.5%')转为数值，缺失列补空"""
+    df_save = pd.DataFrame(index=df.index)
+    for col, col_type in RAW_SNAPSHOT_COLUMNS:
+        if col not in df.columns:
+            df_save[col] = None
+            continue
+        values = df[col]
+        if col_type == 'TEXT':
+            df_save[col] = values.astype(str).where(values.notna(), None)
+        elif pd.api.types.is_numeric_dtype(values):
+            df_save[col] = values
+        else:
+            df_save[col] = pd.to_numeric(values.astype(str).str.rstrip('%'), errors='coerce')
+    return df_save
+
+def _record_snapshot_time(conn, period, trade_date, fetched_at=None):
+    """记录快照的获取时间（与快照写入在同一事务中）"""
+    fetched_at = fetched_at or datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    conn.execute('''INSERT OR REPLACE INTO fund_flow_snapshot_meta (cache_date, period_type, fetched_at)
+                    VALUES (?, ?, ?)''', (trade_date, period, fetched_at))
+
+# 快照按版本写入: 新版本完整写入并提交后，再在一个事务内把 snapshot_pointer 指向新版本；
+# 读取时在同一条语句中取当前版本，读到的始终是某个完整版本，写入中途或写入失败都不会读到空缓存
+_CURRENT_VERSION_SQL = "(SELECT version FROM snapshot_pointer WHERE table_name = ? AND cache_date = ? AND period_type = ?)"
+
+def _new_snapshot_version():
+    """新快照的版本号（微秒时间戳，后开始写入的版本号更大）"""
+    return time.time_ns() // 1000
+
+def _publish_snapshot(conn, table, period, trade_date, version, record_time=False):
+    """
+    切换当前版本指针到已写入的新版本（只前进不后退，并发写入时以较新的版本为准），再清理旧版本
+
+    :param record_time: 同一事务内记录快照获取时间
+    :return: 是否切换到了该版本
+    """
+    cursor = conn.execute('''INSERT INTO snapshot_pointer (table_name, cache_date, period_type, version)
+                             VALUES (?, ?, ?, ?)
+                             ON CONFLICT (table_name, cache_date, period_type)
+                             DO UPDATE SET version = excluded.version WHERE excluded.version > snapshot_pointer.version''',
+                          (table, trade_date, period, version))
+    published = cursor.rowcount > 0
+    if published and record_time:
+        _record_snapshot_time(conn, period, trade_date)
+    conn.commit()
+    _prune_snapshot_versions(conn, table, period, trade_date)
+    return published
+
+def _prune_snapshot_versions(conn, table, period, trade_date, keep=None):
+    """删除不再需要的旧版本：保留当前版本及之前最近的 keep - 1 个版本，比当前版本新的（正在写入的）不动"""
+    keep = keep or config.SNAPSHOT_KEEP_VERSIONS
+    try:
+        versions = conn.execute(
+            f"SELECT DISTINCT version FROM {table} WHERE period_type = ? AND cache_date = ? "
+            f"AND version <= {_CURRENT_VERSION_SQL} ORDER BY version DESC LIMIT ?",
+            (period, trade_date, table, trade_date, period, keep)).fetchall()
+        if len(versions) == keep:
+            conn.execute(f"DELETE FROM {table} WHERE period_type = ? AND cache_date = ? AND version < ?",
+                         (period, trade_date, versions[-1][0]))
+            conn.commit()
+    except Exception as e:
+        conn.rollback()
+        print(f"清理旧版本快照失败: {e}")
+
+def get_fund_flow_snapshot_time(period):
+    """当前交易日某个周期的快照获取时间，没有记录时返回 None"""
+    conn = get_connection()
+    row = conn.execute("SELECT fetched_at FROM fund_flow_snapshot_meta WHERE cache_date = ? AND period_type = ?",
+                       (get_stock_trade_date(), period)).fetchone()
+    return row[0] if row else None
+
+def save_raw_fund_flow_cache(df, period, storage=None):
     """
     保存原始资金流数据到数据库（不包含任何计算字段）
 
+    :param df: 原始数据DataFrame
+    :param period: 周期类型
+    :param storage: 'columnar' 按列存储 / 'json' 旧版逐行JSON，默认取 config.RAW_CACHE_STORAGE
+    """
+    storage = storage or config.RAW_CACHE_STORAGE
+    if storage == 'json':
+        return save_raw_fund_flow_cache_json(df, period)
+
+    if df.empty or '股票代码' not in df.columns:
+        return
+
+    conn = get_connection()
+    try:
+        trade_date = get_stock_trade_date()
+
+        df_save = _to_snapshot_frame(df)
+        df_save = df_save[df_save['股票代码'].notna() & (df_save['股票代码'] != '')]
+        df_save = df_save.drop_duplicates(subset=['股票代码'], keep='first')
+        version = _new_snapshot_version()
+        df_save.insert(0, 'version', version)
+        df_save.insert(0, 'cache_date', trade_date)
+        df_save.insert(0, 'period_type', period)
+        # NaN 转为 NULL，整表一次性批量写入
+        df_save = df_save.astype(object).where(df_save.notna(), None)
+
+        placeholders = ", ".join("?" * len(df_save.columns))
+        columns_sql = ", ".join(f'"{col}"' for col in df_save.columns)
+        # 写入新版本（切换前读取方仍读旧版本），再切换当前版本
+        conn.executemany(f"INSERT INTO raw_fund_flow_snapshot ({columns_sql}) VALUES ({placeholders})",
+                         df_save.itertuples(index=False, name=None))
+        conn.commit()
+        _publish_snapshot(conn, 'raw_fund_flow_snapshot', period, trade_date, version, record_time=True)
+        print(f"[原始数据] 已保存 {len(df_save)} 只股票的原始数据到数据库")
+
+    except Exception as e:
+        conn.rollback()
+        print(f"保存原始数据失败: {e}")
+
+def get_raw_fund_flow_cache(period, storage=None):
+    """
+    读取原始资金流数据（不包含计算字段）
+
+    :param period: 周期类型
+    :param storage: 'columnar' / 'json'，默认取 config.RAW_CACHE_STORAGE
+    :return: 原始数据DataFrame
+    """
+    storage = storage or config.RAW_CACHE_STORAGE
+    if storage == 'json':
+        return get_raw_fund_flow_cache_json(period)
+
+    date_str = get_stock_trade_date()
+    conn = get_connection()
+    try:
+        columns_sql = ", ".join(f'"{col}"' for col, _ in RAW_SNAPSHOT_COLUMNS)
+        df = pd.read_sql(f"SELECT {columns_sql} FROM raw_fund_flow_snapshot "
+                         f"WHERE period_type = ? AND cache_date = ? AND version = {_CURRENT_VERSION_SQL}",
+                         conn, params=(period, date_str, 'raw_fund_flow_snapshot', date_str, period))
+    except Exception as e:
+        print(f"读取原始数据失败: {e}")
+        df = pd.DataFrame()
+
+    if df.empty:
+        # 兼容升级前当天已保存的JSON格式数据
+        return get_raw_fund_flow_cache_json(period)
+
+    # 不同周期返回的字段不同（如N日排行没有 流入资金），整列为空的字段去掉，与接口原始返回保持一致
+    return df.dropna(axis=1, how='all')
+
+def save_raw_fund_flow_cache_json(df, period):
+    """
+    保存原始资金流数据到数据库（旧版格式：每只股票一行JSON）
+
     :param df: 原始数据DataFrame
     :param period: 周期类型
     """
@@ -208,15 +770,7 @@ def save_raw_fund_flow_cache(df, period):
 
     conn = get_connection()
     try:
-        # 创建原始数据表（如果不存在）
         cursor = conn.cursor()
-        cursor.execute('''CREATE TABLE IF NOT EXISTS raw_fund_flow_cache (
-                            stock_code TEXT,
-                            period_type TEXT,
-                            cache_date TEXT,
-                            data_json TEXT,
-                            PRIMARY KEY (stock_code, period_type, cache_date)
-                        )''')
 
         # 使用交易日日期
         trade_date = get_stock_trade_date()
@@ -230,11 +784,8 @@ def save_raw_fund_flow_cache(df, period):
         if '序号' in df_save.columns:
             df_save = df_save.drop(columns=['序号'])
 
-        # 删除同日期的旧数据
-        conn.execute("DELETE FROM raw_fund_flow_cache WHERE period_type = ? AND cache_date = ?", (period, trade_date))
-        conn.commit()
-
-        # 逐行保存为JSON
+        # 逐行保存为JSON（写入新版本，切换前读取方仍读旧版本）
+        version = _new_snapshot_version()
         data_to_save = []
         for _, row in df_save.iterrows():
             stock_code = str(row.get('股票代码', ''))
@@ -245,25 +796,24 @@ def save_raw_fund_flow_cache(df, period):
             row_dict = row.to_dict()
             row_json = json.dumps(row_dict, ensure_ascii=False, default=str)
 
-            data_to_save.append((stock_code, period, trade_date, row_json))
+            data_to_save.append((stock_code, period, trade_date, version, row_json))
 
         # 批量插入
         cursor.executemany(
-            "INSERT INTO raw_fund_flow_cache (stock_code, period_type, cache_date, data_json) VALUES (?, ?, ?, ?)",
+            "INSERT INTO raw_fund_flow_cache (stock_code, period_type, cache_date, version, data_json) VALUES (?, ?, ?, ?, ?)",
             data_to_save
         )
-
         conn.commit()
+        _publish_snapshot(conn, 'raw_fund_flow_cache', period, trade_date, version, record_time=True)
         print(f"[原始数据] 已保存 {len(data_to_save)} 只股票的原始数据到数据库")
 
     except Exception as e:
+        conn.rollback()
         print(f"保存原始数据失败: {e}")
-    finally:
-        conn.close()
 
-def get_raw_fund_flow_cache(period):
+def get_raw_fund_flow_cache_json(period):
     """
-    读取原始资金流数据（不包含计算字段）
+    读取旧版JSON格式的原始资金流数据（逐行解析JSON）
 
     :param period: 周期类型
     :return: 原始数据DataFrame
@@ -271,14 +821,10 @@ def get_raw_fund_flow_cache(period):
     date_str = get_stock_trade_date()
     conn = get_connection()
     try:
-        # 检查表是否存在
         cursor = conn.cursor()
-        cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='raw_fund_flow_cache'")
-        if not cursor.fetchone():
-            return pd.DataFrame()
-
-        query = "SELECT stock_code, data_json FROM raw_fund_flow_cache WHERE period_type = ? AND cache_date = ?"
-        cursor.execute(query, (period, date_str))
+        query = ("SELECT stock_code, data_json FROM raw_fund_flow_cache "
+                 f"WHERE period_type = ? AND cache_date = ? AND version = {_CURRENT_VERSION_SQL}")
+        cursor.execute(query, (period, date_str, 'raw_fund_flow_cache', date_str, period))
         rows = cursor.fetchall()
 
         if not rows:
@@ -307,8 +853,6 @@ def get_raw_fund_flow_cache(period):
     except Exception as e:
         print(f"读取原始数据失败: {e}")
         return pd.DataFrame()
-    finally:
-        conn.close()
 
 def save_fund_flow_cache(df, period):
     """保存资金流数据到缓存表"""
@@ -334,8 +878,10 @@ def save_fund_flow_cache(df, period):
         # 使用交易日日期而非自然日
         trade_date = get_stock_trade_date()
         
+        version = _new_snapshot_version()
         df_save['period_type'] = period
         df_save['cache_date'] = trade_date
+        df_save['version'] = version
         
         # 0. 去重：确保同一天同一周期下，股票代码唯一
         if 'stock_code' in df_save.columns:
@@ -351,63 +897,210 @@ def save_fund_flow_cache(df, period):
         valid_cols = [c for c in df_save.columns if c in db_cols]
         df_save = df_save[valid_cols]
         
-        # 删除同日期的旧数据，避免重复
-        conn.execute("DELETE FROM fund_flow_cache WHERE period_type = ? AND cache_date = ?", (period, trade_date))
-        conn.commit()
-        
-        # 保存到数据库
+        # 保存到数据库（写入新版本，切换前读取方仍读旧版本），再切换当前版本
         # if_exists='append' 因为我们可能存不同period的数据在同一张表
         df_save.to_sql('fund_flow_cache', conn, if_exists='append', index=False)
+        conn.commit()
+        _publish_snapshot(conn, 'fund_flow_cache', period, trade_date, version)
     except Exception as e:
+        conn.rollback()
         print(f"数据库保存失败: {e}")
-    finally:
-        conn.close()
 
 def get_fund_flow_cache(period):
     """读取当天的资金流缓存"""
     date_str = get_stock_trade_date()
     conn = get_connection()
     try:
-        # 检查表是否存在
-        cursor = conn.cursor()
-        cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='fund_flow_cache'")
-        if not cursor.fetchone():
-            return pd.DataFrame()
+        query = f"SELECT * FROM fund_flow_cache WHERE period_type = ? AND cache_date = ? AND version = {_CURRENT_VERSION_SQL}"
+        df = pd.read_sql(query, conn, params=(period, date_str, 'fund_flow_cache', date_str, period))
 
-        query = "SELECT * FROM fund_flow_cache WHERE period_type = ? AND cache_date = ?"
-        df = pd.read_sql(query, conn, params=(period, date_str))
-        
         # 清理辅助列 并 恢复列名
         if not df.empty:
             if 'period_type' in df.columns:
                 del df['period_type']
             if 'cache_date' in df.columns:
                 del df['cache_date']
+            if 'version' in df.columns:
+                del df['version']
             if 'stock_code' in df.columns:
                 df = df.rename(columns={'stock_code': '股票代码'})
         return df
     except Exception as e:
         print(f"数据库读取失败: {e}")
         return pd.DataFrame()
-    finally:
-        conn.close()
 
-def clean_old_data(days=7):
-    """清理过期数据"""
+MAIN_FORCE_COLUMNS = ['超大单净额', '大单净额', '主力净流入']
+# 抓取时的即时排行成交额/净额（变化驱动刷新的比较基准）: DataFrame列名 -> 表列名
+MAIN_FORCE_BASIS_COLUMNS = {'基准成交额': 'basis_amount', '基准净额': 'basis_net'}
+
+def _create_main_force_table(conn):
+    """创建主力资金流缓存表，并为旧表补充抓取时间/状态列"""
+    conn.execute('''CREATE TABLE IF NOT EXISTS main_force_cache (
+                        stock_code TEXT PRIMARY KEY,
+                        cache_date TEXT,
+                        超大单净额 REAL,
+                        大单净额 REAL,
+                        主力净流入 REAL,
+                        fetched_at TEXT,
+                        status TEXT
+                    )''')
+    existing = [info[1] for info in conn.execute("PRAGMA table_info(main_force_cache)").fetchall()]
+    for col in ['fetched_at', 'status']:
+        if col not in existing:
+            conn.execute(f"ALTER TABLE main_force_cache ADD COLUMN {col} TEXT")
+
+def save_main_force_cache(df, status='ok', fetched_at=None):
+    """
+    按股票逐只写入（覆盖）主力资金流缓存，记录抓取时间和状态
+
+    :param df: 包含 股票代码 及主力资金流列的DataFrame（失败记录可只有 股票代码），
+               可带 基准成交额、基准净额（抓取时即时排行中的值）
+    :param status: 'ok' 成功 / 'empty' 接口无数据 / 'failed' 重试后仍失败
+    :param fetched_at: 抓取时间，默认当前时间
+    """
+    if df.empty:
+        return
+
+    conn = get_connection()
+    try:
+        trade_date = get_stock_trade_date()
+        fetched_at = fetched_at or datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+        data_to_save = []
+        for record in df.to_dict('records'):
+            values = [record.get(col) for col in MAIN_FORCE_COLUMNS + list(MAIN_FORCE_BASIS_COLUMNS)]
+            values = [None if v is None or pd.isna(v) else float(v) for v in values]
+            data_to_save.append((str(record['股票代码']), trade_date, *values, fetched_at, status))
+
+        conn.executemany('''INSERT OR REPLACE INTO main_force_cache
+                              (stock_code, cache_date, 超大单净额, 大单净额, 主力净流入, basis_amount, basis_net,
+                               fetched_at, status)
+                              VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)''', data_to_save)
+        conn.commit()
+    except Exception as e:
+        conn.rollback()
+        print(f"[缓存保存] 主力资金流缓存保存失败: {e}")
+
+def get_main_force_cache(trade_date=None):
+    """
+    读取某个交易日的主力资金流缓存（含抓取时间和状态）
+
+    :return: DataFrame，列为 股票代码、超大单净额、大单净额、主力净流入、基准成交额、基准净额、fetched_at、status
+    """
+    trade_date = trade_date or get_stock_trade_date()
     conn = get_connection()
+    try:
+        df = pd.read_sql(
+            "SELECT stock_code, 超大单净额, 大单净额, 主力净流入, basis_amount, basis_net, fetched_at, status "
+            "FROM main_force_cache WHERE cache_date = ?",
+            conn, params=(trade_date,)
+        )
+        df = df.rename(columns={'stock_code': '股票代码', **{v: k for k, v in MAIN_FORCE_BASIS_COLUMNS.items()}})
+        # 旧版本写入的数据没有状态列，视为成功
+        df['status'] = df['status'].fillna('ok')
+        return df
+    except Exception as e:
+        print(f"[缓存读取] 主力资金流缓存读取失败: {e}")
+        return pd.DataFrame()
+
+# 需要按日期清理的缓存表: (表名, 日期列)，日期列均有索引
+RETENTION_TABLES = [
+    ('fund_flow_cache', 'cache_date'),
+    ('raw_fund_flow_snapshot', 'cache_date'),
+    ('raw_fund_flow_cache', 'cache_date'),
+    ('main_force_cache', 'cache_date'),
+    ('fund_flow_snapshot_meta', 'cache_date'),
+    ('snapshot_pointer', 'cache_date'),
+]
+
+def clean_old_data(days=None, batch_size=None, vacuum_pages=None):
+    """
+    清理所有缓存表中的过期数据
+
+    按日期索引分批删除（每批一个短事务，不长时间占用写锁），
+    删除后用 incremental_vacuum 回收部分空闲页，而不是重写整个数据库文件
+
+    :param days: 保留天数，默认 config.CACHE_RETENTION_DAYS
+    :param batch_size: 每批删除的行数，默认 config.RETENTION_BATCH_SIZE
+    :param vacuum_pages: 本次最多回收的空闲页数，默认 config.RETENTION_VACUUM_PAGES
+    :return: {表名: 删除行数}
+    """
+    days = days if days is not None else config.CACHE_RETENTION_DAYS
+    batch_size = batch_size or config.RETENTION_BATCH_SIZE
+    vacuum_pages = vacuum_pages if vacuum_pages is not None else config.RETENTION_VACUUM_PAGES
     cutoff_date = (datetime.now() - timedelta(days=days)).strftime("%Y-%m-%d")
+
+    conn = get_connection()
+    deleted = {}
     try:
-        # 检查表是否存在
-        cursor = conn.cursor()
-        cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='fund_flow_cache'")
-        if cursor.fetchone():
-            conn.execute("DELETE FROM fund_flow_cache WHERE cache_date < ?", (cutoff_date,))
-            conn.commit()
-            conn.execute("VACUUM")
+        for table, date_col in RETENTION_TABLES:
+            deleted[table] = 0
+            while True:
+                cursor = conn.execute(
+                    f"DELETE FROM {table} WHERE rowid IN "
+                    f"(SELECT rowid FROM {table} WHERE {date_col} < ? LIMIT ?)",
+                    (cutoff_date, batch_size)
+                )
+                conn.commit()
+                deleted[table] += cursor.rowcount
+                if cursor.rowcount < batch_size:
+                    break
+
+        if conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2:
+            conn.execute(f"PRAGMA incremental_vacuum({int(vacuum_pages)})")
     except Exception as e:
+        conn.rollback()
         print(f"数据库清理失败: {e}")
-    finally:
-        conn.close()
+
+    total = sum(deleted.values())
+    if total:
+        detail = ", ".join(f"{table} {count}行" for table, count in deleted.items() if count)
+        print(f"[数据清理] 已删除 {cutoff_date} 之前的缓存数据: {detail}")
+    return deleted
+
+def enable_incremental_vacuum():
+    """
+    把旧数据库切换为增量回收模式（新建的数据库已是该模式）
+
+    需要执行一次整库 VACUUM 才能生效：耗时与数据库大小成正比，期间阻塞其他进程的读写，
+    应在 main.py / app.py 都未运行时手动执行一次
+    :return: 是否执行了转换
+    """
+    conn = get_connection()
+    if conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2:
+        return False
+    print("[数据清理] 切换为增量回收模式，执行一次 VACUUM ...")
+    conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+    conn.execute("VACUUM")
+    return True
+
+def run_retention_if_due(force=False):
+    """
+    按计划执行过期数据清理：距上次清理不足 config.RETENTION_INTERVAL_HOURS 小时则跳过
+
+    :param force: 忽略计划时间，立即执行
+    :return: 本次执行时返回 {表名: 删除行数}，跳过时返回 None
+    """
+    conn = get_connection()
+    now = datetime.now()
+    row = conn.execute("SELECT last_run_at FROM maintenance_state WHERE task = 'retention'").fetchone()
+    if not force and row and row[0]:
+        last_run = datetime.strptime(row[0], "%Y-%m-%d %H:%M:%S")
+        if now - last_run < timedelta(hours=config.RETENTION_INTERVAL_HOURS):
+            return None
+
+    # 旧数据库转换需要整库 VACUUM，只在显式开启时执行
+    if config.RETENTION_CONVERT_TO_INCREMENTAL:
+        try:
+            enable_incremental_vacuum()
+        except Exception as e:
+            print(f"[数据清理] 切换增量回收模式失败: {e}")
+
+    deleted = clean_old_data()
+    conn.execute("INSERT OR REPLACE INTO maintenance_state (task, last_run_at) VALUES ('retention', ?)",
+                 (now.strftime("%Y-%m-%d %H:%M:%S"),))
+    conn.commit()
+    return deleted
 
 # --- Watchlist Operations ---
 def get_watchlist():
@@ -417,8 +1110,6 @@ def get_watchlist():
         return df['stock_code'].tolist()
     except:
         return []
-    finally:
-        conn.close()
 
 def update_watchlist(codes):
     """全量更新自选股列表"""
@@ -430,6 +1121,5 @@ def update_watchlist(codes):
             conn.executemany("INSERT INTO watchlist (stock_code) VALUES (?)", data)
         conn.commit()
     except Exception as e:
+        conn.rollback()
         print(f"自选股更新失败: {e}")
-    finally:
-        conn.close()
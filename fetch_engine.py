@@ -0,0 +1,232 @@
+# 并发抓取引擎: 自适应令牌桶限速 + 失败重试 + 有界并发窗口
+# akshare 的接口都是阻塞调用，这里用有界线程池实现并发，由令牌桶统一控制请求速率
+
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed, TimeoutError as FuturesTimeoutError
+from threading import Lock
+
+import config
+
+
+class BadDataError(Exception):
+    """接口有响应但数据无法解析（缺列、格式变化等），重试无意义，也不代表接口限流"""
+
+
+class AdaptiveRateLimiter:
+    """
+    自适应令牌桶限速器 (AIMD)
+
+    - 令牌按当前速率匀速补充，每次请求消耗一个令牌
+    - 请求成功且响应不慢: 加性增速（约每秒 +increase 个请求/秒）
+    - 请求失败或响应变慢: 乘性降速（速率 * decrease），同一拥塞周期内只降一次
+    多个线程共享同一个限速器，线程安全。
+    """
+
+    def __init__(self, initial_rate=None, min_rate=None, max_rate=None,
+                 increase=None, decrease=None, latency_target=None, burst=None):
+        self.min_rate = min_rate if min_rate is not None else config.FETCH_MIN_RATE
+        self.max_rate = max_rate if max_rate is not None else config.FETCH_MAX_RATE
+        self.increase = increase if increase is not None else config.FETCH_RATE_INCREASE
+        self.decrease = decrease if decrease is not None else config.FETCH_RATE_DECREASE
+        self.latency_target = latency_target if latency_target is not None else config.FETCH_LATENCY_TARGET
+        self.burst = burst if burst is not None else config.FETCH_BURST_SECONDS
+
+        rate = initial_rate if initial_rate is not None else config.FETCH_INITIAL_RATE
+        self.rate = min(max(rate, self.min_rate), self.max_rate)
+        self._tokens = 1.0
+        self._last_refill = time.monotonic()
+        self._last_decrease = 0.0
+        self._lock = Lock()
+
+    def _capacity(self):
+        return max(1.0, self.rate * self.burst)
+
+    def _refill(self, now):
+        elapsed = now - self._last_refill
+        self._tokens = min(self._capacity(), self._tokens + elapsed * self.rate)
+        self._last_refill = now
+
+    def acquire(self, deadline=None):
+        """
+        阻塞直到拿到一个令牌
+        :param deadline: time.monotonic() 截止时间，超时返回 False
+        """
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._refill(now)
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return True
+                wait = (1 - self._tokens) / self.rate
+
+            if deadline is not None and now + wait > deadline:
+                return False
+            time.sleep(wait)
+
+    def on_success(self, latency):
+        """请求成功后反馈响应耗时"""
+        if latency > self.latency_target:
+            self._decrease_rate()
+            return
+        with self._lock:
+            self.rate = min(self.max_rate, self.rate + self.increase / self.rate)
+
+    def on_error(self):
+        """请求失败（超时/限流/连接错误）后反馈"""
+        self._decrease_rate()
+
+    def _decrease_rate(self):
+        with self._lock:
+            now = time.monotonic()
+            # 同一拥塞周期（约一个请求间隔，至少1秒）内只降速一次，避免一批失败把速率打到底
+            if now - self._last_decrease < max(1.0, 1.0 / self.rate):
+                return
+            self._last_decrease = now
+            self.rate = max(self.min_rate, self.rate * self.decrease)
+            self._tokens = min(self._tokens, self._capacity())
+
+
+class FetchStats:
+    """一次批量抓取的统计信息"""
+
+    def __init__(self, total):
+        self.total = total
+        self.requests = 0      # 实际发出的请求数（含重试）
+        self.succeeded = 0
+        self.failed = 0
+        self.retries = 0
+        self.timed_out = []    # 截止时间前未完成的键
+        self.start_time = time.monotonic()
+        self.end_time = None
+        self.final_rate = None
+
+    @property
+    def elapsed(self):
+        end = self.end_time if self.end_time is not None else time.monotonic()
+        return max(end - self.start_time, 1e-9)
+
+    @property
+    def requests_per_second(self):
+        """实际达到的请求速率"""
+        return self.requests / self.elapsed
+
+    def summary(self):
+        timed_out = f" | 超时 {len(self.timed_out)}" if self.timed_out else ""
+        return (f"成功 {self.succeeded}/{self.total} | 失败 {self.failed}{timed_out} | 重试 {self.retries}次 | "
+                f"耗时 {self.elapsed:.1f}秒 | 实际速率 {self.requests_per_second:.1f}请求/秒 | "
+                f"最终限速 {self.final_rate:.1f}请求/秒")
+
+
+def backoff_delay(attempt, base=None, cap=None):
+    """第 attempt 次重试前的等待时间（指数退避 + 全抖动）"""
+    base = base if base is not None else config.FETCH_BACKOFF_BASE
+    cap = cap if cap is not None else config.FETCH_BACKOFF_MAX
+    return random.uniform(0, min(cap, base * (2 ** attempt)))
+
+
+def fetch_batch(items, fetch_func, limiter: AdaptiveRateLimiter = None, max_in_flight: int = None,
+                max_retries: int = None, label: str = '', on_result=None, show_progress: bool = True,
+                deadline: float = None):
+    """
+    并发批量抓取
+
+    :param items: 待抓取的键列表（如股票代码）
+    :param fetch_func: fetch_func(item) -> 结果；抛出异常视为请求失败（会重试并降速），
+                       抛出 BadDataError 视为数据异常（记为失败，不重试也不降速），返回 None 视为无数据（不重试）
+    :param limiter: 共享的限速器，默认新建一个
+    :param max_in_flight: 同时进行中的请求上限
+    :param max_retries: 单个键的最大重试次数
+    :param label: 进度输出的名称
+    :param on_result: 每拿到一个结果时的回调 on_result(item, result)，在调用 fetch_batch 的线程中按完成顺序调用
+    :param show_progress: 是否打印进度
+    :param deadline: time.monotonic() 截止时间，到时不再等待未完成的键（记入 stats.timed_out，不算失败），
+                     已发出的请求在后台继续执行，结果不再收集
+    :return: (results, failed, stats)  results 为 {item: 结果}，failed 为重试后仍失败的键列表
+    """
+    items = list(items)
+    limiter = limiter or AdaptiveRateLimiter()
+    max_in_flight = max_in_flight or config.FETCH_MAX_IN_FLIGHT
+    max_retries = max_retries if max_retries is not None else config.FETCH_MAX_RETRIES
+
+    stats = FetchStats(len(items))
+    results = {}
+    failed = []
+    lock = Lock()
+    completed = [0]
+    expired = [False]
+
+    def fetch_one(item):
+        for attempt in range(max_retries + 1):
+            if expired[0] or not limiter.acquire(deadline):
+                return item, None, None
+            with lock:
+                stats.requests += 1
+                if attempt > 0:
+                    stats.retries += 1
+
+            start = time.monotonic()
+            try:
+                result = fetch_func(item)
+            except BadDataError:
+                # 请求本身成功，只是数据异常：按成功反馈限速器，不重试
+                limiter.on_success(time.monotonic() - start)
+                return item, None, False
+            except Exception:
+                limiter.on_error()
+                if attempt < max_retries:
+                    delay = backoff_delay(attempt)
+                    if deadline is not None and time.monotonic() + delay > deadline:
+                        return item, None, None
+                    time.sleep(delay)
+                    continue
+                return item, None, False
+
+            limiter.on_success(time.monotonic() - start)
+            return item, result, True
+
+    def report_progress():
+        current = completed[0]
+        if not show_progress or (current % 10 != 0 and current != stats.total):
+            return
+        progress = current / stats.total * 100
+        remaining = stats.elapsed / current * (stats.total - current)
+        print(f"\r{label}进度: {current}/{stats.total} ({progress:.1f}%) | 成功: {stats.succeeded} | "
+              f"速率: {stats.requests_per_second:.1f}请求/秒 (限速 {limiter.rate:.1f}) | "
+              f"预计剩余: {int(remaining // 60)}分{int(remaining % 60)}秒", end="", flush=True)
+
+    if items:
+        executor = ThreadPoolExecutor(max_workers=min(max_in_flight, len(items)))
+        futures = {executor.submit(fetch_one, item): item for item in items}
+        pending = set(futures)
+        timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+        try:
+            for future in as_completed(futures, timeout=timeout):
+                pending.discard(future)
+                item, result, ok = future.result()
+                with lock:
+                    completed[0] += 1
+                    if ok is None:
+                        stats.timed_out.append(item)
+                    elif ok and result is not None:
+                        results[item] = result
+                        stats.succeeded += 1
+                    elif not ok:
+                        failed.append(item)
+                        stats.failed += 1
+                    report_progress()
+                if on_result is not None and ok and result is not None:
+                    on_result(item, result)
+        except FuturesTimeoutError:
+            # 到达截止时间：未开始的任务直接取消，进行中的请求不再等待
+            expired[0] = True
+            stats.timed_out.extend(futures[future] for future in pending)
+        finally:
+            executor.shutdown(wait=not expired[0], cancel_futures=True)
+
+    stats.end_time = time.monotonic()
+    stats.final_rate = limiter.rate
+    if show_progress and items:
+        print()
+    return results, failed, stats
@@ -0,0 +1,165 @@
+# 多日主力资金流特征: 由本地资金流历史 (fund_flow_history) 按 日期 × 股票 面板向量化计算滚动特征
+# 任意窗口（2-60个交易日）的超大单/大单/主力净额之和、成交额之和和增仓占比，不再请求N日排行接口；
+# 增仓占比按 N日主力净额 / N日成交额 计算，不再用N日净额和即时成交额估算。
+# 每日成交额优先取本地日线（此时增仓占比精确）；没有日线的日期由两位小数的净占比反推，增仓占比为近似值
+# （反推成交额的相对误差约为 0.005 / 最大一档净占比(%)），实际成交额天数 列记录窗口内取自日线的天数。
+# N日排行的增仓占比优先使用这里的结果（见 rank_flow.apply_local_flow_ratio）
+
+import numpy as np
+import pandas as pd
+
+import config
+import database
+import trade_calendar
+
+# 资金流历史中的各档 (净额列, 净占比列)，净占比 = 净额 / 当日成交额 × 100
+TIER_COLUMNS = [
+    ('super_large_net', 'super_large_ratio'),
+    ('large_net', 'large_ratio'),
+    ('medium_net', 'medium_ratio'),
+    ('small_net', 'small_ratio'),
+]
+
+# 面板名 -> 输出列名
+FEATURE_COLUMNS = {
+    'super_large_net': '超大单净额',
+    'large_net': '大单净额',
+    'main_net': '主力净额',
+    'amount': '成交额',
+}
+
+
+def implied_amount(history: pd.DataFrame) -> np.ndarray:
+    """
+    由各档净额和净占比反推每日成交额
+    净占比只保留两位小数，取净占比绝对值最大的一档反推，相对舍入误差最小；各档净占比都为0时为空
+    """
+    nets = history[[net for net, _ in TIER_COLUMNS]].to_numpy(dtype=np.float64)
+    ratios = np.abs(history[[ratio for _, ratio in TIER_COLUMNS]].to_numpy(dtype=np.float64))
+    best = np.argmax(np.nan_to_num(ratios, nan=-1.0), axis=1)
+    rows = np.arange(len(history))
+    net, ratio = np.abs(nets[rows, best]), ratios[rows, best]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(ratio > 0, net / ratio * 100, np.nan)
+
+
+def build_panels(history: pd.DataFrame, amounts: pd.DataFrame = None) -> dict:
+    """
+    长表转换为 日期 × 股票 面板（行为交易日升序，列为股票代码）
+
+    :param history: database.get_fund_flow_history() 的结果
+    :param amounts: 每日成交额（stock_code、trade_date、amount），优先使用；缺失的日期由净占比反推（近似值）
+    :return: {'super_large_net' | 'large_net' | 'main_net' | 'amount' | 'amount_actual': DataFrame}，
+             amount_actual 为成交额是否取自日线（1/0）
+    """
+    history = history.copy()
+    history['main_net'] = history['super_large_net'] + history['large_net']
+    history['amount'] = implied_amount(history)
+    history['amount_actual'] = 0
+    if amounts is not None and not amounts.empty:
+        known = history[['stock_code', 'trade_date']].merge(amounts, on=['stock_code', 'trade_date'], how='left')['amount']
+        history['amount'] = known.fillna(history['amount']).to_numpy()
+        history['amount_actual'] = known.notna().astype(int).to_numpy()
+
+    dates = np.sort(history['trade_date'].unique())
+    panels = {}
+    for field in [*FEATURE_COLUMNS, 'amount_actual']:
+        panel = history.pivot(index='trade_date', columns='stock_code', values=field)
+        panels[field] = panel.reindex(dates)
+    return panels
+
+
+def rolling_features(panels: dict, window: int, min_periods: int = 1) -> dict:
+    """
+    对所有股票同时计算 window 个交易日的滚动特征（停牌等没有数据的日期按0计入）
+
+    :return: {'超大单净额' | '大单净额' | '主力净额' | '成交额' | '增仓占比' | '有效天数' | '实际成交额天数': 日期 × 股票 面板}
+             实际成交额天数 等于 有效天数 时增仓占比精确，否则为近似值
+    """
+    if window < 1:
+        raise ValueError(f"窗口长度必须为正整数: {window}")
+    features = {name: panels[field].rolling(window, min_periods=min_periods).sum()
+                for field, name in FEATURE_COLUMNS.items()}
+    features['有效天数'] = panels['main_net'].notna().astype(int).rolling(window, min_periods=1).sum()
+    features['实际成交额天数'] = panels['amount_actual'].fillna(0).rolling(window, min_periods=1).sum()
+    amount = features['成交额'].where(features['成交额'] != 0)
+    features['增仓占比'] = features['主力净额'] / amount * 100
+    return features
+
+
+def _check_windows(windows):
+    low, high = config.FLOW_FEATURE_MIN_WINDOW, config.FLOW_FEATURE_MAX_WINDOW
+    invalid = [w for w in windows if not low <= w <= high]
+    if invalid:
+        raise ValueError(f"窗口长度需在 {low}-{high} 个交易日之间: {invalid}")
+
+
+def _window_start(end_date: str, window: int) -> str:
+    """end_date 往前第 window 个交易日（含 end_date）"""
+    day = end_date if trade_calendar.is_trading_day(end_date) else trade_calendar.previous_trading_day(end_date)
+    for _ in range(window - 1):
+        day = trade_calendar.previous_trading_day(day)
+    return day
+
+
+def load_panels(max_window: int, stock_codes=None, end_date: str = None) -> dict:
+    """读取 end_date（默认最近已收盘交易日）之前 max_window 个交易日的资金流历史并构建面板"""
+    end_date = end_date or trade_calendar.last_closed_trade_date()
+    start_date = _window_start(end_date, max_window)
+    history = database.get_fund_flow_history(stock_codes, start_date, end_date)
+    amounts = database.get_daily_bar_amounts(stock_codes, start_date, end_date)
+    return build_panels(history, amounts)
+
+
+def _latest(features: dict, window: int) -> pd.DataFrame:
+    """取面板最后一个交易日的截面"""
+    if features['主力净额'].empty:
+        return pd.DataFrame(columns=['股票代码', '窗口', '截止日期', *features])
+    end_date = features['主力净额'].index[-1]
+    df = pd.DataFrame({name: panel.iloc[-1] for name, panel in features.items()})
+    df.index.name = '股票代码'
+    df = df.reset_index()
+    df.insert(1, '窗口', window)
+    df.insert(2, '截止日期', end_date)
+    return df
+
+
+def get_rolling_features(window: int, stock_codes=None, end_date: str = None, min_periods: int = 1) -> pd.DataFrame:
+    """
+    截至 end_date 的 window 日主力资金流特征（每只股票一行）
+
+    :param window: 交易日窗口长度，范围见 config.FLOW_FEATURE_MIN_WINDOW / FLOW_FEATURE_MAX_WINDOW
+    :param stock_codes: 股票代码列表，None 表示资金流历史中的全部股票
+    :param end_date: 截止日期 'YYYY-MM-DD'，默认最近已收盘交易日
+    :param min_periods: 窗口内至少有几天数据才计算，不足时为空
+    :return: 列为 股票代码、窗口、截止日期、超大单净额、大单净额、主力净额、成交额、增仓占比、有效天数、实际成交额天数
+    """
+    _check_windows([window])
+    panels = load_panels(window, stock_codes, end_date)
+    return _latest(rolling_features(panels, window, min_periods), window)
+
+
+def run_feature_job(windows=None, stock_codes=None, end_date: str = None) -> pd.DataFrame:
+    """
+    一次读取资金流历史，计算多个窗口的主力资金流特征
+
+    :param windows: 窗口长度列表，默认 config.FLOW_FEATURE_WINDOWS
+    :return: 各窗口结果纵向拼接（窗口 列区分）
+    """
+    windows = sorted(set(windows or config.FLOW_FEATURE_WINDOWS))
+    _check_windows(windows)
+
+    panels = load_panels(windows[-1], stock_codes, end_date)
+    frames = [_latest(rolling_features(panels, window), window) for window in windows]
+    result = pd.concat(frames, ignore_index=True)
+    print(f"[多日特征] {panels['main_net'].shape[1]} 只股票 × {len(panels['main_net'])} 个交易日，"
+          f"窗口 {', '.join(f'{w}日' for w in windows)}")
+    return result
+
+
+if __name__ == "__main__":
+    database.init_db()
+    features = run_feature_job()
+    for window, df in features.groupby('窗口'):
+        print(f"\n--- {window}日增仓占比 Top 10 ---")
+        print(df.sort_values('增仓占比', ascending=False).head(10).to_string(index=False))
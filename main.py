@@ -1,15 +1,21 @@
 import rank_flow as rf
 import pandas as pd
 import time
+from threading import Lock
 import config
 import predictor
 import database
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+# 多个周期并发处理时，整块输出结果表的锁
+_OUTPUT_LOCK = Lock()
 
 def process_and_save(period, sort_by, top_n=20, filename_prefix="排名"):
+    """获取、排名并保存单个周期的数据，返回排名结果（未获取到数据时返回 None）"""
     print(f"\n[{period}] 正在处理...")
     
-    # 1. 检查更新 & 读取数据
-    df = rf.get_fund_flow_data(period=period)
+    # 1. 检查更新 & 读取数据（分支定界只保证综合评分前列准确，其他排序方式抓取全部股票的主力资金流）
+    df = rf.get_fund_flow_data(period=period, prune=sort_by == 'comprehensive')
     
     if not df.empty:
         # 2. 排名/处理
@@ -25,31 +31,72 @@ def process_and_save(period, sort_by, top_n=20, filename_prefix="排名"):
         save_name = f"{filename_prefix}_{period}"
         formatted_df = rf.save_to_csv(ranked_df, save_name)
         
-        print(f"\n--- {period} Top {top_n} (按{sort_by}排序, 单位已格式化) ---")
-        if formatted_df is not None:
-            print(formatted_df)
-        else:
-            print(ranked_df)
-            
-        if '日排行' in period:
-            if sort_by == 'ratio':
-                print(f"*注: {period}增仓占比是基于换手率反推成交额估算得出，数值仅供参考。")
+        # 多个周期并发处理时，整块输出结果表，避免互相穿插
+        with _OUTPUT_LOCK:
+            print(f"\n--- {period} Top {top_n} (按{sort_by}排序, 单位已格式化) ---")
+            if formatted_df is not None:
+                print(formatted_df)
             else:
-                print(f"*注: 当前按资金净流入额排序。")
+                print(ranked_df)
+
+            if '日排行' in period:
+                if sort_by == 'ratio':
+                    print(f"*注: {period}增仓占比优先由本地资金流历史计算，历史或日线不完整的股票基于换手率反推成交额估算，数值仅供参考。")
+                else:
+                    print(f"*注: 当前按资金净流入额排序。")
 
         # 5. AI 智能预测 (仅对即时数据且配置开启时执行)
         if period == '即时' and config.ENABLE_PREDICTION:
             try:
                 pred_df = predictor.run_predictions(ranked_df, top_n=config.PREDICT_TOP_N)
                 if pred_df is not None:
-                    print("\n--- AI 智能预测结果 ---")
-                    print(pred_df)
+                    with _OUTPUT_LOCK:
+                        print("\n--- AI 智能预测结果 ---")
+                        print(pred_df)
                     rf.save_to_csv(pred_df, f"AI预测_{period}")
             except Exception as e:
                 print(f"智能预测执行出错: {e}")
 
-    else:
-        print(f"[{period}] 未获取到数据")
+        return ranked_df
+
+    print(f"[{period}] 未获取到数据")
+    return None
+
+def run_pipeline(periods=None, max_workers=None):
+    """
+    并发处理多个周期：各周期同时获取数据、评分排名，哪个周期先完成就先保存结果
+    即时排行与N日排行共用同一份即时参考快照（与各周期的排行接口并发获取，即时排行接口只请求一次）
+    总耗时约等于最慢的一个周期，而不是各周期之和
+
+    :param periods: [(周期, 排序方式, 文件名前缀), ...]，默认 config.PIPELINE_PERIODS
+    :param max_workers: 同时处理的周期数上限，默认 config.PIPELINE_MAX_WORKERS
+    :return: {周期: 排名结果}，失败或无数据的周期为 None
+    """
+    periods = periods if periods is not None else config.PIPELINE_PERIODS
+    max_workers = max_workers or config.PIPELINE_MAX_WORKERS
+    results = {}
+    start = time.time()
+
+    with ThreadPoolExecutor(max_workers=max_workers + 1) as executor:
+        if any('日排行' in period for period, _, _ in periods):
+            executor.submit(rf.get_instant_reference_data)
+
+        futures = {
+            executor.submit(process_and_save, period=period, sort_by=sort_by, filename_prefix=prefix): period
+            for period, sort_by, prefix in periods
+        }
+        for future in as_completed(futures):
+            period = futures[future]
+            try:
+                results[period] = future.result()
+            except Exception as e:
+                print(f"[{period}] 处理失败: {e}")
+                results[period] = None
+            print(f"[{period}] 完成，已用时 {time.time() - start:.1f}秒")
+
+    done = sum(1 for df in results.values() if df is not None)
+    print(f"\n[流水线] {done}/{len(periods)} 个周期处理完成，总耗时 {time.time() - start:.1f}秒")
+    return results
 
 if __name__ == "__main__":
     # 初始化数据库
@@ -65,13 +112,10 @@ if __name__ == "__main__":
     print("正在检查并清理过期结果文件...")
     rf.clean_old_files('analysis_results', days=7)
     
-    # 即时数据 - 按增仓占比
-    process_and_save(period='即时', sort_by='ratio', filename_prefix="增仓占比")
-
-    # 3日数据 - 按增仓占比
-    process_and_save(period='3日排行', sort_by='ratio', filename_prefix="增仓占比")
+    # 即时 / 3日 / 5日 / 10日 / 20日 并发处理（周期和排序方式见 config.PIPELINE_PERIODS）
+    run_pipeline()
 
-    # 5日数据 - 按增仓占比
-    process_and_save(period='5日排行', sort_by='ratio', filename_prefix="增仓占比")
+    # 批处理结束后按计划清理过期的数据库缓存（默认每天最多一次）
+    database.run_retention_if_due()
 
     print("\n所有任务完成。")
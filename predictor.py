@@ -1,4 +1,3 @@
-import akshare as ak
 import pandas as pd
 import requests
 import json
@@ -6,6 +5,13 @@ import time
 import numpy as np
 from datetime import datetime
 import config
+import bar_store
+import data_source
+import database
+import single_flight
+
+# 个股基本面接口的请求合并：多个会话同时预测同一只股票时只请求一次，键为 (股票代码, 交易日)
+_INFO_FLIGHTS = single_flight.SingleFlight()
 
 class StockPredictor:
     def __init__(self):
@@ -22,12 +28,8 @@ class StockPredictor:
         获取股票历史K线数据并计算技术指标
         """
         try:
-            # 获取最近45天的日线数据 (用于计算指标)
-            end_date = datetime.now().strftime("%Y%m%d")
-            start_date = (datetime.now() - pd.Timedelta(days=60)).strftime("%Y%m%d")
-            
-            # akshare 获取个股历史数据
-            df = ak.stock_zh_a_hist(symbol=stock_code, period="daily", start_date=start_date, end_date=end_date, adjust="qfq")
+            # 获取最近60天的日线数据 (用于计算指标)，从本地日线库读取，只补抓缺失的交易日
+            df = bar_store.get_daily_bars(stock_code, days=60)
             
             if df.empty:
                 return "无历史数据"
@@ -91,7 +93,8 @@ class StockPredictor:
     def fetch_basic_info(self, stock_code):
         """获取基本面数据 (行业、PE、总市值等)"""
         try:
-            df = ak.stock_individual_info_em(symbol=stock_code)
+            df = _INFO_FLIGHTS.do((stock_code, database.get_stock_trade_date()),
+                                  data_source.get_provider().stock_individual_info_em, symbol=stock_code)
             # df columns: item, value
             info_dict = dict(zip(df['item'], df['value']))
             
@@ -109,7 +112,7 @@ class StockPredictor:
         """获取个股最新新闻 (Top 3)"""
         try:
             # 限制获取条数以节省流量
-            df = ak.stock_news_em(symbol=stock_code)
+            df = data_source.get_provider().stock_news_em(symbol=stock_code)
             if df.empty:
                 return "近期无重大新闻"
             
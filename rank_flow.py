@@ -3,6 +3,7 @@
 
 import pandas as pd
 import numpy as np
+from numpy.dtypes import StringDType
 import os
 
 # 修复可能的代理配置问题 (Fix ProxyError)
@@ -12,24 +13,47 @@ os.environ.pop('HTTP_PROXY', None)
 os.environ.pop('HTTPS_PROXY', None)
 os.environ.pop('ALL_PROXY', None)
 
-import akshare as ak
+import data_source
 from datetime import datetime, timedelta
 import time
 import sys
 import database # Import database module
+import config
+import bisect
+import fetch_engine
+import bar_store
+import snapshot_cache
+import single_flight
+import trade_calendar
+import flow_features
 import random
 from concurrent.futures import ThreadPoolExecutor, as_completed
+import threading
 from threading import Lock
 
-# 全局缓存，避免重复请求同一只股票的量比数据
-_VOLUME_RATIO_CACHE = {}
-# 全局数据缓存，避免单次运行中多次请求同一类型数据（如即时排行）
-_FUND_FLOW_CACHE = {}
+# 进程内快照缓存，避免多次请求同一类型数据（如即时排行）；按交易日换键，带过期时间和容量上限
+_SNAPSHOT_CACHE = snapshot_cache.SnapshotCache(is_stale=trade_calendar.is_snapshot_stale)
+# N日排行估算增仓占比用的即时参考快照在缓存中的周期键（只含排行接口数据，不含主力资金流）
+REFERENCE_PERIOD = '即时参考'
+
+# 日线接口共享的限速器（首次计算量比时创建，多次排名之间保留已调整的速率）
+_HISTORY_LIMITER = None
+_HISTORY_LIMITER_LOCK = Lock()
+# 即时参考快照只获取一次（多个N日周期并发请求时，其余线程等待第一份结果）
+_REFERENCE_LOCK = Lock()
+# 全市场主力资金流排行在缓存中的周期键（一次请求取得全部股票的超大单/大单净额）
+BULK_MAIN_FORCE_PERIOD = '主力排行'
+_BULK_MAIN_FORCE_LOCK = Lock()
+# get_fund_flow_data 的请求合并，键为快照缓存键 (周期, 交易日, 数据版本)
+_FUND_FLOW_FLIGHTS = single_flight.SingleFlight()
+# 各周期最近一次成功获取的 (数据, 获取时间)，刷新期间继续返回（不随快照缓存失效），以及进行中的后台重新获取
+_LAST_GOOD = {}
+_REVALIDATIONS = {}
+_REVALIDATE_ERRORS = {}
+_SERVE_LOCK = Lock()
 
 # 全局锁，用于线程安全的打印和计数
 _PRINT_LOCK = Lock()
-_REQUEST_DELAY = 0.05  # 50ms延迟（并发模式下可以更短）
-_MAX_WORKERS = 15  # 并发线程数（可根据网络情况调整）
 
 def convert_unit(x):
     if pd.isna(x):
@@ -47,6 +71,62 @@ def convert_unit(x):
         except:
             return np.nan
 
+# 接口返回的金额列（带 亿/万 单位的字符串）和百分比列（带 % 的字符串）
+AMOUNT_COLUMNS = ['最新价', '流入资金', '流出资金', '净额', '成交额', '资金流入净额']
+PERCENT_COLUMNS = ['涨跌幅', '换手率', '连续换手率', '阶段涨跌幅']
+
+def _to_string_array(series: pd.Series) -> np.ndarray:
+    """转为 numpy StringDType 数组（缺失值记为 'nan'，首尾空白已去除），供 np.strings 整列处理"""
+    values = series.to_numpy(dtype=object, na_value='nan').astype(StringDType())
+    return np.strings.strip(values)
+
+def _string_array_to_float(values: np.ndarray) -> np.ndarray:
+    """字符串数组转 float64，'-' 和空串记为 NaN；遇到无法解析的内容时退回逐个容错解析"""
+    values[(values == '-') | (values == '')] = 'nan'
+    try:
+        return values.astype(np.float64)
+    except ValueError:
+        return pd.to_numeric(pd.Series(values.astype(object)), errors='coerce').to_numpy(dtype=np.float64)
+
+def parse_amount_series(series: pd.Series) -> pd.Series:
+    """整列解析 亿/万 单位的金额（向量化版 convert_unit），返回 float64"""
+    if pd.api.types.is_numeric_dtype(series):
+        return series.astype(np.float64)
+    values = _to_string_array(series)
+    multiplier = np.where(np.strings.endswith(values, '亿'), 100000000.0,
+                          np.where(np.strings.endswith(values, '万'), 10000.0, 1.0))
+    values = _string_array_to_float(np.strings.rstrip(values, '亿万'))
+    return pd.Series(values * multiplier, index=series.index, name=series.name)
+
+def parse_percent_series(series: pd.Series) -> pd.Series:
+    """整列解析 "5.23%" 格式的百分比，返回 float64（单位仍为%）"""
+    if pd.api.types.is_numeric_dtype(series):
+        return series.astype(np.float64)
+    values = _string_array_to_float(np.strings.rstrip(_to_string_array(series), '%'))
+    return pd.Series(values, index=series.index, name=series.name)
+
+def normalize_fund_flow_frame(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    接口数据入口的统一清洗（紧跟在 akshare 调用或缓存读取之后执行一次）
+    - 列名去空格，股票代码统一为6位字符串
+    - 金额列（亿/万）和百分比列（%）整列转为 float64，下游不再重复解析字符串
+    """
+    df = df.copy()
+    df.columns = [str(c).strip() for c in df.columns]
+
+    if '股票代码' in df.columns:
+        df['股票代码'] = (df['股票代码'].astype(str).str.strip()
+                        .str.replace("'", "", regex=False).str.replace('"', "", regex=False)
+                        .str.zfill(6))
+
+    for col in AMOUNT_COLUMNS:
+        if col in df.columns:
+            df[col] = parse_amount_series(df[col])
+    for col in PERCENT_COLUMNS:
+        if col in df.columns:
+            df[col] = parse_percent_series(df[col])
+    return df
+
 def format_amount(x):
     """能够将数字格式化为 xx亿 或 xx万 的字符串"""
     if pd.isna(x):
@@ -76,17 +156,12 @@ def format_percentage(x):
 
 def clean_old_files(directory: str, days: int = 7):
     """
-    删除目录下超过指定天数的文件，并清理已过期的数据库数据
+    删除目录下超过指定天数的文件
+    （数据库过期数据由 database.run_retention_if_due 定期清理，不在启动时执行）
     :param directory: 目录路径
     :param days: 天数阈值
     """
-    # 1. 清理数据库过期数据
-    try:
-        database.clean_old_data(days)
-    except Exception as e:
-        print(f"数据库清理失败: {e}")
-
-    # 2. 清理结果文件 (analysis_results)
+    # 清理结果文件 (analysis_results)
     if not os.path.exists(directory):
         return
         
@@ -105,159 +180,327 @@ def clean_old_files(directory: str, days: int = 7):
             except Exception as e:
                 print(f"清理文件失败 {filename}: {e}")
 
-def get_fund_flow_data(period: str = '即时') -> pd.DataFrame:
+def _with_float_market_cap(df: pd.DataFrame) -> pd.DataFrame:
+    """补算流通市值 = 成交额 / (换手率 / 100)"""
+    if '流通市值' not in df.columns and '成交额' in df.columns and '换手率' in df.columns:
+        df = df.copy()
+        df['流通市值'] = df['成交额'] / (df['换手率'].replace(0, np.nan) / 100)
+    return df
+
+def _snapshot_key(period: str):
+    """内存快照缓存的键: (周期, 交易日, 数据版本)"""
+    return _SNAPSHOT_CACHE.make_key(period, database.get_stock_trade_date())
+
+def get_snapshot_cache_stats() -> dict:
+    """内存快照缓存的命中/未命中等计数（界面侧边栏“系统状态”显示）"""
+    return _SNAPSHOT_CACHE.stats()
+
+def _get_cached_instant_reference():
+    for key in ('即时', REFERENCE_PERIOD):
+        df = _SNAPSHOT_CACHE.get(_snapshot_key(key))
+        if df is not None:
+            return df
+    return None
+
+def get_instant_reference_data() -> pd.DataFrame:
+    """
+    获取N日排行估算增仓占比所需的即时参考数据（股票代码、成交额、换手率、流通市值）
+    只需一次即时排行接口调用，不抓取逐只股票的主力资金流，所有N日周期共用同一份快照
+    (一级:内存缓存 -> 二级:数据库缓存(参考快照或完整即时数据) -> 三级:API获取)
+    """
+    df_ref = _get_cached_instant_reference()
+    if df_ref is not None:
+        return df_ref
+
+    with _REFERENCE_LOCK:
+        # 等锁期间可能已由其他线程获取
+        df_ref = _get_cached_instant_reference()
+        if df_ref is not None:
+            return df_ref
+        return _load_instant_reference_data()
+
+def _load_instant_reference_data() -> pd.DataFrame:
+    """即时参考数据：数据库缓存 -> API获取，结果写入内存缓存"""
+    cache_key = _snapshot_key(REFERENCE_PERIOD)
+    try:
+        for key in (REFERENCE_PERIOD, '即时'):
+            snapshot_time = database.get_fund_flow_snapshot_time(key)
+            if trade_calendar.is_snapshot_stale(snapshot_time):
+                continue
+            df_cache = database.get_raw_fund_flow_cache(key)
+            if not df_cache.empty:
+                print(f"[缓存命中] 即时参考数据从数据库读取 (Period: {key}, 获取于 {snapshot_time})")
+                df_ref = _with_float_market_cap(normalize_fund_flow_frame(df_cache))
+                _SNAPSHOT_CACHE.put(cache_key, df_ref, fetched_at=snapshot_time)
+                return df_ref
+    except Exception as e:
+        print(f"数据库读取异常: {e}, 转为API获取")
+
+    try:
+        print("正在从API获取即时参考数据（仅排行接口，不抓取主力资金流）...")
+        return _request_instant_ranking()
+    except Exception as e:
+        print(f"获取即时参考数据失败: {e}")
+        return pd.DataFrame()
+
+def _request_instant_ranking() -> pd.DataFrame:
+    """请求即时排行接口（清洗并只保留6/3/0开头），结果同时写入即时参考快照（调用方需持有 _REFERENCE_LOCK）"""
+    df_ref = data_source.get_provider().stock_fund_flow_individual(symbol='即时')
+    if df_ref.empty:
+        return df_ref
+    df_ref = normalize_fund_flow_frame(df_ref)
+    df_ref = df_ref[df_ref['股票代码'].str.startswith(('6', '3', '0'))]
+
+    try:
+        original_cols = ['股票代码', '股票简称', '最新价', '涨跌幅', '换手率', '净额', '成交额', '流入资金', '流出资金']
+        database.save_raw_fund_flow_cache(df_ref[[c for c in original_cols if c in df_ref.columns]], REFERENCE_PERIOD)
+    except Exception as e:
+        print(f"[缓存保存] 写入即时参考数据失败: {e}")
+
+    df_ref = _with_float_market_cap(df_ref)
+    _SNAPSHOT_CACHE.put(_snapshot_key(REFERENCE_PERIOD), df_ref)
+    return df_ref
+
+def _fetch_instant_ranking(refresh: bool = False) -> pd.DataFrame:
+    """
+    即时数据的排行接口原始数据，与N日排行的即时参考快照共用同一次请求：
+    内存中的参考快照有效时直接使用，否则请求接口并写入参考快照；refresh 时总是重新请求
+    返回副本，调用方可以直接修改
+    """
+    with _REFERENCE_LOCK:
+        df_ref = None if refresh else _SNAPSHOT_CACHE.get(_snapshot_key(REFERENCE_PERIOD))
+        if df_ref is not None:
+            print("[即时参考] 使用已获取的即时排行快照，不再重复请求排行接口")
+        else:
+            df_ref = _request_instant_ranking()
+        return df_ref.copy()
+
+def get_fund_flow_data(period: str = '即时', prune: bool = True, refresh: bool = False) -> pd.DataFrame:
     """
     获取资金流入数据 (一级:内存缓存 -> 二级:数据库缓存 -> 三级:API获取)
+    冷缓存时多个线程/会话同时请求同一周期，只有一个执行获取，其余等待并共享结果
     :param period: '即时', '3日排行', '5日排行', '10日排行', '20日排行'
+    :param prune: 即时数据是否按分支定界跳过不可能进入综合评分前列的股票（见 config.MAIN_FORCE_PRUNE_TOP_N）；
+                  按增仓占比排序需要全部股票的主力资金流时设为 False
+    :param refresh: 跳过内存和数据库缓存直接从API获取（界面“刷新数据”）；获取成功后才替换缓存，
+                    获取期间其他读取方仍读到旧快照
     :return: 包含资金流入数据的DataFrame
     """
-    # 0. 检查内存缓存 (防止主程序多次调用或递归调用时重复获取)
-    if period in _FUND_FLOW_CACHE:
+    cache_key = _snapshot_key(period)
+    df_memory = None if refresh else _get_cached_snapshot(cache_key, prune)
+    if df_memory is not None:
         print(f"检测到内存缓存数据，直接读取 (Period: {period})")
-        return _FUND_FLOW_CACHE[period]
+        return df_memory
+
+    flight_key = cache_key if prune else (cache_key, 'full')
+    if refresh:
+        flight_key = (flight_key, 'refresh')
+    if _FUND_FLOW_FLIGHTS.in_flight(flight_key):
+        print(f"[请求合并] {period} 数据正在由其他请求获取，等待其结果...")
+    df = _FUND_FLOW_FLIGHTS.do(flight_key, _load_fund_flow_data, period, cache_key, prune, refresh)
+    if not df.empty:
+        fetched_at = database.get_fund_flow_snapshot_time(period) or datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        with _SERVE_LOCK:
+            _LAST_GOOD[period] = (df, fetched_at)
+    return df
 
-    # 初始化数据库（确保表存在）
-    database.init_db()
+def refresh_fund_flow_data(period: str = '即时') -> pd.DataFrame:
+    """
+    重新从API获取周期数据（界面“刷新数据”；主力资金流缓存仍只补抓过期的股票）
+    不清除现有缓存：新数据写入数据库新版本并切换后才替换，获取失败时旧快照保留，获取期间读取方仍读到旧快照
+    :return: 新数据，获取失败时为空表
+    """
+    if period == '即时':
+        # 全市场主力资金流排行只是接口结果的缓存，刷新时一并重新请求
+        _SNAPSHOT_CACHE.invalidate(BULK_MAIN_FORCE_PERIOD)
+    return get_fund_flow_data(period, refresh=True)
 
-    # 清理过期
-    # clean_old_files 已经在main中被调用，这里可以不调用，或者也调用防守
-    
-    # 1. 尝试从数据库读取原始数据（优先）
+def _revalidate(period: str, refresh: bool):
     try:
-        trade_date = database.get_stock_trade_date()
-        print(f"[缓存检查] 交易日期: {trade_date}, 查询周期: {period}")
+        df = refresh_fund_flow_data(period) if refresh else get_fund_flow_data(period)
+        error = None if not df.empty else "未获取到数据"
+    except Exception as e:
+        error = str(e)
+    with _SERVE_LOCK:
+        _REVALIDATIONS.pop(period, None)
+        if error is not None:
+            # 失败时保留旧数据继续返回
+            _REVALIDATE_ERRORS[period] = (error, time.monotonic())
+            print(f"[后台刷新] {period} 数据获取失败，继续使用旧数据: {error}")
+
+def revalidate_fund_flow_data(period: str = '即时', refresh: bool = False) -> bool:
+    """
+    在后台线程重新获取周期数据，完成后由 serve_fund_flow_data 返回新数据
+    :param refresh: True 时跳过缓存重新从API获取（同“刷新数据”，不清除缓存，获取成功后才替换），
+                    否则只在缓存过期时重新获取
+    :return: 是否启动了新的后台获取（已有进行中的则不重复启动）
+    """
+    with _SERVE_LOCK:
+        if period in _REVALIDATIONS:
+            return False
+        _REVALIDATE_ERRORS.pop(period, None)
+        worker = threading.Thread(target=_revalidate, args=(period, refresh), daemon=True,
+                                  name=f"revalidate-{period}")
+        _REVALIDATIONS[period] = worker
+    worker.start()
+    return True
+
+def is_revalidating(period: str = '即时') -> bool:
+    with _SERVE_LOCK:
+        return period in _REVALIDATIONS
+
+def serve_fund_flow_data(period: str = '即时', refresh: bool = False, now: datetime = None):
+    """
+    立即返回最近一次成功获取的数据（stale-while-revalidate）：
+    已过期或要求刷新时在后台重新获取，获取期间继续返回旧数据，完成后整体切换为新数据
 
-        # 优先尝试读取原始数据
-        df_raw = database.get_raw_fund_flow_cache(period)
-        print(f"[缓存检查] 原始数据表返回 {len(df_raw)} 条数据")
+    :param refresh: 是否要求刷新（界面“刷新数据”）
+    :return: (数据, 信息)；本进程还没有成功获取过该周期时数据为 None（需同步获取）。
+             信息: fetched_at 数据获取时间, age_seconds 数据时长(秒), stale 是否已过期,
+             revalidating 是否正在后台获取, error 上一次后台获取的错误
+    """
+    now = now or datetime.now()
+    with _SERVE_LOCK:
+        entry = _LAST_GOOD.get(period)
+    if entry is None:
+        return None, {'fetched_at': None, 'age_seconds': None, 'stale': True,
+                      'revalidating': is_revalidating(period), 'error': None}
+
+    df, fetched_at = entry
+    stale = trade_calendar.is_snapshot_stale(fetched_at, now)
+    with _SERVE_LOCK:
+        failed = _REVALIDATE_ERRORS.get(period)
+    # 过期触发的后台获取失败后，间隔 config.REVALIDATE_RETRY_SECONDS 再自动重试，避免反复请求
+    backing_off = failed is not None and time.monotonic() - failed[1] < config.REVALIDATE_RETRY_SECONDS
+    if refresh or (stale and not backing_off):
+        revalidate_fund_flow_data(period, refresh=refresh)
+    with _SERVE_LOCK:
+        info = {
+            'fetched_at': fetched_at,
+            'age_seconds': max((now - pd.Timestamp(fetched_at).to_pydatetime()).total_seconds(), 0.0),
+            'stale': stale,
+            'revalidating': period in _REVALIDATIONS,
+            'error': _REVALIDATE_ERRORS[period][0] if period in _REVALIDATE_ERRORS else None,
+        }
+    return df, info
 
-        if not df_raw.empty:
-            print(f"[缓存命中] 从原始数据表读取，准备计算指标...")
-            df_cache = df_raw
-        else:
-            # 如果原始数据表没有，尝试读取计算结果表（兼容旧数据）
-            df_cache = database.get_fund_flow_cache(period)
-            print(f"[缓存检查] 计算结果表返回 {len(df_cache)} 条数据")
+def _is_pruned(df: pd.DataFrame) -> bool:
+    """即时数据中是否有被分支定界跳过的股票（这些股票没有主力资金流，抓取失败的股票按0计）"""
+    return '主力净额' in df.columns and bool(df['主力净额'].isna().any())
+
+def _get_cached_snapshot(cache_key, prune: bool = True):
+    """读取内存快照；需要完整数据时，跳过了部分股票的快照视为未命中"""
+    df = _SNAPSHOT_CACHE.get(cache_key)
+    if df is not None and not prune and _is_pruned(df):
+        return None
+    return df
 
-        if not df_cache.empty:
-            print(f"[缓存命中] 检测到今日数据库缓存数据，直接读取 (Period: {period})")
-            # 补全股票代码前导0 (数据库Text类型应该保留了，但防守一下)
-            if '股票代码' in df_cache.columns:
-                df_cache['股票代码'] = df_cache['股票代码'].astype(str).apply(lambda x: x.zfill(6))
+def _load_fund_flow_data(period: str, cache_key, prune: bool = True, refresh: bool = False) -> pd.DataFrame:
+    """get_fund_flow_data 的实际获取（同一 cache_key 同时只执行一次；refresh 时跳过内存和数据库缓存）"""
+    prune_top_n = None if prune else 0
+    # 0. 再次检查内存缓存 (等待期间可能已由刚结束的请求写入)
+    df_memory = None if refresh else _get_cached_snapshot(cache_key, prune)
+    if df_memory is not None:
+        print(f"检测到内存缓存数据，直接读取 (Period: {period})")
+        return df_memory
 
-            # 如果是即时数据，需要处理超大单数据
-            if period == '即时':
-                # 检查是否已有主力资金流数据
-                if '主力净流入' not in df_cache.columns or df_cache['主力净流入'].isna().all():
-                    print("[提示] 缓存数据缺少主力资金流数据，尝试从主力资金流缓存表读取...")
+    # 清理过期
+    # clean_old_files 已经在main中被调用，这里可以不调用，或者也调用防守
+    
+    # 1. 尝试从数据库读取原始数据（优先）；刷新数据时跳过，获取成功后才替换数据库缓存
+    if refresh:
+        print(f"[刷新数据] 跳过 {period} 缓存，重新从API获取（获取失败时保留现有缓存）")
+    else:
+        try:
+            trade_date = database.get_stock_trade_date()
+            print(f"[缓存检查] 交易日期: {trade_date}, 查询周期: {period}")
+
+            # 优先尝试读取原始数据
+            df_raw = database.get_raw_fund_flow_cache(period)
+            print(f"[缓存检查] 原始数据表返回 {len(df_raw)} 条数据")
 
-                    # 尝试从主力资金流缓存表读取
+            if not df_raw.empty:
+                print(f"[缓存命中] 从原始数据表读取，准备计算指标...")
+                df_cache = df_raw
+            else:
+                # 如果原始数据表没有，尝试读取计算结果表（兼容旧数据）
+                df_cache = database.get_fund_flow_cache(period)
+                print(f"[缓存检查] 计算结果表返回 {len(df_cache)} 条数据")
+
+            # 交易日历判断快照是否仍有效：收盘后获取的当天不再变化，盘中获取的按交易时段过期
+            snapshot_time = database.get_fund_flow_snapshot_time(period)
+            if not df_cache.empty and trade_calendar.is_snapshot_stale(snapshot_time):
+                print(f"[缓存过期] {period} 快照获取于 {snapshot_time or '未知时间'}，已过期，重新从API获取")
+                df_cache = pd.DataFrame()
+
+            if not df_cache.empty:
+                print(f"[缓存命中] 检测到今日数据库缓存数据，直接读取 (Period: {period})")
+                # 统一清洗（旧版缓存中可能仍是字符串格式的百分比，股票代码补全前导0）
+                df_cache = normalize_fund_flow_frame(df_cache)
+
+                # 如果是即时数据，需要处理超大单数据
+                if period == '即时':
+                    # 主力资金流以 main_force_cache 为准：增量补抓缺失/失败/过期的股票后合并
+                    # （缓存全部有效时不发起任何请求）
+                    print("[提示] 从主力资金流缓存读取数据（仅补抓缺失、失败或过期的股票）...")
+                    progress = _start_progress(df_cache)
                     try:
-                        trade_date = database.get_stock_trade_date()
-                        conn = database.get_connection()
-                        cursor = conn.cursor()
-                        cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='main_force_cache'")
-
-                        if cursor.fetchone():
-                            query = "SELECT * FROM main_force_cache WHERE cache_date = ?"
-                            df_main_force = pd.read_sql(query, conn, params=(trade_date,))
-
-                            if not df_main_force.empty:
-                                # 恢复列名并合并
-                                if 'stock_code' in df_main_force.columns:
-                                    df_main_force = df_main_force.rename(columns={'stock_code': '股票代码'})
-                                if 'cache_date' in df_main_force.columns:
-                                    df_main_force = df_main_force.drop(columns=['cache_date'])
-
-                                # 合并主力资金流数据
-                                df_cache = df_cache.merge(df_main_force, on='股票代码', how='left')
-                                df_cache['超大单净额'] = df_cache['超大单净额'].fillna(0)
-                                df_cache['大单净额'] = df_cache['大单净额'].fillna(0)
-                                df_cache['主力净流入'] = df_cache['主力净流入'].fillna(0)
-                                print(f"[OK] 成功从主力资金流缓存读取数据")
-                            else:
-                                # 数据严谨性要求：缓存表为空时，抛出异常
-                                conn.close()
-                                raise ValueError("[数据完整性错误] 主力资金流缓存表为空，无法保证数据准确性")
-                        else:
-                            # 数据严谨性要求：缓存表不存在时，抛出异常
-                            conn.close()
-                            raise ValueError("[数据完整性错误] 主力资金流缓存表不存在，无法保证数据准确性")
-
-                        conn.close()
-                    except ValueError:
-                        # 重新抛出数据完整性错误，不使用净额作为后备
-                        raise
+                        df_main_force, attempted_codes = fetch_main_force_flow_pruned(df_cache, top_n=prune_top_n,
+                                                                                    progress=progress)
                     except Exception as ex:
                         # 数据严谨性要求：读取失败时，抛出异常而不是使用净额
                         raise RuntimeError(f"[数据完整性错误] 读取主力资金流缓存失败: {ex}，无法保证数据准确性") from ex
+                    finally:
+                        progress.finish()
 
-                # 使用主力净流入作为主力净额（超大单 + 大单）
-                df_cache['主力净额'] = df_cache['主力净流入']
+                    if df_main_force.empty:
+                        # 数据严谨性要求：没有任何主力资金流数据时，抛出异常
+                        raise ValueError("[数据完整性错误] 主力资金流缓存表为空，无法保证数据准确性")
 
-                # 重新计算增仓占比
-                if '成交额' in df_cache.columns:
-                    df_cache['增仓占比'] = (df_cache['主力净额'] / df_cache['成交额'].replace(0, np.nan)) * 100
+                    # 合并主力资金流数据
+                    df_cache = df_cache.drop(columns=[c for c in database.MAIN_FORCE_COLUMNS if c in df_cache.columns])
+                    df_cache = _merge_main_force(df_cache, df_main_force, attempted_codes)
+                    print(f"[OK] 成功从主力资金流缓存读取数据")
 
-                # 计算流通市值（如果缺失）
-                if '流通市值' not in df_cache.columns and '成交额' in df_cache.columns and '换手率' in df_cache.columns:
-                    def parse_rate_val(x):
-                        if pd.isna(x): return np.nan
-                        s = str(x).replace('%', '')
-                        try: return float(s)
-                        except: return np.nan
+                    # 重新计算增仓占比
+                    if '成交额' in df_cache.columns:
+                        df_cache['增仓占比'] = (df_cache['主力净额'] / df_cache['成交额'].replace(0, np.nan)) * 100
 
-                    temp_rates = df_cache['换手率'].apply(parse_rate_val)
-                    df_cache['流通市值'] = df_cache['成交额'] / (temp_rates.replace(0, np.nan) / 100)
+                    # 计算流通市值（如果缺失）
+                    if '流通市值' not in df_cache.columns and '成交额' in df_cache.columns and '换手率' in df_cache.columns:
+                        df_cache['流通市值'] = df_cache['成交额'] / (df_cache['换手率'].replace(0, np.nan) / 100)
 
-            # 写入内存缓存
-            _FUND_FLOW_CACHE[period] = df_cache
-            return df_cache
-    except Exception as e:
-        print(f"数据库读取异常: {e}, 转为API获取")
+                # 写入内存缓存
+                _SNAPSHOT_CACHE.put(cache_key, df_cache, fetched_at=snapshot_time)
+                return df_cache
+        except Exception as e:
+            print(f"数据库读取异常: {e}, 转为API获取")
     
     # 2. 从API获取
     try:
         print(f"正在从API获取 {period} 数据...")
-        # 使用akshare获取资金流入数据
-        fund_flow_df = ak.stock_fund_flow_individual(symbol=period)
+        # 使用akshare获取资金流入数据（即时排行与N日排行的即时参考快照共用一次请求）
+        if period == '即时':
+            fund_flow_df = _fetch_instant_ranking(refresh)
+        else:
+            fund_flow_df = data_source.get_provider().stock_fund_flow_individual(symbol=period)
         
         if not fund_flow_df.empty:
-            # 处理股票代码：转为字符串并补全6位前导0
-            fund_flow_df['股票代码'] = fund_flow_df['股票代码'].astype(str).str.zfill(6)
-            
+            # 统一清洗：股票代码补全6位前导0，金额（亿/万）和百分比（%）整列转为数值
+            fund_flow_df = normalize_fund_flow_frame(fund_flow_df)
+
             # 筛选股票代码以 6, 3, 0 开头的 (前导0已补全，可以直接匹配)
-            # 强制确保列名为字符串，去除可能存在的引号或空格，再匹配
-            fund_flow_df['股票代码'] = fund_flow_df['股票代码'].astype(str).str.strip().str.replace("'", "").str.replace('"', "")
-            fund_flow_df['股票代码'] = fund_flow_df['股票代码'].str.zfill(6)
-            
             fund_flow_df = fund_flow_df[fund_flow_df['股票代码'].str.startswith(('6', '3', '0'))]
             print(f"筛选 A股(6/3/0)后剩余股票数量: {len(fund_flow_df)} 只")
-            
-            # 数据类型转换与指标计算
-            numeric_cols = ['最新价', '流入资金', '流出资金', '净额', '成交额', '资金流入净额']
-            for col in numeric_cols:
-                if col in fund_flow_df.columns:
-                    fund_flow_df[col] = fund_flow_df[col].apply(convert_unit)
 
             if period == '即时':
                 print("[筛选预处理] 提前计算流通市值并过滤，以减少不必要的爬虫请求...")
                 
                 # 1. 提前计算 '流通市值'
                 # 流通市值 = 成交额 / (换手率 / 100)
-                # 确保列名没有空格
-                fund_flow_df.columns = [c.strip() for c in fund_flow_df.columns]
-                
                 if '成交额' in fund_flow_df.columns and '换手率' in fund_flow_df.columns:
-                     def parse_rate_val(x):
-                         if pd.isna(x): return np.nan
-                         s = str(x).replace('%', '')
-                         try: return float(s)
-                         except: return np.nan
-                     
-                     temp_rates = fund_flow_df['换手率'].apply(parse_rate_val)
                      # 避免除以0
-                     fund_flow_df['流通市值'] = fund_flow_df['成交额'] / (temp_rates.replace(0, np.nan) / 100)
+                     fund_flow_df['流通市值'] = fund_flow_df['成交额'] / (fund_flow_df['换手率'].replace(0, np.nan) / 100)
                 else:
                     print("[Error] 缺少计算流通市值的关键列('成交额'或'换手率')")
 
@@ -275,28 +518,20 @@ def get_fund_flow_data(period: str = '即时') -> pd.DataFrame:
                 # 3. 开始获取主力资金流数据（超大单 + 大单）
                 print(f"\n[步骤1/2] 准备获取 {len(fund_flow_df)} 只目标股票的主力资金流数据...")
 
-                # 提取股票代码列表（已筛选6、3、0开头 且 市值<1000亿）
-                stock_codes = fund_flow_df['股票代码'].tolist()
-
-                # 串行获取所有股票的主力资金流数据
+                # 按综合评分上界分支定界抓取（已筛选6、3、0开头 且 市值<1000亿），
+                # 跳过不可能进入前 config.MAIN_FORCE_PRUNE_TOP_N 名的股票；
+                # 抓取过程中逐步发布结果，rank_fund_flow_anytime 可随时给出临时排名
                 print(f"[步骤2/2] 获取主力资金流数据（超大单 + 大单）...")
-                df_main_force = fetch_all_main_force_flow(stock_codes)
+                progress = _start_progress(fund_flow_df)
+                try:
+                    df_main_force, attempted_codes = fetch_main_force_flow_pruned(fund_flow_df, top_n=prune_top_n,
+                                                                                progress=progress)
+                finally:
+                    progress.finish()
 
                 if not df_main_force.empty:
-                    # 合并主力资金流数据
-                    fund_flow_df = fund_flow_df.merge(
-                        df_main_force,
-                        on='股票代码',
-                        how='left'
-                    )
-
-                    # 将缺失值填充为0
-                    fund_flow_df['超大单净额'] = fund_flow_df['超大单净额'].fillna(0)
-                    fund_flow_df['大单净额'] = fund_flow_df['大单净额'].fillna(0)
-                    fund_flow_df['主力净流入'] = fund_flow_df['主力净流入'].fillna(0)
-
-                    # 使用主力净流入作为主力净额（超大单 + 大单）
-                    fund_flow_df['主力净额'] = fund_flow_df['主力净流入']
+                    # 合并主力资金流数据（已抓取的缺失值填充为0）
+                    fund_flow_df = _merge_main_force(fund_flow_df, df_main_force, attempted_codes)
 
                     print(f"[OK] 成功合并主力资金流数据")
                 else:
@@ -327,29 +562,22 @@ def get_fund_flow_data(period: str = '即时') -> pd.DataFrame:
                      
                      # 尝试估算增仓占比
                      try:
-                         # 递归获取即时数据（利用缓存）
-                         print(f"正在获取即时数据以辅助计算 {period} 增仓占比...")
-                         df_instant = get_fund_flow_data(period='即时')
+                         # 只需即时排行接口的成交额/换手率，不触发逐只股票的主力资金流抓取
+                         print(f"正在获取即时参考数据以辅助计算 {period} 增仓占比...")
+                         df_instant = get_instant_reference_data()
                          
                          if not df_instant.empty:
                              # 准备合并数据
                              # 即时数据我们需要: 股票代码, 成交额(Instant Turnover), 换手率(Instant TurnRate)
                              # N日数据我们需要: 连续换手率(N-day TurnRate), 净额(N-day NetInflow)
                              
-                             # 预处理即时数据的换手率
-                             def parse_rate(x):
-                                 if pd.isna(x): return np.nan
-                                 s = str(x).replace('%', '')
-                                 try: return float(s)
-                                 except: return np.nan
-
                              cols_ref = ['股票代码', '成交额', '换手率']
                              if '流通市值' in df_instant.columns:
                                  cols_ref.append('流通市值')
 
                              df_ref = df_instant[cols_ref].copy()
                              df_ref['即时成交额'] = df_ref['成交额']
-                             df_ref['即时换手率'] = df_ref['换手率'].apply(parse_rate)
+                             df_ref['即时换手率'] = df_ref['换手率']
                              
                              # 合并
                              merge_cols = ['股票代码', '即时成交额', '即时换手率']
@@ -359,7 +587,7 @@ def get_fund_flow_data(period: str = '即时') -> pd.DataFrame:
                              merged = pd.merge(fund_flow_df, df_ref[merge_cols], on='股票代码', how='left')
                              
                              # N日数据的 '连续换手率'
-                             merged['N日换手率'] = merged['连续换手率'].apply(parse_rate)
+                             merged['N日换手率'] = merged['连续换手率']
                              
                              # 估算公式: Ratio = (N日净额 * 即时换手率) / (即时成交额 * N日换手率) * 100
                              merged['增仓占比'] = (merged['净额'] * merged['即时换手率']) / (merged['即时成交额'] * merged['N日换手率']) * 100
@@ -372,6 +600,9 @@ def get_fund_flow_data(period: str = '即时') -> pd.DataFrame:
                      except Exception as ex:
                          print(f"估算增仓占比失败: {ex}")
                          fund_flow_df['增仓占比'] = 0.0 
+
+                     # 本地资金流历史和日线完整的股票改用精确的N日增仓占比
+                     fund_flow_df = apply_local_flow_ratio(fund_flow_df, period)
             
             # 保存到数据库缓存（双表架构：原始数据 + 计算结果）
             try:
@@ -385,11 +616,8 @@ def get_fund_flow_data(period: str = '即时') -> pd.DataFrame:
                 df_raw_to_save = fund_flow_df.copy()
 
                 # 只保留原始字段（如果存在）
+                # 主力资金流数据按股票单独保存在 main_force_cache（含抓取时间和状态），这里不再重复保存
                 cols_to_save = [col for col in original_cols if col in df_raw_to_save.columns]
-                # 同时保留主力资金流数据（如果有）
-                for col in ['超大单净额', '大单净额', '主力净流入']:
-                    if col in df_raw_to_save.columns:
-                        cols_to_save.append(col)
 
                 df_raw_to_save = df_raw_to_save[cols_to_save]
                 database.save_raw_fund_flow_cache(df_raw_to_save, period)
@@ -405,7 +633,7 @@ def get_fund_flow_data(period: str = '即时') -> pd.DataFrame:
 
         # 写入内存缓存
         if not fund_flow_df.empty:
-            _FUND_FLOW_CACHE[period] = fund_flow_df
+            _SNAPSHOT_CACHE.put(cache_key, fund_flow_df)
             
         return fund_flow_df
     except Exception as e:
@@ -415,12 +643,133 @@ def get_fund_flow_data(period: str = '即时') -> pd.DataFrame:
 
 import concurrent.futures
 
-def fetch_single_stock_main_force_flow(stock_code: str, debug: bool = False) -> dict:
+def apply_local_flow_ratio(df: pd.DataFrame, period: str, end_date: str = None) -> pd.DataFrame:
+    """
+    N日排行的增仓占比改用本地资金流历史计算的 N日主力净额 / N日成交额（见 flow_features）
+    只替换窗口内每个交易日都有资金流历史和本地日线成交额的股票（此时增仓占比精确），其余保留即时成交额估算值，
+    不用由净占比反推成交额的近似值替换接口数据
+
+    :param period: '3日排行' 等
+    :param end_date: 窗口截止日期，默认当前行情所属交易日（盘中包含未定稿的当日数据）
+    """
+    if not config.FLOW_FEATURE_RANKING_ENABLED or df.empty or '股票代码' not in df.columns:
+        return df
+    try:
+        window = int(period.replace('日排行', ''))
+        features = flow_features.get_rolling_features(window, end_date=end_date or trade_calendar.current_trade_date())
+    except Exception as e:
+        print(f"[多日特征] 计算 {period} 增仓占比失败，使用估算值: {e}")
+        return df
+
+    exact = (features['有效天数'] >= window) & (features['实际成交额天数'] >= window)
+    complete = features[exact].set_index('股票代码')['增仓占比'].dropna()
+    local = df['股票代码'].map(complete)
+    if local.notna().any():
+        df = df.copy()
+        estimated = df['增仓占比'] if '增仓占比' in df.columns else np.nan
+        df['增仓占比'] = local.fillna(estimated)
+    print(f"[多日特征] {int(local.notna().sum())}/{len(df)} 只股票的 {period} 增仓占比由本地资金流历史计算，其余为估算值")
+    return df
+
+# 单只股票资金流接口列名 -> 资金流历史库列名
+FUND_FLOW_HISTORY_COLUMN_MAP = {
+    '日期': 'trade_date',
+    '收盘价': 'close',
+    '涨跌幅': 'pct_change',
+    '主力净流入-净额': 'main_net',
+    '主力净流入-净占比': 'main_ratio',
+    '超大单净流入-净额': 'super_large_net',
+    '超大单净流入-净占比': 'super_large_ratio',
+    '大单净流入-净额': 'large_net',
+    '大单净流入-净占比': 'large_ratio',
+    '中单净流入-净额': 'medium_net',
+    '中单净流入-净占比': 'medium_ratio',
+    '小单净流入-净额': 'small_net',
+    '小单净流入-净占比': 'small_ratio',
+}
+
+def to_fund_flow_history_frame(df: pd.DataFrame, now: datetime = None) -> pd.DataFrame:
+    """
+    单只股票资金流接口返回的每日数据转换为资金流历史库格式（金额单位为元，净占比单位为%）
+    最近一个已收盘交易日及之前的数据标记为定稿，盘中的当日数据之后会被覆盖
+    """
+    columns = ['trade_date'] + database.FUND_FLOW_HISTORY_COLUMNS
+    df = df.rename(columns=lambda c: FUND_FLOW_HISTORY_COLUMN_MAP.get(str(c).strip(), c))
+    history = pd.DataFrame({'trade_date': pd.to_datetime(df['trade_date']).dt.strftime("%Y-%m-%d")})
+    for col in database.FUND_FLOW_HISTORY_COLUMNS:
+        if col not in df.columns:
+            history[col] = np.nan
+        elif col.endswith('_ratio') or col == 'pct_change':
+            history[col] = parse_percent_series(df[col]).to_numpy()
+        else:
+            history[col] = parse_amount_series(df[col]).to_numpy()
+    history = history[columns].drop_duplicates('trade_date', keep='last')
+    history['is_final'] = (history['trade_date'] <= trade_calendar.last_closed_trade_date(now)).astype(int)
+    return history.reset_index(drop=True)
+
+# 全市场资金流排行（今日）的列名 -> 资金流历史库列名
+BULK_FUND_FLOW_HISTORY_COLUMN_MAP = {
+    '最新价': 'close',
+    '今日涨跌幅': 'pct_change',
+    '今日主力净流入-净额': 'main_net',
+    '今日主力净流入-净占比': 'main_ratio',
+    '今日超大单净流入-净额': 'super_large_net',
+    '今日超大单净流入-净占比': 'super_large_ratio',
+    '今日大单净流入-净额': 'large_net',
+    '今日大单净流入-净占比': 'large_ratio',
+    '今日中单净流入-净额': 'medium_net',
+    '今日中单净流入-净占比': 'medium_ratio',
+    '今日小单净流入-净额': 'small_net',
+    '今日小单净流入-净占比': 'small_ratio',
+}
+
+def to_bulk_fund_flow_history_frame(df: pd.DataFrame, now: datetime = None) -> pd.DataFrame:
+    """
+    全市场资金流排行（今日）转换为资金流历史库格式：每只股票一行，日期为当前行情所属交易日
+    没有任何资金流数据的股票（停牌）不写入；收盘后获取的标记为定稿
+    """
+    df = df.rename(columns=lambda c: BULK_FUND_FLOW_HISTORY_COLUMN_MAP.get(str(c).strip(), c))
+    trade_date = trade_calendar.current_trade_date(now)
+    history = pd.DataFrame({'stock_code': df['代码'].astype(str).str.strip().str.zfill(6).to_numpy()})
+    history['trade_date'] = trade_date
+    for col in database.FUND_FLOW_HISTORY_COLUMNS:
+        if col not in df.columns:
+            history[col] = np.nan
+        elif col.endswith('_ratio') or col == 'pct_change':
+            history[col] = parse_percent_series(df[col]).to_numpy()
+        else:
+            history[col] = parse_amount_series(df[col]).to_numpy()
+    net_cols = [c for c in database.FUND_FLOW_HISTORY_COLUMNS if c.endswith('_net')]
+    history = history.dropna(subset=net_cols, how='all').drop_duplicates('stock_code')
+    history['is_final'] = int(trade_date <= trade_calendar.last_closed_trade_date(now))
+    return history.reset_index(drop=True)
+
+def _save_bulk_fund_flow_history(df: pd.DataFrame):
+    """保存全市场资金流排行中今日的各档资金流（不额外请求）；失败不影响主力资金流的获取"""
+    if not config.FUND_FLOW_HISTORY_ENABLED:
+        return
+    try:
+        database.save_fund_flow_history_snapshot(to_bulk_fund_flow_history_frame(df))
+    except Exception as e:
+        print(f"[缓存保存] 全市场资金流历史保存失败: {e}")
+
+def _save_fund_flow_history(stock_code: str, df: pd.DataFrame):
+    """保存接口已返回的每日资金流（不额外请求），只追加新的交易日；失败不影响主力资金流的获取"""
+    if not config.FUND_FLOW_HISTORY_ENABLED:
+        return
+    try:
+        database.save_fund_flow_history(stock_code, to_fund_flow_history_frame(df))
+    except Exception as e:
+        print(f"[缓存保存] {stock_code} 资金流历史保存失败: {e}")
+
+def fetch_single_stock_main_force_flow(stock_code: str, debug: bool = False, raise_errors: bool = False) -> dict:
     """
     获取单只股票的主力资金流数据（超大单 + 大单）
 
     :param stock_code: 股票代码（6位）
     :param debug: 是否打印调试信息
+    :param raise_errors: 接口请求失败时抛出异常（供抓取引擎重试和限速），数据无法解析时抛出
+                         fetch_engine.BadDataError（不重试、不降速），默认返回None
     :return: 包含超大单净额和大单净额的字典，失败返回None
     """
     try:
@@ -429,10 +778,12 @@ def fetch_single_stock_main_force_flow(stock_code: str, debug: bool = False) ->
 
         # 调用akshare接口获取单只股票资金流数据
         try:
-            df = ak.stock_individual_fund_flow(stock=stock_code, market=market)
+            df = data_source.get_provider().stock_individual_fund_flow(stock=stock_code, market=market)
         except Exception as e:
             if debug:
                 print(f"[DEBUG] {stock_code}: 获取资金流数据失败 - {e}")
+            if raise_errors:
+                raise
             return None
 
         if df.empty:
@@ -440,6 +791,9 @@ def fetch_single_stock_main_force_flow(stock_code: str, debug: bool = False) ->
                 print(f"[DEBUG] {stock_code}: 返回数据为空")
             return None
 
+        # 接口返回近几个月的每日数据，全部存入资金流历史库
+        _save_fund_flow_history(stock_code, df)
+
         # 获取最新一天的数据（最后一行）
         latest_data = df.iloc[-1]
 
@@ -473,378 +827,661 @@ def fetch_single_stock_main_force_flow(stock_code: str, debug: bool = False) ->
     except Exception as e:
         if debug:
             print(f"[DEBUG] {stock_code}: 异常 - {e}")
+        if raise_errors:
+            raise fetch_engine.BadDataError(f"{stock_code}: {e}") from e
         return None
 
-def save_main_force_cache(df: pd.DataFrame):
+def save_main_force_cache(df: pd.DataFrame, fetched_at: str = None):
     """
     保存主力资金流数据到数据库缓存（超大单 + 大单）
 
     :param df: 包含主力资金流数据的DataFrame
+    :param fetched_at: 抓取时间，默认当前时间
     """
     if df.empty:
         return
 
-    try:
-        conn = database.get_connection()
-        cursor = conn.cursor()
+    database.save_main_force_cache(df, status='ok', fetched_at=fetched_at)
+    print(f"[缓存保存] 已保存 {len(df)} 只股票的主力资金流数据到数据库")
+
+def is_main_force_stale(fetched_at, now: datetime = None) -> bool:
+    """
+    判断一条主力资金流缓存是否过期（由交易日历按交易时段判断）
+
+    - 交易日收盘后（及周末、节假日）抓取的数据当天不再变化，不会过期
+    - 盘中抓取的数据经过 config.MAIN_FORCE_STALE_MINUTES 个交易分钟（午休不计）或收盘后视为过期
+    - 没有抓取时间的旧数据视为过期
+    """
+    return trade_calendar.is_snapshot_stale(fetched_at, now, config.MAIN_FORCE_STALE_MINUTES)
 
-        # 创建主力资金流缓存表（如果不存在）
-        cursor.execute('''CREATE TABLE IF NOT EXISTS main_force_cache (
-                            stock_code TEXT PRIMARY KEY,
-                            cache_date TEXT,
-                            超大单净额 REAL,
-                            大单净额 REAL,
-                            主力净流入 REAL
-                        )''')
+def _main_force_stale_mask(fetched_at: pd.Series, now: datetime) -> pd.Series:
+    """整列判断缓存是否过期（同一批抓取的时间相同，每个不同的抓取时间只判断一次）"""
+    stale = {t: is_main_force_stale(t, now) for t in fetched_at.dropna().unique()}
+    return fetched_at.map(stale).fillna(True).astype(bool)
 
-        trade_date = database.get_stock_trade_date()
+# 全市场主力资金流排行接口的列名 -> 本地列名
+BULK_MAIN_FORCE_COLUMNS = {
+    '今日超大单净流入-净额': '超大单净额',
+    '今日大单净流入-净额': '大单净额',
+}
 
-        # 准备数据
-        df_save = df.copy()
-        if '股票代码' in df_save.columns:
-            df_save = df_save.rename(columns={'股票代码': 'stock_code'})
+def fetch_bulk_main_force_flow() -> pd.DataFrame:
+    """
+    从全市场资金流排行接口一次性获取今日所有股票的主力资金流（超大单 + 大单）
 
-        df_save['cache_date'] = trade_date
+    与逐只获取使用同一数据来源（东方财富），主力净流入同样按 超大单净额 + 大单净额 计算；
+    停牌等没有数据的股票不在结果中，由逐只获取补齐
+    :return: DataFrame，列为 股票代码、超大单净额、大单净额、主力净流入；接口失败时抛出异常
+    """
+    df = data_source.get_provider().stock_individual_fund_flow_rank(indicator='今日')
+    if df is None or df.empty:
+        return pd.DataFrame(columns=['股票代码'] + database.MAIN_FORCE_COLUMNS)
+
+    df.columns = [str(c).strip() for c in df.columns]
+    missing = [c for c in ['代码', *BULK_MAIN_FORCE_COLUMNS] if c not in df.columns]
+    if missing:
+        raise ValueError(f"全市场主力资金流排行缺少列: {missing}")
+
+    # 排行中今日的各档资金流同时存入资金流历史库
+    _save_bulk_fund_flow_history(df)
+
+    result = pd.DataFrame({'股票代码': df['代码'].astype(str).str.strip().str.zfill(6)})
+    for source_col, col in BULK_MAIN_FORCE_COLUMNS.items():
+        result[col] = parse_amount_series(df[source_col]).to_numpy()
+    result['主力净流入'] = result['超大单净额'] + result['大单净额']
+    result = result.dropna(subset=database.MAIN_FORCE_COLUMNS)
+    return result.drop_duplicates('股票代码').reset_index(drop=True)
+
+def get_bulk_main_force_flow() -> pd.DataFrame:
+    """
+    全市场主力资金流排行（内存缓存，过期规则与资金流排行快照相同）
+    未启用（config.MAIN_FORCE_BULK_ENABLED）或接口失败时返回空表，调用方改为逐只获取
+    """
+    if not config.MAIN_FORCE_BULK_ENABLED:
+        return pd.DataFrame()
 
-        # 删除当天旧数据
-        conn.execute("DELETE FROM main_force_cache WHERE cache_date = ?", (trade_date,))
-        conn.commit()
+    cache_key = _snapshot_key(BULK_MAIN_FORCE_PERIOD)
+    df_bulk = _SNAPSHOT_CACHE.get(cache_key)
+    if df_bulk is not None:
+        return df_bulk
 
-        # 保存新数据
-        df_save.to_sql('main_force_cache', conn, if_exists='append', index=False)
+    with _BULK_MAIN_FORCE_LOCK:
+        # 等锁期间可能已由其他线程获取
+        df_bulk = _SNAPSHOT_CACHE.get(cache_key)
+        if df_bulk is not None:
+            return df_bulk
+        try:
+            print("正在从全市场资金流排行获取主力资金流数据（超大单 + 大单）...")
+            df_bulk = fetch_bulk_main_force_flow()
+        except Exception as e:
+            # 失败结果同样缓存，本快照有效期内不再重复请求，全部逐只获取
+            print(f"[WARNING] 获取全市场主力资金流排行失败: {e}，改为逐只获取")
+            df_bulk = pd.DataFrame()
+            _SNAPSHOT_CACHE.put(cache_key, df_bulk)
+            return df_bulk
+        print(f"[OK] 全市场主力资金流排行: {len(df_bulk)} 只股票")
+        _SNAPSHOT_CACHE.put(cache_key, df_bulk)
+        return df_bulk
+
+def _plan_change_refresh(df_cache: pd.DataFrame, stale: pd.Series, snapshot: pd.DataFrame, now: datetime):
+    """
+    变化驱动刷新：盘中已过期的缓存，对比抓取时与当前即时排行中的成交额和净额，
+    变化未超过阈值的沿用上次数据，超过的按变化幅度从大到小重抓
 
-        print(f"[缓存保存] 已保存 {len(df_save)} 只股票的主力资金流数据到数据库")
+    - 成交额增长超过抓取时成交额的 config.MAIN_FORCE_REFRESH_AMOUNT_DELTA
+    - 或净额变化超过抓取时成交额的 config.MAIN_FORCE_REFRESH_NET_DELTA
+    - 沿用的数据距抓取超过 config.MAIN_FORCE_CARRY_MAX_MINUTES 个交易分钟后必须重抓
 
-    except Exception as e:
-        print(f"[缓存保存] 保存失败: {e}")
-    finally:
-        conn.close()
+    :return: (沿用上次数据的掩码, 需重抓股票的变化幅度 Series（股票代码 -> 幅度，>=1 为超过阈值）)
+    """
+    carried = pd.Series(False, index=df_cache.index)
+    if (snapshot is None or df_cache.empty or not config.MAIN_FORCE_CHANGE_REFRESH_ENABLED
+            or not trade_calendar.is_intraday(now)):
+        return carried, pd.Series(dtype=np.float64)
+
+    current = snapshot.drop_duplicates('股票代码').set_index('股票代码')
+    codes = df_cache['股票代码']
+    basis_amount = df_cache['基准成交额'].to_numpy(dtype=np.float64)
+    basis_net = df_cache['基准净额'].to_numpy(dtype=np.float64)
+    amount = codes.map(current['成交额']).to_numpy(dtype=np.float64)
+    net = codes.map(current['净额']).to_numpy(dtype=np.float64)
+
+    # 变化幅度（相对阈值的倍数）；没有基准或当前值时无法比较，视为超过阈值
+    with np.errstate(divide='ignore', invalid='ignore'):
+        scale = np.where(basis_amount > 0, basis_amount, np.nan)
+        change = np.fmax((amount - basis_amount) / (scale * config.MAIN_FORCE_REFRESH_AMOUNT_DELTA),
+                         np.abs(net - basis_net) / (scale * config.MAIN_FORCE_REFRESH_NET_DELTA))
+    change = np.where(np.isnan(change), np.inf, change)
+
+    age = np.nan_to_num(trade_calendar.trading_minutes_since(df_cache['fetched_at'], now), nan=np.inf)
+    candidates = stale.to_numpy() & df_cache['status'].eq('ok').to_numpy()
+    carried[:] = candidates & (change < 1) & (age <= config.MAIN_FORCE_CARRY_MAX_MINUTES)
+    priority = pd.Series(change, index=codes.to_numpy())[candidates & ~carried.to_numpy()]
+    return carried, priority
+
+def _snapshot_activity(df: pd.DataFrame):
+    """即时排行快照中用于变化驱动刷新的列（股票代码、成交额、净额），缺列时返回 None"""
+    if not {'股票代码', '成交额', '净额'}.issubset(df.columns):
+        return None
+    return df[['股票代码', '成交额', '净额']]
 
-def fetch_all_main_force_flow(stock_codes: list, use_cache: bool = True) -> pd.DataFrame:
+def fetch_all_main_force_flow(stock_codes: list, use_cache: bool = True, on_result=None,
+                              snapshot: pd.DataFrame = None) -> pd.DataFrame:
     """
-    批量获取多只股票的主力资金流数据（串行版本，避免API限流）
+    批量获取多只股票的主力资金流数据（增量版本，失败自动重试）
+
+    缓存按股票记录抓取时间和状态，重复运行时只抓取缺失、失败或已过期的股票，
+    再与缓存中仍然有效的数据合并返回。
+    需要抓取的股票先从全市场主力资金流排行中取（一次请求，排行中有的全部使用最新数据），排行中没有的再逐只获取。
+    传入当前即时排行快照时，需要逐只获取的股票中盘中过期的只重抓成交额/净额有明显变化的，其余沿用上次数据。
 
     :param stock_codes: 股票代码列表
     :param use_cache: 是否使用数据库缓存
-    :return: 包含主力资金流数据的DataFrame（超大单净额、大单净额、主力净流入）
+    :param on_result: 每取得一只股票的数据时的回调 on_result(股票代码, 数据字典)，在调用本函数的线程中按完成顺序调用
+                      （逐只抓取时由 fetch_engine.fetch_batch 在调用线程中回调，不在工作线程中）
+    :param snapshot: 当前即时排行快照（股票代码、成交额、净额），用于变化驱动刷新，并作为下次比较的基准保存
+    :return: 包含主力资金流数据的DataFrame（超大单净额、大单净额、主力净流入、主力数据时间）
     """
     if not stock_codes:
         return pd.DataFrame()
 
-    # 1. 尝试从数据库缓存读取
+    result_cols = ['股票代码'] + database.MAIN_FORCE_COLUMNS
+    stock_codes = list(dict.fromkeys(stock_codes))
+
+    # 1. 读取今日缓存，找出需要（重新）抓取的股票
+    df_cache = pd.DataFrame(columns=result_cols + ['fetched_at', 'status'])
+    if use_cache:
+        cached = database.get_main_force_cache()
+        if not cached.empty:
+            df_cache = cached[cached['股票代码'].isin(stock_codes)]
+
+    now = datetime.now()
+    now_str = now.strftime("%Y-%m-%d %H:%M:%S")
+    stale = _main_force_stale_mask(df_cache['fetched_at'], now)
+    valid = df_cache['status'].isin(['ok', 'empty']) & ~stale
+    valid_codes = set(df_cache.loc[valid, '股票代码'])
+    # 缺失、失败或已过期的股票
+    needed = [code for code in stock_codes if code not in valid_codes]
+
+    if on_result is not None:
+        _publish_records(df_cache.loc[valid & df_cache['status'].eq('ok'), result_cols], on_result)
+
+    # 2. 先从全市场主力资金流排行中取（一次请求，排行中有的股票全部使用最新数据）
+    df_bulk = get_bulk_main_force_flow() if needed else pd.DataFrame()
+    if not df_bulk.empty:
+        df_bulk = df_bulk.loc[df_bulk['股票代码'].isin(needed), result_cols]
+        bulk_codes = set(df_bulk['股票代码'])
+        needed = [code for code in needed if code not in bulk_codes]
+        if on_result is not None:
+            _publish_records(df_bulk, on_result)
+
+    # 排行中没有的股票才需要逐只请求：盘中过期的缓存只重抓成交额/净额有明显变化的股票，其余沿用上次数据
+    rest = df_cache['股票代码'].isin(needed)
+    carried, priority = _plan_change_refresh(df_cache[rest], stale[rest], snapshot, now)
+    carried = carried.reindex(df_cache.index, fill_value=False)
+    carried_codes = set(df_cache.loc[carried, '股票代码'])
+    # 没有数据的股票优先，其次按成交额/净额变化幅度从大到小重抓
+    codes_to_fetch = sorted((code for code in needed if code not in carried_codes),
+                            key=lambda code: -priority.get(code, np.inf))
+
+    if use_cache:
+        status_counts = df_cache['status'].value_counts()
+        print(f"[缓存检查] 主力资金流缓存: 有效 {len(valid_codes)} 只 | "
+              f"过期 {int((stale & df_cache['status'].eq('ok')).sum())} 只 | "
+              f"失败 {int(status_counts.get('failed', 0))} 只 | "
+              f"缺失 {len(stock_codes) - len(df_cache)} 只")
+        if carried.any() or len(priority):
+            print(f"[变化驱动刷新] 排行中没有的过期股票中 {len(priority)} 只成交额/净额变化超过阈值需重抓，"
+                  f"{int(carried.sum())} 只变化不大，沿用上次抓取的数据")
+
+    if on_result is not None:
+        _publish_records(df_cache.loc[carried, result_cols], on_result)
+
+    if df_bulk.empty and not codes_to_fetch:
+        print(f"[缓存命中] 从数据库读取到 {len(valid_codes) + len(carried_codes)} 只股票的主力资金流数据")
+        df_result = df_cache.loc[df_cache['status'] == 'ok', result_cols + ['fetched_at']]
+        return df_result.rename(columns={'fetched_at': '主力数据时间'}).reset_index(drop=True)
+
+    if not df_bulk.empty:
+        print(f"[全市场排行] 取得 {len(df_bulk)} 只股票的主力资金流，逐只补抓 {len(codes_to_fetch)} 只")
+
+    # 3. 其余股票逐只从API获取（自适应限速 + 失败重试的并发抓取）
+    fetched, failed_codes = {}, []
+    if codes_to_fetch:
+        total = len(codes_to_fetch)
+        print(f"开始获取{total}只股票的主力资金流数据（自适应限速，最多{config.FETCH_MAX_IN_FLIGHT}个并发请求）...")
+
+        fetched, failed_codes, stats = fetch_engine.fetch_batch(
+            codes_to_fetch,
+            lambda code: fetch_single_stock_main_force_flow(code, raise_errors=True),
+            label='主力资金流',
+            on_result=on_result,
+        )
+
+        print(f"完成！{stats.summary()}")
+        if failed_codes:
+            print(f"[WARNING] {len(failed_codes)} 只股票重试 {config.FETCH_MAX_RETRIES} 次后仍获取失败: "
+                  f"{', '.join(failed_codes[:10])}{' ...' if len(failed_codes) > 10 else ''}")
+
+    df_fetched = pd.DataFrame(list(fetched.values()), columns=result_cols)
+    if not df_bulk.empty:
+        df_fetched = pd.concat([df_bulk, df_fetched], ignore_index=True)
+    df_fetched['主力数据时间'] = now_str
+    if snapshot is not None:
+        # 保存抓取时的成交额和净额，下次盘中刷新时据此判断变化
+        current = snapshot.drop_duplicates('股票代码').set_index('股票代码')
+        df_fetched['基准成交额'] = df_fetched['股票代码'].map(current['成交额'])
+        df_fetched['基准净额'] = df_fetched['股票代码'].map(current['净额'])
+    empty_codes = [code for code in codes_to_fetch if code not in fetched and code not in set(failed_codes)]
+
+    # 4. 增量写回缓存：成功的覆盖；失败的若缓存中仍有旧的成功数据则保留旧值
     if use_cache:
         try:
-            trade_date = database.get_stock_trade_date()
-            conn = database.get_connection()
-
-            # 检查是否存在主力资金流缓存表
-            cursor = conn.cursor()
-            cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='main_force_cache'")
-
-            if cursor.fetchone():
-                # 表存在，尝试读取今日数据
-                query = "SELECT * FROM main_force_cache WHERE cache_date = ?"
-                df_cache = pd.read_sql(query, conn, params=(trade_date,))
-                conn.close()
-
-                if not df_cache.empty:
-                    # 恢复列名
-                    if 'stock_code' in df_cache.columns:
-                        df_cache = df_cache.rename(columns={'stock_code': '股票代码'})
-                    if 'cache_date' in df_cache.columns:
-                        df_cache = df_cache.drop(columns=['cache_date'])
-
-                    print(f"[缓存命中] 从数据库读取到 {len(df_cache)} 只股票的主力资金流数据")
-                    return df_cache
-            else:
-                conn.close()
+            save_main_force_cache(df_fetched, fetched_at=now_str)
+            if empty_codes:
+                database.save_main_force_cache(pd.DataFrame({'股票代码': empty_codes}), status='empty')
+            had_data = set(df_cache.loc[df_cache['status'] == 'ok', '股票代码'])
+            newly_failed = [code for code in failed_codes if code not in had_data]
+            if newly_failed:
+                database.save_main_force_cache(pd.DataFrame({'股票代码': newly_failed}), status='failed')
         except Exception as e:
-            print(f"[缓存读取] 数据库读取失败: {e}，转为API获取")
-
-    # 2. 从API获取（并发线程池版本）
-    total = len(stock_codes)
-    print(f"开始获取{total}只股票的主力资金流数据（并发模式，{_MAX_WORKERS}线程）...")
+            print(f"[缓存保存] 保存主力资金流数据到数据库失败: {e}")
 
-    results = []
-    success_count = [0]  # 使用列表以便在闭包中修改
-    completed_count = [0]
-    start_time = time.time()
+    # 5. 合并：新抓取的数据 + 缓存中仍然可用的数据（有效的、沿用的，以及本次重抓失败但有旧值的），
+    #    主力数据时间 为各股票数据的实际抓取时间
+    df_kept = df_cache[(df_cache['status'] == 'ok') & ~df_cache['股票代码'].isin(df_fetched['股票代码'])]
+    df_kept = df_kept[result_cols + ['fetched_at']].rename(columns={'fetched_at': '主力数据时间'})
+    df_result = pd.concat([df_fetched[result_cols + ['主力数据时间']], df_kept], ignore_index=True)
 
-    # 线程安全的结果收集
-    results_lock = Lock()
+    if df_result.empty:
+        return pd.DataFrame()
+    return df_result
 
-    def fetch_with_progress(code):
-        """带进度更新的获取函数"""
-        result = fetch_single_stock_main_force_flow(code, debug=False)
+def _publish_records(df: pd.DataFrame, on_result):
+    for record in df.to_dict('records'):
+        on_result(record['股票代码'], record)
 
-        # 线程安全地更新结果和计数
-        with results_lock:
-            if result:
-                results.append(result)
-                success_count[0] += 1
+def main_force_score_bounds(df: pd.DataFrame) -> np.ndarray:
+    """
+    抓取主力资金流之前每只股票的综合评分上界（4维度）
+    动量、活跃度、流动性评分已知，增仓评分按可能的最高分计算
+    """
+    sub_scores = calculate_sub_scores_vec(df)
+    sub_scores['增仓评分'] = np.full(len(df), _SCORE_TABLES['position_increase'].max_score)
+    bounds = _weighted_sum(sub_scores, config.COMPREHENSIVE_SCORE_WEIGHTS['without_volume_ratio'])
+    return _round_half_even_like_python(np.asarray(bounds, dtype=np.float64), 1)
+
+def _scores_with_main_force(df: pd.DataFrame, df_main_force: pd.DataFrame) -> np.ndarray:
+    """合并主力资金流后的实际综合评分（4维度，抓取失败的股票按主力净流入为0计，与合并逻辑一致）"""
+    if df_main_force.empty:
+        net = pd.Series(np.nan, index=df.index)
+    else:
+        net = df['股票代码'].map(df_main_force.set_index('股票代码')['主力净流入'])
+    turnover = df['成交额'].to_numpy(dtype=np.float64) if '成交额' in df.columns else np.full(len(df), np.nan)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ratio = net.fillna(0).to_numpy(dtype=np.float64) / np.where(turnover == 0, np.nan, turnover) * 100
+    scored = df[[c for c in ['涨跌幅', '换手率', '成交额'] if c in df.columns]].copy()
+    scored['增仓占比'] = ratio
+    return calculate_comprehensive_score_vec(scored)
+
+def fetch_main_force_flow_pruned(df: pd.DataFrame, top_n: int = None, batch_size: int = None, use_cache: bool = True,
+                                 progress: 'ProgressiveFetch' = None):
+    """
+    分支定界抓取主力资金流：只抓取有可能进入综合评分前 top_n 名的股票
 
-            completed_count[0] += 1
-            current = completed_count[0]
+    1. 按评分上界（增仓评分取最高分）从高到低排序，全市场排行中已有的股票、曾入榜的追踪股票和自选股排在最前
+    2. 先抓取上界最高的 top_n 只（及上述必须抓取的股票），之后每批抓取 batch_size 只，并更新实际评分的第 top_n 名
+    3. 剩余股票的评分上界都低于第 top_n 名的实际评分时停止，它们不可能进入前 top_n 名
+    追踪股票的当日数据会写入回测库，自选股在自选股页面展示并供 AI 分析，两者始终抓取，不会因剪枝缺少增仓占比
 
-            # 每10个更新一次进度（避免刷新过快）
-            if current % 10 == 0 or current == total:
-                progress = current / total * 100
-                elapsed = time.time() - start_time
+    :param df: 待抓取的股票（需含 股票代码、涨跌幅、换手率、成交额）
+    :param top_n: 需要保证准确的名次，默认 config.MAIN_FORCE_PRUNE_TOP_N，None/0 表示全部抓取
+    :param batch_size: 每批抓取数量，默认 config.MAIN_FORCE_PRUNE_BATCH_SIZE
+    :param use_cache: 是否使用数据库缓存
+    :param progress: 逐步发布抓取结果的 ProgressiveFetch（供抓取完成前的临时排名使用）
+    :return: (主力资金流DataFrame, 已尝试抓取的股票代码列表)
+    """
+    codes = df['股票代码'].tolist()
+    top_n = config.MAIN_FORCE_PRUNE_TOP_N if top_n is None else top_n
+    bounds = main_force_score_bounds(df)
+    on_result = progress.publish if progress is not None else None
+    snapshot = _snapshot_activity(df)
+    if not top_n or len(codes) <= top_n:
+        # 不剪枝时同样按评分上界从高到低抓取，临时排名尽早稳定
+        ordered = df['股票代码'].iloc[np.argsort(-bounds, kind='stable')].tolist()
+        df_main_force = fetch_all_main_force_flow(ordered, use_cache, on_result, snapshot)
+        if progress is not None:
+            progress.resolve(ordered)
+        return df_main_force, codes
+
+    batch_size = batch_size or config.MAIN_FORCE_PRUNE_BATCH_SIZE
+    # 全市场排行中已有的股票无需逐只请求，追踪股票需要写入回测库，自选股需要完整展示，都放在首批全部取得；
+    # 其余按评分上界从高到低
+    df_bulk = get_bulk_main_force_flow()
+    required = df['股票代码'].isin(set(database.get_all_tracked_stocks()) | set(database.get_watchlist())).to_numpy()
+    if not df_bulk.empty:
+        required = required | df['股票代码'].isin(df_bulk['股票代码']).to_numpy()
+    order = np.lexsort((-bounds, ~required))
+    bounds = np.where(required, np.inf, bounds)
+
+    frames = []
+    real_scores = np.empty(0)
+    threshold = -np.inf
+    pos = 0
+    while pos < len(order):
+        if len(real_scores) >= top_n and bounds[order[pos]] < threshold:
+            break
+        batch = order[pos:pos + (max(top_n, int(required.sum())) if pos == 0 else batch_size)]
+        # 批内上界已低于当前门槛的股票不再抓取
+        batch = batch[bounds[batch] >= threshold]
+        pos += len(batch)
+
+        batch_df = df.iloc[batch]
+        df_batch_main_force = fetch_all_main_force_flow(batch_df['股票代码'].tolist(), use_cache, on_result, snapshot)
+        if progress is not None:
+            progress.resolve(batch_df['股票代码'])
+        frames.append(df_batch_main_force)
+        real_scores = np.concatenate([real_scores, _scores_with_main_force(batch_df, df_batch_main_force)])
+        if len(real_scores) >= top_n:
+            threshold = np.partition(real_scores, len(real_scores) - top_n)[len(real_scores) - top_n]
+
+    attempted = df.iloc[order[:pos]]['股票代码'].tolist()
+    if progress is not None:
+        # 被跳过的股票不可能进入前 top_n 名，同样视为已确定
+        progress.resolve(df.iloc[order[pos:]]['股票代码'])
+    print(f"[分支定界] 抓取 {len(attempted)}/{len(codes)} 只股票的主力资金流，"
+          f"跳过 {len(codes) - len(attempted)} 只（评分上界低于第{top_n}名实际评分 {threshold:.1f}）")
+    frames = [f for f in frames if not f.empty]
+    df_main_force = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
+    return df_main_force, attempted
+
+def _merge_main_force(df: pd.DataFrame, df_main_force: pd.DataFrame, attempted_codes: list) -> pd.DataFrame:
+    """
+    合并主力资金流数据：已抓取（含抓取失败）的股票缺失值按0处理，
+    被分支定界跳过的股票保持为空（不会进入综合评分前列）
+    """
+    df = df.merge(df_main_force, on='股票代码', how='left')
+    attempted = df['股票代码'].isin(attempted_codes)
+    for col in ['超大单净额', '大单净额', '主力净流入']:
+        df.loc[attempted, col] = df.loc[attempted, col].fillna(0)
+    # 使用主力净流入作为主力净额（超大单 + 大单）
+    df['主力净额'] = df['主力净流入']
+    return df
 
-                if current > 0:
-                    avg_time = elapsed / current
-                    remaining = avg_time * (total - current)
-                    eta_min = int(remaining // 60)
-                    eta_sec = int(remaining % 60)
+class ProgressiveFetch:
+    """
+    主力资金流抓取过程中逐步发布的部分结果（线程安全）
 
-                    print(f"\r进度: {current}/{total} ({progress:.1f}%) | 成功: {success_count[0]} | 速度: {current/elapsed:.1f}个/秒 | 预计剩余: {eta_min}分{eta_sec}秒",
-                          end="", flush=True)
+    抓取按评分上界从高到低进行，每取得一只股票就发布一次；排名层据此在抓取完成前给出临时排名
+    (rank_fund_flow_anytime)。已确定 = 已抓取（含失败、无数据）或被分支定界跳过的股票
+    """
 
-        # 短暂延迟，避免过度并发导致API限流
-        time.sleep(_REQUEST_DELAY)
-        return result
+    def __init__(self, df: pd.DataFrame, period: str = '即时'):
+        self.period = period
+        self.df = df.reset_index(drop=True)
+        self.total = len(self.df)
+        self.bounds = pd.Series(main_force_score_bounds(self.df), index=self.df['股票代码'].to_numpy())
+        self.started_at = time.time()
+        self.finished_at = None
+        self._records = {}
+        self._resolved = set()
+        self._lock = Lock()
+
+    def publish(self, stock_code, record):
+        """发布一只股票的主力资金流（抓取引擎的 on_result 回调）"""
+        with self._lock:
+            self._records[stock_code] = record
+            self._resolved.add(stock_code)
+
+    def resolve(self, stock_codes):
+        """标记股票已确定（抓取失败、无数据或被跳过的股票没有数据）"""
+        with self._lock:
+            self._resolved.update(stock_codes)
+
+    def finish(self):
+        with self._lock:
+            self._resolved.update(self.bounds.index)
+            self.finished_at = time.time()
+
+    @property
+    def done(self) -> bool:
+        return self.finished_at is not None
+
+    @property
+    def completeness(self) -> float:
+        """已确定的股票占比 (0-1)"""
+        with self._lock:
+            return len(self._resolved) / self.total if self.total else 1.0
+
+    def snapshot(self):
+        """
+        当前的部分结果
+        :return: (已抓取股票的DataFrame（含主力净额、增仓占比）, 尚未确定股票的最高评分上界, 完成度)
+        """
+        with self._lock:
+            records = list(self._records.values())
+            resolved = set(self._resolved)
+        df_main_force = pd.DataFrame(records, columns=['股票代码'] + database.MAIN_FORCE_COLUMNS)
+        df = self.df[self.df['股票代码'].isin(df_main_force['股票代码'])]
+        df = df.drop(columns=[c for c in database.MAIN_FORCE_COLUMNS if c in df.columns])
+        df = _merge_main_force(df, df_main_force, df_main_force['股票代码'])
+        if '成交额' in df.columns:
+            df['增仓占比'] = (df['主力净额'] / df['成交额'].replace(0, np.nan)) * 100
+        pending = self.bounds[~self.bounds.index.isin(list(resolved))]
+        pending_bound = float(pending.max()) if len(pending) else -np.inf
+        return df, pending_bound, len(resolved) / self.total if self.total else 1.0
+
+# 各周期最近一次主力资金流抓取的进度
+_PROGRESS = {}
+
+def _start_progress(df: pd.DataFrame, period: str = '即时') -> ProgressiveFetch:
+    progress = ProgressiveFetch(df, period)
+    _PROGRESS[period] = progress
+    return progress
+
+def get_main_force_progress(period: str = '即时'):
+    """最近一次主力资金流抓取的 ProgressiveFetch，没有时返回 None"""
+    return _PROGRESS.get(period)
+
+# -----------------
+# 评分分档查找表（由 config.py 中的分档配置编译而来）
+# -----------------
+
+class ScoreBinTable:
+    """
+    编译后的分档查找表
 
-    # 使用线程池并发处理
-    with ThreadPoolExecutor(max_workers=_MAX_WORKERS) as executor:
-        # 提交所有任务
-        futures = [executor.submit(fetch_with_progress, code) for code in stock_codes]
+    将 config 中的 [(阈值, 分数, 是否包含阈值), ...] 编译为有序阈值数组，
+    查找时用 np.searchsorted 一次完成整列分档；单值查找用 bisect，结果与整列查找一致。
+    “不包含阈值”的档位把阈值换成紧邻的下一个浮点数，从而统一为 >= 比较。
+    """
 
-        # 等待所有任务完成
-        for future in as_completed(futures):
-            try:
-                future.result()
-            except Exception as e:
-                print(f"\n[WARNING] 任务执行异常: {e}")
+    def __init__(self, spec: dict, name: str = ''):
+        self.name = name
+        bins = spec.get('bins', [])
+        thresholds = [float(b[0]) for b in bins]
+        if any(a >= b for a, b in zip(thresholds, thresholds[1:])):
+            raise ValueError(f"分档表 {name} 的阈值必须严格递增: {thresholds}")
+
+        self.edges = np.array([
+            threshold if (len(b) < 3 or b[2]) else np.nextafter(threshold, np.inf)
+            for threshold, b in zip(thresholds, bins)
+        ], dtype=np.float64)
+        self._edge_list = self.edges.tolist()
+
+        # 索引 0 为“低于第一档”，索引 i 为第 i 档
+        self.values = [spec.get('below')] + [b[1] for b in bins]
+        self.missing = spec.get('missing')
+        self.below_linear = spec.get('below_linear')
+
+        # 嵌套分档（如放量等级先按成交额、再按换手率分档）
+        self.nested = any(isinstance(v, dict) for v in self.values)
+        if self.nested:
+            self.values = [
+                ScoreBinTable(v, f"{name}[{i}]") if isinstance(v, dict) else v
+                for i, v in enumerate(self.values)
+            ]
+            self._value_array = None
+        else:
+            self._value_array = np.array(self.values)
+
+    @property
+    def max_score(self) -> float:
+        """查找表可能给出的最高分（用于计算评分上界）"""
+        if self.nested:
+            raise ValueError(f"嵌套分档表 {self.name} 没有单一的最高分")
+        candidates = list(self.values[1:])
+        if self.below_linear is None:
+            candidates.append(self.values[0])
+        else:
+            rule = self.below_linear
+            if rule['slope'] <= 0 or not len(self.edges):
+                return float('inf')
+            candidates.append(max(rule['floor'], rule['intercept'] + self.edges[0] * rule['slope']))
+        if self.missing is not None:
+            candidates.append(self.missing)
+        return float(max(candidates))
+
+    def _linear_below(self, values):
+        rule = self.below_linear
+        return np.maximum(rule['floor'], rule['intercept'] + values * rule['slope'])
+
+    def lookup(self, values) -> np.ndarray:
+        """整列分档查找，values 为 float64 数组"""
+        values = np.asarray(values, dtype=np.float64)
+        idx = np.searchsorted(self.edges, values, side='right')
+        result = self._value_array[idx]
+        if result.dtype.kind in 'iu':
+            result = result.astype(np.float64)
+
+        if self.below_linear is not None:
+            below = idx == 0
+            result[below] = self._linear_below(values[below])
+
+        missing = np.isnan(values)
+        if missing.any():
+            if result.dtype.kind in 'fiu':
+                result = result.astype(np.float64)
+            else:
+                result = result.astype(object)
+            result[missing] = self.missing
+        return result
 
-    # 完成后换行
-    elapsed_total = int(time.time() - start_time)
-    print(f"\n完成！成功获取 {success_count[0]}/{total} 只股票的主力资金流数据")
-    print(f"总耗时: {elapsed_total}秒 | 平均速度: {total/elapsed_total:.1f}个/秒")
+    def lookup_nested(self, values, inner_values) -> np.ndarray:
+        """两级分档查找：先用 values 选外层档位，再在档内用 inner_values 查找"""
+        values = np.asarray(values, dtype=np.float64)
+        inner_values = np.asarray(inner_values, dtype=np.float64)
+        idx = np.searchsorted(self.edges, values, side='right')
 
-    if results:
-        df_result = pd.DataFrame(results)
+        result = np.empty(len(values), dtype=object)
+        for i, table in enumerate(self.values):
+            mask = idx == i
+            if mask.any():
+                result[mask] = table.lookup(inner_values[mask])
 
-        # 3. 保存到数据库缓存
-        if use_cache and not df_result.empty:
-            try:
-                save_main_force_cache(df_result)
-            except Exception as e:
-                print(f"[缓存保存] 保存主力资金流数据到数据库失败: {e}")
+        result[np.isnan(values) | np.isnan(inner_values)] = self.missing
+        return result
 
-        return df_result
-    else:
-        return pd.DataFrame()
+    def lookup_scalar(self, value):
+        """单值分档查找"""
+        if pd.isna(value):
+            return self.missing
+        value = float(value)
+        idx = bisect.bisect_right(self._edge_list, value)
+        if idx == 0 and self.below_linear is not None:
+            rule = self.below_linear
+            return max(rule['floor'], rule['intercept'] + value * rule['slope'])
+        return self.values[idx]
+
+    def lookup_scalar_nested(self, value, inner_value):
+        """两级分档单值查找"""
+        if pd.isna(value) or pd.isna(inner_value):
+            return self.missing
+        table = self.values[bisect.bisect_right(self._edge_list, float(value))]
+        return table.lookup_scalar(inner_value)
+
+
+def compile_score_tables() -> dict:
+    """将 config 中的分档配置编译为查找表（模块加载时自动执行一次）"""
+    specs = {
+        'position_increase': config.POSITION_INCREASE_SCORE_BINS,
+        'price_momentum': config.PRICE_MOMENTUM_SCORE_BINS,
+        'turnover_rate': config.TURNOVER_RATE_SCORE_BINS,
+        'turnover_amount': config.TURNOVER_AMOUNT_SCORE_BINS,
+        'volume_ratio': config.VOLUME_RATIO_SCORE_BINS,
+        'volume_level': config.VOLUME_LEVEL_BINS,
+        'turnover_level': config.TURNOVER_LEVEL_BINS,
+    }
+    return {name: ScoreBinTable(spec, name) for name, spec in specs.items()}
+
+_SCORE_TABLES = compile_score_tables()
+
+def reload_score_tables():
+    """重新编译分档查找表（修改 config 中的阈值后调用，无需重启）"""
+    global _SCORE_TABLES
+    _SCORE_TABLES = compile_score_tables()
+    return _SCORE_TABLES
+
+def _parse_percent(value):
+    """处理字符串格式的百分比（如 "5.23%" 或 "-3.45%"）"""
+    if isinstance(value, str):
+        return float(value.replace('%', ''))
+    return value
 
 def calculate_price_momentum_score(price_change):
     """
     计算涨跌幅评分 (0-100分) - 严格标准
-    评估价格动量强度
-    """
-    if pd.isna(price_change):
-        return 0
-
-    # 处理字符串格式（如 "5.23%" 或 "-3.45%"）
-    if isinstance(price_change, str):
-        price_change = float(price_change.replace('%', ''))
-
-    pct = float(price_change)
-
-    if pct >= 9.9:  # 涨停或接近涨停
-        return 100
-    elif pct >= 8:  # 强势上涨
-        return 90
-    elif pct >= 6:  # 较强上涨
-        return 80
-    elif pct >= 4:  # 温和上涨
-        return 70
-    elif pct >= 2:  # 小幅上涨
-        return 60
-    elif pct >= 1:  # 微涨
-        return 50
-    elif pct >= 0:  # 平盘附近
-        return 40
-    elif pct >= -2:  # 小幅下跌
-        return 30
-    elif pct >= -4:  # 明显下跌
-        return 20
-    elif pct >= -6:  # 大幅下跌
-        return 10
-    else:  # 暴跌
-        return 0
+    评估价格动量强度，分档见 config.PRICE_MOMENTUM_SCORE_BINS
+    """
+    return _SCORE_TABLES['price_momentum'].lookup_scalar(_parse_percent(price_change))
 
 def calculate_turnover_rate_score(turnover_rate):
     """
     计算换手率评分 (0-100分) - 严格标准
-    评估交易活跃度，理想范围5-10%（缩窄）
+    评估交易活跃度，理想范围5-10%，分档见 config.TURNOVER_RATE_SCORE_BINS
     """
-    if pd.isna(turnover_rate):
-        return 0
-
-    # 处理字符串格式
-    if isinstance(turnover_rate, str):
-        turnover_rate = float(turnover_rate.replace('%', ''))
-
-    rate = float(turnover_rate)
-
-    if 5 <= rate <= 10:  # 最理想活跃范围（缩窄）
-        return 100
-    elif 3 <= rate < 5 or 10 < rate <= 15:  # 可接受
-        return 80
-    elif 2 <= rate < 3 or 15 < rate <= 20:  # 偏离理想
-        return 60
-    elif 1 <= rate < 2 or 20 < rate <= 30:  # 过低或过高
-        return 40
-    else:  # 极端情况（换手率过低或过高都不好）
-        return 20
+    return _SCORE_TABLES['turnover_rate'].lookup_scalar(_parse_percent(turnover_rate))
 
 def calculate_turnover_amount_score(turnover_amount):
     """
     计算成交额评分 (0-100分) - 严格标准
-    评估流动性，成交额越大越能保证真实性
-    """
-    if pd.isna(turnover_amount) or turnover_amount <= 0:
-        return 0
-
-    amount = float(turnover_amount)
-
-    if amount >= 20_0000_0000:  # >= 20亿
-        return 100
-    elif amount >= 10_0000_0000:  # >= 10亿
-        return 85
-    elif amount >= 5_0000_0000:  # >= 5亿
-        return 70
-    elif amount >= 2_0000_0000:  # >= 2亿
-        return 55
-    elif amount >= 1_0000_0000:  # >= 1亿
-        return 40
-    else:  # < 1亿
-        return 20
+    评估流动性，成交额越大越能保证真实性，分档见 config.TURNOVER_AMOUNT_SCORE_BINS
+    """
+    return _SCORE_TABLES['turnover_amount'].lookup_scalar(turnover_amount)
 
 def calculate_position_increase_score(position_ratio):
     """
     计算增仓评分 (0-100分) - 严格标准
-    根据增仓占比计算分数，提高门槛
-    """
-    if pd.isna(position_ratio):
-        return 0
-
-    # 处理字符串格式（如 "20.01%" 或 "-5.3%"）
-    if isinstance(position_ratio, str):
-        position_ratio = float(position_ratio.replace('%', ''))
-
-    ratio = float(position_ratio)
-
-    if ratio >= 25:  # 超强增仓
-        return 100
-    elif ratio >= 20:  # 强增仓
-        return 90
-    elif ratio >= 15:  # 明显增仓
-        return 80
-    elif ratio >= 12:  # 较强增仓
-        return 70
-    elif ratio >= 10:  # 中等增仓
-        return 60
-    elif ratio >= 8:  # 温和增仓
-        return 50
-    elif ratio >= 6:  # 小幅增仓
-        return 40
-    elif ratio >= 4:  # 微增仓
-        return 30
-    elif ratio >= 2:  # 弱增仓
-        return 20
-    elif ratio >= 0:  # 几乎无增仓
-        return 10
-    else:
-        # 负增仓（资金流出），严格扣分
-        return max(0, 10 + ratio * 3)  # 每-1%扣3分
+    根据增仓占比计算分数，负增仓按每-1%扣3分，分档见 config.POSITION_INCREASE_SCORE_BINS
+    """
+    return _SCORE_TABLES['position_increase'].lookup_scalar(_parse_percent(position_ratio))
 
 def classify_turnover_level(row):
     """
     基于成交额和换手率判断放量等级（无需历史数据）
 
-    逻辑：
+    逻辑（分档见 config.TURNOVER_LEVEL_BINS）：
     - 成交额大 + 换手率高 = 明显放量
     - 成交额适中 + 换手率高 = 温和放量
     - 成交额大 + 换手率低 = 大盘股正常
     - 成交额小 + 换手率低 = 缩量
     """
     turnover_amount = row.get('成交额', 0)
-    turnover_rate = row.get('换手率', 0)
-
-    # 处理换手率字符串格式
-    if isinstance(turnover_rate, str):
-        turnover_rate = float(turnover_rate.replace('%', ''))
-
-    if pd.isna(turnover_amount) or pd.isna(turnover_rate):
-        return "数据缺失"
-
-    turnover_amount = float(turnover_amount)
-    turnover_rate = float(turnover_rate)
-
-    # 判断逻辑
-    if turnover_amount >= 10_0000_0000:  # >= 10亿
-        if turnover_rate >= 10:
-            return "强放量"
-        elif turnover_rate >= 5:
-            return "明显放量"
-        elif turnover_rate >= 3:
-            return "温和放量"
-        else:
-            return "正常"
-    elif turnover_amount >= 5_0000_0000:  # >= 5亿
-        if turnover_rate >= 15:
-            return "强放量"
-        elif turnover_rate >= 8:
-            return "明显放量"
-        elif turnover_rate >= 5:
-            return "温和放量"
-        else:
-            return "正常"
-    elif turnover_amount >= 2_0000_0000:  # >= 2亿
-        if turnover_rate >= 20:
-            return "明显放量"
-        elif turnover_rate >= 10:
-            return "温和放量"
-        else:
-            return "正常"
-    else:  # < 2亿
-        if turnover_rate >= 15:
-            return "温和放量"
-        elif turnover_rate >= 5:
-            return "正常"
-        else:
-            return "缩量"
+    turnover_rate = _parse_percent(row.get('换手率', 0))
+    return _SCORE_TABLES['turnover_level'].lookup_scalar_nested(turnover_amount, turnover_rate)
 
 def calculate_volume_ratio_score(volume_ratio):
     """
     计算量比评分 (0-100分) - 严格标准
-    评估成交量变化，量比越大表示资金关注度越高
-    """
-    if pd.isna(volume_ratio) or volume_ratio <= 0:
-        return 0
-
-    ratio = float(volume_ratio)
-
-    if ratio >= 5:  # 巨量
-        return 100
-    elif ratio >= 3:  # 强放量
-        return 90
-    elif ratio >= 2:  # 明显放量
-        return 80
-    elif ratio >= 1.5:  # 温和放量
-        return 70
-    elif ratio >= 1.2:  # 小幅放量
-        return 60
-    elif ratio >= 0.8:  # 正常
-        return 40
-    else:  # 缩量
-        return 20
+    评估成交量变化，量比越大表示资金关注度越高，分档见 config.VOLUME_RATIO_SCORE_BINS
+    """
+    return _SCORE_TABLES['volume_ratio'].lookup_scalar(volume_ratio)
 
 def calculate_comprehensive_score(row):
     """
     计算综合评分 (0-100分) - 多维度评分系统
 
-    评分维度和权重:
+    评分维度和权重 (见 config.COMPREHENSIVE_SCORE_WEIGHTS):
     - 增仓占比 45%: 资金流入强度（核心指标）
     - 涨跌幅   18%: 价格动量（趋势确认）
     - 换手率   13.5%: 交易活跃度（市场关注）
@@ -856,103 +1493,181 @@ def calculate_comprehensive_score(row):
     - 多维度验证，降低单一指标误判风险
     - 量比可选，未计算时自动调整权重
     """
-    # 1. 增仓占比评分
-    position_ratio = row.get('增仓占比', 0)
-    position_score = calculate_position_increase_score(position_ratio)
-
-    # 2. 涨跌幅评分
-    price_change = row.get('涨跌幅', 0)
-    momentum_score = calculate_price_momentum_score(price_change)
-
-    # 3. 换手率评分
-    turnover_rate = row.get('换手率', 0)
-    activity_score = calculate_turnover_rate_score(turnover_rate)
-
-    # 4. 成交额评分
-    turnover_amount = row.get('成交额', 0)
-    liquidity_score = calculate_turnover_amount_score(turnover_amount)
-
-    # 5. 量比评分（可选）
+    sub_scores = {
+        '增仓评分': calculate_position_increase_score(row.get('增仓占比', 0)),
+        '动量评分': calculate_price_momentum_score(row.get('涨跌幅', 0)),
+        '活跃度评分': calculate_turnover_rate_score(row.get('换手率', 0)),
+        '流动性评分': calculate_turnover_amount_score(row.get('成交额', 0)),
+    }
+
+    # 量比评分（可选）
     volume_ratio = row.get('当日量比', None)
     has_volume_ratio = pd.notna(volume_ratio) and volume_ratio > 0
 
     if has_volume_ratio:
         # 有量比数据：5维度评分
-        volume_score = calculate_volume_ratio_score(volume_ratio)
-        comprehensive = (
-            position_score * 0.45 +
-            momentum_score * 0.18 +
-            activity_score * 0.135 +
-            liquidity_score * 0.135 +
-            volume_score * 0.10
-        )
+        sub_scores['量比评分'] = calculate_volume_ratio_score(volume_ratio)
+        weights = config.COMPREHENSIVE_SCORE_WEIGHTS['with_volume_ratio']
     else:
         # 无量比数据：4维度评分（原权重）
-        comprehensive = (
-            position_score * 0.50 +
-            momentum_score * 0.20 +
-            activity_score * 0.15 +
-            liquidity_score * 0.15
-        )
+        weights = config.COMPREHENSIVE_SCORE_WEIGHTS['without_volume_ratio']
+
+    comprehensive = 0
+    for col, weight in weights:
+        comprehensive = comprehensive + sub_scores[col] * weight
 
     return round(comprehensive, 1)
 
 def classify_volume_level(volume_ratio):
     """
-    根据量比值分类放量等级
-    """
-    if pd.isna(volume_ratio) or volume_ratio <= 0:
-        return "数据缺失"
-    elif volume_ratio < 0.8:
-        return "萎缩"
-    elif volume_ratio < 1.2:
-        return "正常"
-    elif volume_ratio < 1.8:
-        return "温和放量"
-    elif volume_ratio < 2.5:
-        return "明显放量"
-    elif volume_ratio < 5:
-        return "强放量"
-    else:
-        return "巨量"
+    根据量比值分类放量等级，分档见 config.VOLUME_LEVEL_BINS
+    """
+    return _SCORE_TABLES['volume_level'].lookup_scalar(volume_ratio)
 
-def calculate_volume_ratio_local(stock_code):
+# -----------------
+# 向量化评分引擎（整列查表，与上面的逐行评分函数结果完全一致）
+# -----------------
+
+def _to_float_array(values) -> np.ndarray:
     """
-    本地计算量比，避免API限制
-    量比 = 今日成交量 / 近5日平均成交量
+    将一列数据转为 float64 数组
+    兼容 "5.23%" 形式的字符串，无法解析的值记为 NaN
     """
-    try:
-        # 获取最近10天的历史数据（确保有足够数据计算5日均量）
-        end_date = datetime.now().strftime("%Y%m%d")
-        start_date = (datetime.now() - timedelta(days=15)).strftime("%Y%m%d")
+    series = values if isinstance(values, pd.Series) else pd.Series(values)
+    if not pd.api.types.is_numeric_dtype(series):
+        series = pd.to_numeric(series.astype(str).str.replace('%', '', regex=False), errors='coerce')
+    return pd.to_numeric(series, errors='coerce').to_numpy(dtype=np.float64, na_value=np.nan)
+
+def _column_as_array(df: pd.DataFrame, col: str, default=0) -> np.ndarray:
+    """取出DataFrame中的一列（列不存在时按逐行评分的 row.get 默认值填充）"""
+    if col in df.columns:
+        return _to_float_array(df[col])
+    return np.full(len(df), np.nan if default is None else default, dtype=np.float64)
+
+def _round_half_even_like_python(values: np.ndarray, ndigits: int = 1) -> np.ndarray:
+    """
+    与 Python 内置 round 结果一致的向量化四舍五入
 
-        df = ak.stock_zh_a_hist(symbol=stock_code, period="daily", start_date=start_date, end_date=end_date, adjust="")
+    np.round 先乘 10^n 再取整，在 x.x5 附近的浮点误差会导致与 round() 结果不同，
+    这类“临界值”退回到 Python round 逐个计算（通常只有极少数）
+    """
+    rounded = np.round(values, ndigits)
+    scaled = values * (10 ** ndigits)
+    near_tie = np.abs(scaled - np.floor(scaled) - 0.5) < 1e-6
+    if near_tie.any():
+        rounded[near_tie] = [round(float(v), ndigits) for v in values[near_tie]]
+    return rounded
+
+def calculate_position_increase_score_vec(values) -> np.ndarray:
+    """增仓评分（向量化版，对应 calculate_position_increase_score）"""
+    return _SCORE_TABLES['position_increase'].lookup(_to_float_array(values))
+
+def calculate_price_momentum_score_vec(values) -> np.ndarray:
+    """涨跌幅评分（向量化版，对应 calculate_price_momentum_score）"""
+    return _SCORE_TABLES['price_momentum'].lookup(_to_float_array(values))
+
+def calculate_turnover_rate_score_vec(values) -> np.ndarray:
+    """换手率评分（向量化版，对应 calculate_turnover_rate_score）"""
+    return _SCORE_TABLES['turnover_rate'].lookup(_to_float_array(values))
+
+def calculate_turnover_amount_score_vec(values) -> np.ndarray:
+    """成交额评分（向量化版，对应 calculate_turnover_amount_score）"""
+    return _SCORE_TABLES['turnover_amount'].lookup(_to_float_array(values))
+
+def calculate_volume_ratio_score_vec(values) -> np.ndarray:
+    """量比评分（向量化版，对应 calculate_volume_ratio_score）"""
+    return _SCORE_TABLES['volume_ratio'].lookup(_to_float_array(values))
+
+def classify_volume_level_vec(values) -> np.ndarray:
+    """量比放量等级（向量化版，对应 classify_volume_level）"""
+    return _SCORE_TABLES['volume_level'].lookup(_to_float_array(values))
+
+def classify_turnover_level_vec(df: pd.DataFrame) -> np.ndarray:
+    """放量等级（向量化版，对应 classify_turnover_level）"""
+    return _SCORE_TABLES['turnover_level'].lookup_nested(
+        _column_as_array(df, '成交额'), _column_as_array(df, '换手率')
+    )
+
+def calculate_sub_scores_vec(df: pd.DataFrame) -> dict:
+    """一次性计算各维度子评分（向量化），返回 {列名: ndarray}"""
+    return {
+        '增仓评分': calculate_position_increase_score_vec(_column_as_array(df, '增仓占比')),
+        '动量评分': calculate_price_momentum_score_vec(_column_as_array(df, '涨跌幅')),
+        '活跃度评分': calculate_turnover_rate_score_vec(_column_as_array(df, '换手率')),
+        '流动性评分': calculate_turnover_amount_score_vec(_column_as_array(df, '成交额')),
+    }
+
+def _weighted_sum(sub_scores: dict, weights: list) -> np.ndarray:
+    """按权重顺序累加子评分（累加顺序与逐行评分一致，保证浮点结果相同）"""
+    total = 0
+    for col, weight in weights:
+        total = total + sub_scores[col] * weight
+    return total
+
+def calculate_comprehensive_score_vec(df: pd.DataFrame, sub_scores: dict = None) -> np.ndarray:
+    """
+    综合评分（向量化版，对应 calculate_comprehensive_score）
 
-        if df.empty or len(df) < 2:
-            return np.nan
+    :param df: 股票数据
+    :param sub_scores: 已计算好的子评分（calculate_sub_scores_vec 的返回值），避免重复计算
+    :return: 与 df 行顺序一致的综合评分数组
+    """
+    if sub_scores is None:
+        sub_scores = calculate_sub_scores_vec(df)
 
-        # 按日期升序排序
-        df = df.sort_values('日期')
+    volume_ratio = _column_as_array(df, '当日量比', default=None)
+    with np.errstate(invalid='ignore'):
+        has_volume_ratio = ~np.isnan(volume_ratio) & (volume_ratio > 0)
 
-        # 今日成交量（最后一行）
-        today_volume = df.iloc[-1]['成交量']
+    # 无量比数据：4维度评分（原权重）
+    comprehensive = _weighted_sum(sub_scores, config.COMPREHENSIVE_SCORE_WEIGHTS['without_volume_ratio'])
 
-        # 近5日平均成交量（倒数第2到第6行，不包括今天）
-        if len(df) >= 6:
-            avg_volume_5d = df.iloc[-6:-1]['成交量'].mean()
-        elif len(df) >= 2:
-            # 数据不足5日，用全部历史数据（排除今天）
-            avg_volume_5d = df.iloc[:-1]['成交量'].mean()
-        else:
-            return np.nan
+    # 有量比数据：5维度评分
+    if has_volume_ratio.any():
+        scores_5d = dict(sub_scores, 量比评分=calculate_volume_ratio_score_vec(volume_ratio))
+        score_5d = _weighted_sum(scores_5d, config.COMPREHENSIVE_SCORE_WEIGHTS['with_volume_ratio'])
+        comprehensive = np.where(has_volume_ratio, score_5d, comprehensive)
 
-        # 避免除以0
-        if avg_volume_5d == 0 or pd.isna(avg_volume_5d):
-            return np.nan
+    return _round_half_even_like_python(np.asarray(comprehensive, dtype=np.float64), 1)
 
-        volume_ratio = today_volume / avg_volume_5d
-        return round(volume_ratio, 2)
+def fetch_volume_history(stock_code) -> np.ndarray:
+    """读取最近15天的日成交量（按日期升序，最后一个为今日），从本地日线库读取，只补抓缺失的交易日"""
+    df = bar_store.get_daily_bars(stock_code, days=15)
+    return df['成交量'].to_numpy(dtype=np.float64)
 
+def calculate_volume_ratio_vec(volume_histories: list) -> np.ndarray:
+    """
+    一次性计算多只股票的量比（向量化）
+    量比 = 今日成交量 / 近5日平均成交量（不足5日时用全部历史，排除今天）
+
+    :param volume_histories: 每只股票的成交量数组（按日期升序），缺失为 None
+    :return: 量比数组（保留2位小数），数据不足或均量为0时为 NaN
+    """
+    n = len(volume_histories)
+    # 右对齐填充为 (股票数, 6) 的矩阵: 前5列为近5日，最后一列为今日
+    volumes = np.full((n, 6), np.nan)
+    for i, history in enumerate(volume_histories):
+        if history is None or len(history) < 2:
+            continue
+        tail = np.asarray(history[-6:], dtype=np.float64)
+        volumes[i, 6 - len(tail):] = tail
+
+    today = volumes[:, -1]
+    history = volumes[:, :-1]
+    counts = (~np.isnan(history)).sum(axis=1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        avg_5d = np.where(counts > 0, np.nansum(history, axis=1) / counts, np.nan)
+        ratio = today / avg_5d
+    ratio[(avg_5d == 0) | np.isnan(avg_5d) | ~np.isfinite(ratio)] = np.nan
+    return _round_half_even_like_python(ratio, 2)
+
+def calculate_volume_ratio_local(stock_code):
+    """
+    本地计算量比，避免API限制
+    量比 = 今日成交量 / 近5日平均成交量
+    """
+    try:
+        return calculate_volume_ratio_vec([fetch_volume_history(stock_code)])[0]
     except Exception:
         # 静默失败，返回NaN
         return np.nan
@@ -969,7 +1684,7 @@ def add_pe_ratio_for_stocks(df: pd.DataFrame) -> pd.DataFrame:
     try:
         print(f"正在获取市盈率(PE)数据...")
         # 获取全市场行情数据（包含PE）
-        spot_df = ak.stock_zh_a_spot_em()
+        spot_df = data_source.get_provider().stock_zh_a_spot_em()
 
         if spot_df.empty:
             print("警告: 未能获取市场行情数据")
@@ -1005,48 +1720,52 @@ def add_pe_ratio_for_stocks(df: pd.DataFrame) -> pd.DataFrame:
 
     return df
 
-def add_volume_ratio_for_top_stocks(df: pd.DataFrame) -> pd.DataFrame:
+def add_volume_ratio_for_top_stocks(df: pd.DataFrame, deadline_seconds: float = None) -> pd.DataFrame:
     """
     为筛选后的股票列表计算量比并重新评分
 
     用于两步筛选的第二步：对Top 500计算量比
-    - 逐个计算量比（今日成交量 / 近5日均量）
+    - 并发读取日成交量（共享限速器），再一次性向量化计算量比（今日成交量 / 近5日均量）
+    - 超过截止时间仍未拿到数据的股票不再等待，保持4维度评分
     - 添加量比评分
     - 重新计算5维度综合评分
+
+    :param deadline_seconds: 本步骤最长耗时（秒），默认 config.VOLUME_RATIO_DEADLINE_SECONDS，None 表示等待全部完成
     """
     if df.empty or '股票代码' not in df.columns:
         return df
 
-    total = len(df)
-    print(f"开始计算{total}只股票的量比...")
-
-    volume_ratios = {}
-    success_count = 0
-
-    for idx, (_, row) in enumerate(df.iterrows()):
-        code = row['股票代码']
+    global _HISTORY_LIMITER
+    with _HISTORY_LIMITER_LOCK:
+        if _HISTORY_LIMITER is None:
+            _HISTORY_LIMITER = fetch_engine.AdaptiveRateLimiter()
 
-        # 显示进度（每50个打印一次）
-        if (idx + 1) % 50 == 0 or (idx + 1) == total:
-            print(f"  进度: {idx + 1}/{total}")
+    if deadline_seconds is None:
+        deadline_seconds = config.VOLUME_RATIO_DEADLINE_SECONDS
+    deadline = time.monotonic() + deadline_seconds if deadline_seconds else None
 
-        ratio = calculate_volume_ratio_local(code)
-        if not pd.isna(ratio):
-            success_count += 1
-        volume_ratios[code] = ratio
+    codes = df['股票代码'].tolist()
+    total = len(codes)
+    print(f"开始计算{total}只股票的量比（最多{config.FETCH_MAX_IN_FLIGHT}个并发请求"
+          f"{f'，最长等待{deadline_seconds}秒' if deadline else ''}）...")
 
-        # 避免请求过快
-        time.sleep(0.05)
+    histories, failed_codes, stats = fetch_engine.fetch_batch(
+        list(dict.fromkeys(codes)), fetch_volume_history,
+        limiter=_HISTORY_LIMITER, label='量比', deadline=deadline,
+    )
 
     # 添加量比列
-    df['当日量比'] = df['股票代码'].map(volume_ratios)
-    print(f"成功计算 {success_count}/{total} 只股票的量比")
+    df['当日量比'] = calculate_volume_ratio_vec([histories.get(code) for code in codes])
+    success_count = int(df['当日量比'].notna().sum())
+    print(f"成功计算 {success_count}/{total} 只股票的量比 | {stats.summary()}")
+    if stats.timed_out:
+        print(f"[WARNING] {len(stats.timed_out)} 只股票未在截止时间内获取到日线，使用4维度评分")
 
     # 添加量比评分
-    df['量比评分'] = df['当日量比'].apply(calculate_volume_ratio_score)
+    df['量比评分'] = calculate_volume_ratio_score_vec(df['当日量比'])
 
     # 重新计算综合评分（现在包含量比）
-    df['综合评分'] = df.apply(calculate_comprehensive_score, axis=1)
+    df['综合评分'] = calculate_comprehensive_score_vec(df)
 
     return df
 
@@ -1070,17 +1789,16 @@ def add_comprehensive_scores(df: pd.DataFrame) -> pd.DataFrame:
 
     print(f"正在计算多维度综合评分（极速模式）...")
 
-    # 计算综合评分（已包含所有子维度评分）
-    df['综合评分'] = df.apply(calculate_comprehensive_score, axis=1)
+    # 整列计算各维度评分（每个维度只算一次），再合成综合评分
+    sub_scores = calculate_sub_scores_vec(df)
+    df['综合评分'] = calculate_comprehensive_score_vec(df, sub_scores)
 
-    # 单独计算各维度评分用于展示（可选）
-    df['增仓评分'] = df['增仓占比'].apply(calculate_position_increase_score)
-    df['动量评分'] = df['涨跌幅'].apply(calculate_price_momentum_score)
-    df['活跃度评分'] = df['换手率'].apply(calculate_turnover_rate_score)
-    df['流动性评分'] = df['成交额'].apply(calculate_turnover_amount_score)
+    # 各维度评分用于展示
+    for col, scores in sub_scores.items():
+        df[col] = scores
 
     # 添加放量等级（基于成交额和换手率）
-    df['放量等级'] = df.apply(classify_turnover_level, axis=1)
+    df['放量等级'] = classify_turnover_level_vec(df)
 
     # 统计综合评分分布
     score_ranges = [
@@ -1097,6 +1815,43 @@ def add_comprehensive_scores(df: pd.DataFrame) -> pd.DataFrame:
 
     return df
 
+def rank_fund_flow_anytime(progress: ProgressiveFetch = None, top_n: int = None):
+    """
+    随时可用的临时排名：主力资金流抓取未完成时，按已抓取股票的4维度综合评分给出前 top_n 名
+
+    尚未抓取的股票评分上界都不超过某个分数时，评分高于它的名次不会再被超过，标记为已确定；
+    抓取完成后结果与 rank_fund_flow(..., enable_volume_ratio=False) 的综合评分排名一致
+
+    :param progress: ProgressiveFetch，默认为即时数据最近一次抓取的进度
+    :param top_n: 返回前N名，默认 config.TOP_N
+    :return: (排名DataFrame（含 名次已确定 列）, 进度信息字典)；还没有任何抓取时返回 (None, None)
+    """
+    progress = progress or get_main_force_progress('即时')
+    if progress is None:
+        return None, None
+    top_n = top_n or config.TOP_N
+
+    df, pending_bound, completeness = progress.snapshot()
+    fetched = len(df)
+    if not df.empty:
+        df['综合评分'] = calculate_comprehensive_score_vec(df)
+        df = df.sort_values('综合评分', ascending=False, kind='stable').head(top_n).reset_index(drop=True)
+        df['名次已确定'] = df['综合评分'] > pending_bound
+        # 前面的名次未确定时，后面的名次也可能被插队
+        df['名次已确定'] = df['名次已确定'].cummin()
+    else:
+        df['名次已确定'] = pd.Series(dtype=bool)
+
+    info = {
+        'completeness': completeness,
+        'fetched': fetched,
+        'total': progress.total,
+        'confirmed': int(df['名次已确定'].sum()),
+        'done': progress.done,
+        'elapsed': (progress.finished_at or time.time()) - progress.started_at,
+    }
+    return df, info
+
 def rank_fund_flow(fund_flow_df: pd.DataFrame, sort_by: str = 'comprehensive', top_n: int = 50, period: str = None, enable_volume_ratio: bool = True) -> pd.DataFrame:
     """
     对资金流入数据进行排名（两步筛选优化）
@@ -1188,6 +1943,9 @@ def rank_fund_flow(fund_flow_df: pd.DataFrame, sort_by: str = 'comprehensive', t
             # 如果有量比数据，也添加
             if '当日量比' in ranked_df.columns:
                 result_cols.append('当日量比')
+            # 主力资金流数据的抓取时间（盘中变化不大的股票沿用上次抓取的数据）
+            if '主力数据时间' in ranked_df.columns:
+                result_cols.append('主力数据时间')
         else:
             # 其他排序方式：显示主排序列
             result_cols.append(column_name)
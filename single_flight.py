@@ -0,0 +1,84 @@
+# 请求合并 (single-flight): 同一个键同时只执行一次获取，其余并发调用者等待并共享这一次的结果
+# 用于冷缓存时多个 Streamlit 会话 / main.py 的多个线程同时请求同一份数据，避免重复发起全量抓取
+# 只合并进行中的调用，不缓存结果（缓存由快照缓存、数据库缓存负责）；仅在同一进程内生效
+
+import threading
+from threading import Lock
+
+
+class _Call:
+    """一次进行中的获取"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.owner = threading.get_ident()
+        self.waiters = 0
+
+
+class SingleFlight:
+    """
+    按键合并并发调用
+
+    - 第一个调用者执行 fn，期间同键的其他调用者阻塞等待，返回同一个结果（fn 抛出异常时同样抛出）
+    - fn 返回后该键即移除，之后的调用重新执行（应先查缓存再调用 do）
+    - 执行中的线程再次以同键调用时直接执行，不会自己等待自己
+    """
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = Lock()
+        self.executed = 0  # 实际执行 fn 的次数
+        self.shared = 0    # 等待并共享他人结果的次数
+
+    def do(self, key, fn, *args, **kwargs):
+        """
+        执行 fn(*args, **kwargs)，同键已有进行中的调用时等待其结果
+        :param key: 可哈希的键，如 (周期, 交易日, 数据版本)
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            if call is None:
+                call = self._calls[key] = _Call()
+                self.executed += 1
+                leader, reentrant = True, False
+            else:
+                # 同一线程重入时直接执行
+                leader = reentrant = call.owner == threading.get_ident()
+                if reentrant:
+                    self.executed += 1
+                else:
+                    call.waiters += 1
+                    self.shared += 1
+
+        if reentrant:
+            return fn(*args, **kwargs)
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn(*args, **kwargs)
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+    def in_flight(self, key=None) -> int:
+        """进行中的调用数（指定 key 时为该键等待中的调用者数 + 1，无进行中调用时为 0）"""
+        with self._lock:
+            if key is None:
+                return len(self._calls)
+            call = self._calls.get(key)
+            return 0 if call is None else call.waiters + 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {'in_flight': len(self._calls), 'executed': self.executed, 'shared': self.shared}
@@ -0,0 +1,141 @@
+# 进程内快照缓存: 按 (周期, 交易日, 数据版本) 缓存资金流 DataFrame
+# 带过期时间、条目数和内存上限（LRU 淘汰），线程安全，可按周期主动失效
+
+import sys
+import time
+from collections import OrderedDict
+from datetime import datetime
+from threading import Lock
+
+import pandas as pd
+
+import config
+
+
+def estimate_size(value):
+    """估算缓存值占用的内存（字节）"""
+    if isinstance(value, pd.DataFrame):
+        return int(value.memory_usage(deep=True).sum())
+    if isinstance(value, pd.Series):
+        return int(value.memory_usage(deep=True))
+    return sys.getsizeof(value)
+
+
+class SnapshotCache:
+    """
+    带 TTL 和容量上限的快照缓存
+
+    - 键为 (周期, 交易日, 数据版本)：跨交易日自动换键，不会在隔天继续返回昨天的快照
+    - 数据版本由 invalidate(period) 递增：失效前已开始获取的数据写回时落在旧版本的键上，不会被读到
+    - 超过 ttl_seconds 的条目视为过期；超过条目数或内存上限时按最近最少使用淘汰
+    - 可选 is_stale(fetched_at) 回调按数据的获取时间判断过期（如按交易时段，见 trade_calendar.is_snapshot_stale）
+    """
+
+    def __init__(self, max_entries=None, max_bytes=None, ttl_seconds=None, is_stale=None):
+        self.max_entries = max_entries if max_entries is not None else config.SNAPSHOT_CACHE_MAX_ENTRIES
+        self.max_bytes = max_bytes if max_bytes is not None else config.SNAPSHOT_CACHE_MAX_BYTES
+        self.ttl_seconds = ttl_seconds if ttl_seconds is not None else config.SNAPSHOT_CACHE_TTL_SECONDS
+        self.is_stale = is_stale
+
+        self._entries = OrderedDict()  # key -> (value, size, stored_at, fetched_at)
+        self._versions = {}            # period -> 数据版本
+        self._bytes = 0
+        self._lock = Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def version(self, period):
+        """周期当前的数据版本"""
+        with self._lock:
+            return self._versions.get(period, 0)
+
+    def make_key(self, period, trade_date):
+        return period, trade_date, self.version(period)
+
+    def get(self, key, now=None):
+        """读取缓存，未命中或已过期返回 None"""
+        now = now if now is not None else time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            value, size, stored_at, fetched_at = entry
+            if ((self.ttl_seconds is not None and now - stored_at > self.ttl_seconds)
+                    or (self.is_stale is not None and self.is_stale(fetched_at))):
+                self._remove(key)
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value, now=None, fetched_at=None):
+        """
+        写入缓存；单个值超过内存上限时不缓存
+        :param fetched_at: 数据的获取时间（供 is_stale 判断），默认当前时间
+        """
+        now = now if now is not None else time.monotonic()
+        fetched_at = fetched_at if fetched_at is not None else datetime.now()
+        size = estimate_size(value)
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            if self.max_bytes is not None and size > self.max_bytes:
+                return
+            self._entries[key] = (value, size, now, fetched_at)
+            self._bytes += size
+            while self._entries and (len(self._entries) > self.max_entries
+                                     or (self.max_bytes is not None and self._bytes > self.max_bytes)):
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def invalidate(self, period=None):
+        """
+        使某个周期（period=None 时为全部）的缓存失效，并递增其数据版本
+        :return: 删除的条目数
+        """
+        with self._lock:
+            keys = [key for key in self._entries if period is None or key[0] == period]
+            for key in keys:
+                self._remove(key)
+            if period is None:
+                periods = set(self._versions) | {key[0] for key in keys}
+            else:
+                periods = {period}
+            for p in periods:
+                self._versions[p] = self._versions.get(p, 0) + 1
+            return len(keys)
+
+    def clear(self):
+        """清空缓存和计数（不改变数据版本）"""
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+            self.hits = self.misses = self.evictions = self.expirations = 0
+
+    def _remove(self, key):
+        size = self._entries.pop(key)[1]
+        self._bytes -= size
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+    def stats(self):
+        """命中/未命中等计数"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+            }
@@ -0,0 +1,109 @@
+"""
+测试本地日线库：只补抓缺失的交易日、盘中当日K线按时效刷新、除权后整段重抓（模拟接口，无需联网）
+"""
+import time
+from datetime import datetime, timedelta
+import pandas as pd
+import pytest
+import config
+import bar_store
+import rank_flow as rf
+import data_source
+
+
+class FakeHistApi:
+    """模拟日线接口：工作日每天一根K线，盘中的当日K线成交量随时间增长"""
+
+    def __init__(self):
+        self.calls = []
+        self.price_factor = 1.0
+        self.now = None
+
+    def __call__(self, symbol, period, start_date, end_date, adjust):
+        self.calls.append((symbol, start_date, end_date))
+        now = self.now
+        day = datetime.strptime(start_date, "%Y%m%d")
+        end = min(datetime.strptime(end_date, "%Y%m%d"), now)
+        rows = []
+        while day.date() <= end.date():
+            if day.weekday() < 5:
+                is_today = day.date() == now.date()
+                if is_today and now.time() < datetime.strptime(config.MARKET_OPEN_TIME, "%H:%M").time():
+                    break
+                volume = 1000 + now.minute if is_today else 1000 + day.day
+                close = (10 + day.day / 100) * self.price_factor
+                rows.append({'日期': day.date(), '开盘': close, '收盘': close, '最高': close, '最低': close,
+                             '成交量': volume, '成交额': volume * close, '振幅': 1.0, '涨跌幅': 0.5,
+                             '涨跌额': 0.05, '换手率': 1.2})
+            day += timedelta(days=1)
+        return pd.DataFrame(rows)
+
+    def fetch(self, days, now, code='600000'):
+        self.now = now
+        self.calls.clear()
+        return bar_store.get_daily_bars(code, days=days, now=now)
+
+
+@pytest.fixture
+def api(temp_db, monkeypatch):
+    fake = FakeHistApi()
+    monkeypatch.setattr(data_source.ak, 'stock_zh_a_hist', fake)
+    return fake
+
+
+def test_incremental_top_up(api, check):
+    tuesday_after_close = datetime(2026, 3, 3, 16, 0)
+    wednesday_open = datetime(2026, 3, 4, 10, 0)
+
+    print("\n1. 首次读取与重复读取...")
+    df = api.fetch(15, tuesday_after_close)
+    check(f"首次整段抓取 1 次 (实际 {len(api.calls)})", len(api.calls) == 1)
+    check("返回 ak 同名列并按日期升序", list(df.columns[:3]) == ['日期', '开盘', '收盘'] and df['日期'].is_monotonic_increasing)
+    df = api.fetch(15, tuesday_after_close)
+    check(f"收盘后重复读取不再请求 (实际 {len(api.calls)})", len(api.calls) == 0)
+
+    print("\n2. 更长窗口只补抓前端缺口...")
+    df = api.fetch(60, tuesday_after_close)
+    check(f"补抓 1 次 (实际 {api.calls})", len(api.calls) == 1 and api.calls[0][2] < '20260216')
+    check("60天窗口数据完整", len(df) == len(pd.bdate_range('2026-01-02', '2026-03-03')))
+
+    print("\n3. 盘中当日K线...")
+    df = api.fetch(15, wednesday_open)
+    check(f"开盘后从上一交易日开始补抓 (实际 {api.calls})", len(api.calls) == 1 and api.calls[0][1] == '20260303')
+    check("包含盘中当日K线", df['日期'].iloc[-1] == '2026-03-04')
+    df = api.fetch(15, wednesday_open + timedelta(minutes=10))
+    check(f"时效内不重复抓取 (实际 {len(api.calls)})", len(api.calls) == 0)
+    df = api.fetch(15, wednesday_open + timedelta(minutes=config.BAR_INTRADAY_STALE_MINUTES + 5))
+    check(f"超过时效后刷新当日K线 (实际 {len(api.calls)})",
+          len(api.calls) == 1 and df['成交量'].iloc[-1] == 1000 + config.BAR_INTRADAY_STALE_MINUTES + 5)
+
+    print("\n4. 除权除息后整段重抓...")
+    api.price_factor = 0.5
+    df = api.fetch(60, datetime(2026, 3, 5, 16, 0))
+    check(f"检测到复权价格变化后整段重抓 (实际 {len(api.calls)} 次)", len(api.calls) == 2)
+    first_day = datetime.strptime(df['日期'].iloc[0], "%Y-%m-%d").day
+    check("历史价格已按新复权因子更新", abs(df['收盘'].iloc[0] - (10 + first_day / 100) * 0.5) < 1e-9)
+
+
+def test_volume_ratio_from_warm_store(api, monkeypatch, check):
+    """本地日线库预热后计算500只股票量比"""
+    codes = [f"{i:06d}" for i in range(500)]
+    now = datetime(2026, 3, 6, 16, 0)
+    api.now = now
+    for code in codes:
+        bar_store.get_daily_bars(code, days=15, now=now)
+    api.calls.clear()
+    original_get = bar_store.get_daily_bars
+    monkeypatch.setattr(bar_store, 'get_daily_bars',
+                        lambda code, days, adjust=None, now=now: original_get(code, days, adjust, now))
+    start = time.perf_counter()
+    ratios = [rf.calculate_volume_ratio_local(code) for code in codes]
+    elapsed = time.perf_counter() - start
+    print(f"[STAT] 500只股票量比耗时: {elapsed:.2f}秒，接口请求 {len(api.calls)} 次")
+    check("预热后不发起请求", len(api.calls) == 0)
+    check("量比计算正常", all(pd.notna(r) for r in ratios))
+    check("耗时在数秒以内", elapsed < 5)
+
+
+if __name__ == '__main__':
+    raise SystemExit(pytest.main([__file__, '-s', '-q']))
@@ -0,0 +1,96 @@
+"""
+测试数据源层：录制 akshare 返回结果后离线回放，回放可模拟延迟和请求失败（无需联网）
+"""
+import time
+import pandas as pd
+import pytest
+import data_source
+import fetch_engine
+import rank_flow as rf
+
+codes = [f"{i:06d}" for i in range(1, 51)]
+
+
+class FakeAkshare(data_source.DataProvider):
+    """模拟在线接口"""
+    def __init__(self):
+        self.calls = []
+
+    def call(self, api, **kwargs):
+        self.calls.append((api, kwargs))
+        if api == 'stock_individual_fund_flow':
+            return pd.DataFrame({'日期': ['2026-03-02'], '主力净流入-净额': [float(kwargs['stock'])]})
+        return pd.DataFrame({
+            '序号': [1, 2], '股票代码': ['600000', '000001'], '股票简称': ['浦发银行', '平安银行'],
+            '最新价': '10.00', '阶段涨跌幅': '3.00%', '连续换手率': '15.00%', '资金流入净额': ['6000.00万', '-1.20亿'],
+        })
+
+
+@pytest.fixture
+def recorded(temp_db, set_config, monkeypatch):
+    """录制目录在临时目录下；录制一次3日排行和各股票的资金流，返回 (在线接口, 录制器, 3日排行结果)"""
+    set_config(DATA_RECORD_DIR=str(temp_db / 'recordings'),
+               FETCH_INITIAL_RATE=500, FETCH_MAX_RATE=500, FETCH_BACKOFF_BASE=0.001)
+    monkeypatch.setattr(rf, 'get_instant_reference_data', lambda: pd.DataFrame())
+    live = FakeAkshare()
+    recorder = data_source.RecordingProvider(live)
+    data_source.set_provider(recorder)
+    df_live = rf.get_fund_flow_data('3日排行')
+    for code in codes:
+        recorder.stock_individual_fund_flow(stock=code, market='sz')
+    return live, recorder, df_live
+
+
+def test_record_and_replay(recorded, check):
+    live, recorder, df_live = recorded
+    print("\n1. 录制...")
+    check(f"录制 {recorder.recorded} 次请求 = {len(codes) + 1}", recorder.recorded == len(codes) + 1)
+
+    print("\n2. 回放（不再调用在线接口）...")
+    live.calls.clear()
+    data_source.set_provider(data_source.ReplayProvider(latency=0, error_rate=0))
+    df_replay = rf.refresh_fund_flow_data('3日排行')
+    check("回放结果与录制时一致", df_replay['净额'].tolist() == df_live['净额'].tolist())
+    check("回放未调用在线接口", live.calls == [])
+
+
+def test_replay_missing_recording(recorded, check):
+    """未录制的请求"""
+    with pytest.raises(data_source.RecordingNotFound):
+        data_source.ReplayProvider(latency=0, error_rate=0).stock_news_em(symbol='600000')
+    check("missing='empty' 时未录制的请求返回 None",
+          data_source.ReplayProvider(missing='empty').stock_news_em(symbol='600000') is None)
+
+
+def test_replay_latency(recorded, check):
+    """模拟延迟"""
+    slow = data_source.ReplayProvider(latency=(0.02, 0.03), error_rate=0)
+    start = time.perf_counter()
+    slow.stock_individual_fund_flow(stock='000001', market='sz')
+    check("每次请求至少等待 20 毫秒", time.perf_counter() - start >= 0.02)
+
+
+def test_replay_errors_with_retries(recorded, check):
+    """模拟限流失败，配合抓取引擎重试（固定随机种子可复现）"""
+    def run(seed):
+        flaky = data_source.ReplayProvider(latency=0, error_rate=0.3, seed=seed)
+        results, failed, stats = fetch_engine.fetch_batch(
+            codes, lambda code: flaky.stock_individual_fund_flow(stock=code, market='sz'),
+            max_retries=10, show_progress=False)
+        return results, failed, stats, flaky
+
+    results, failed, stats, flaky = run(seed=7)
+    check(f"模拟失败 {flaky.errors} 次后全部成功 ({len(results)}/{len(codes)})",
+          flaky.errors > 0 and len(results) == len(codes) and not failed)
+    check(f"失败次数与重试次数一致 ({stats.retries})", stats.retries == flaky.errors)
+    check("相同种子的失败次数可复现", run(seed=7)[3].errors == flaky.errors)
+
+
+def test_default_provider(temp_db, check):
+    data_source.set_provider(data_source.ReplayProvider())
+    data_source.set_provider(None)
+    check("恢复默认数据源为在线接口", isinstance(data_source.get_provider(), data_source.LiveProvider))
+
+
+if __name__ == '__main__':
+    raise SystemExit(pytest.main([__file__, '-s', '-q']))
@@ -0,0 +1,72 @@
+"""
+测试数据库连接复用层：同线程复用连接、WAL模式、多线程/多进程并发写入不报 "database is locked"
+"""
+import os
+import time
+import subprocess
+import sys
+import threading
+import pandas as pd
+import pytest
+import config
+import database
+
+
+def test_connection_reuse(temp_db, check):
+    """连接复用与PRAGMA设置"""
+    conn = database.get_connection()
+    check("同一线程重复获取为同一连接", database.get_connection() is conn)
+    check("WAL 模式", conn.execute("PRAGMA journal_mode").fetchone()[0] == 'wal')
+    check("synchronous=NORMAL", conn.execute("PRAGMA synchronous").fetchone()[0] == 1)
+    tables = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type='table'")}
+    check("首次连接时已建好所有表", {'watchlist', 'fund_flow_cache', 'raw_fund_flow_snapshot', 'main_force_cache'} <= tables)
+
+    other = []
+    t = threading.Thread(target=lambda: other.append(database.get_connection()))
+    t.start()
+    t.join()
+    check("不同线程使用各自的连接", other[0] is not conn)
+
+    # 重复调用的开销（模拟 Streamlit 每次重跑的读写）
+    database.update_watchlist(['600000', '000001'])
+    start = time.perf_counter()
+    for _ in range(500):
+        database.get_watchlist()
+    elapsed = time.perf_counter() - start
+    print(f"[STAT] 500 次读取自选股耗时: {elapsed * 1000:.1f}毫秒 ({elapsed / 500 * 1e6:.0f}微秒/次)")
+    check("自选股读写正常", sorted(database.get_watchlist()) == ['000001', '600000'])
+
+
+def test_concurrent_writes(temp_db, check):
+    """多线程 + 另一个进程同时写入"""
+    database.init_db()
+    df = pd.DataFrame({'股票代码': [f"{i:06d}" for i in range(300)], '超大单净额': 1.0, '大单净额': 2.0, '主力净流入': 3.0})
+    writer_script = (
+        "import config, sys; config.DB_PATH = sys.argv[1]; import database\n"
+        "for i in range(50): database.update_watchlist([f'{i:06d}'])\n"
+    )
+    proc = subprocess.Popen([sys.executable, '-c', writer_script, config.DB_PATH], cwd=os.path.dirname(os.path.abspath(__file__)),
+                            stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+    errors = []
+
+    def writer():
+        for _ in range(20):
+            try:
+                database.save_main_force_cache(df)
+                database.save_fund_flow_cache(df.rename(columns={'主力净流入': '净额'}), '即时')
+            except Exception as e:
+                errors.append(e)
+
+    threads = [threading.Thread(target=writer) for _ in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    output, _ = proc.communicate()
+    check("进程内并发写入无异常", not errors)
+    check("另一个进程写入无 locked 报错", proc.returncode == 0 and 'locked' not in output)
+    check("主力资金流缓存写入完整", len(database.get_main_force_cache()) == 300)
+
+
+if __name__ == '__main__':
+    raise SystemExit(pytest.main([__file__, '-s', '-q']))
@@ -0,0 +1,81 @@
+"""
+测试自适应限速抓取引擎（模拟一个会限流的接口，无需联网）
+"""
+import time
+import random
+from threading import Lock
+import pytest
+import fetch_engine
+
+# 模拟接口: 每秒最多承受 CAPACITY 个请求，超出则报错（模拟限流），另有少量随机网络错误
+CAPACITY = 40
+codes = [f"{i:06d}" for i in range(600)]
+
+
+def make_throttled_fetch():
+    window = []
+    window_lock = Lock()
+
+    def fake_fetch(code):
+        now = time.monotonic()
+        with window_lock:
+            while window and now - window[0] > 1.0:
+                window.pop(0)
+            throttled = len(window) >= CAPACITY
+            window.append(now)
+        time.sleep(random.uniform(0.02, 0.06))  # 模拟网络耗时
+        if throttled:
+            raise ConnectionError("429 Too Many Requests")
+        if random.random() < 0.02:
+            raise TimeoutError("read timeout")
+        if code.endswith('99'):
+            return None  # 接口无数据（不重试）
+        return {'股票代码': code}
+
+    return fake_fetch
+
+
+def test_adapts_to_throttled_api(check):
+    """抓取600只股票，接口承受上限 CAPACITY 请求/秒"""
+    limiter = fetch_engine.AdaptiveRateLimiter(initial_rate=10, max_rate=200)
+    results, failed, stats = fetch_engine.fetch_batch(codes, make_throttled_fetch(), limiter=limiter,
+                                                      max_retries=5, label='模拟')
+    print(stats.summary())
+
+    no_data = [c for c in codes if c.endswith('99')]
+    missing = set(codes) - set(results) - set(failed) - set(no_data)
+    check("无数据的股票不计入结果", all(c not in results for c in no_data))
+    check("其余股票全部成功（重试后无遗漏）", len(results) + len(no_data) == len(codes) and not failed and not missing)
+    check("实际速率不超过接口上限的1.5倍", stats.requests_per_second <= CAPACITY * 1.5)
+    check("速率从初始值向上自适应", stats.requests_per_second > 10)
+
+
+def test_backs_off_on_persistent_failure(check):
+    """持续失败时降速到下限"""
+    limiter = fetch_engine.AdaptiveRateLimiter(initial_rate=20, min_rate=1)
+
+    def always_fail(code):
+        raise ConnectionError("down")
+
+    results, failed, stats = fetch_engine.fetch_batch(codes[:20], always_fail, limiter=limiter, max_retries=1,
+                                                      show_progress=False)
+    check(f"全部失败 {len(failed)}/20，限速降至 {limiter.rate:.1f} 请求/秒", len(failed) == 20 and limiter.rate < 20)
+
+
+def test_bad_data_not_retried(check):
+    """数据异常不重试也不降速"""
+    limiter = fetch_engine.AdaptiveRateLimiter(initial_rate=20, min_rate=1)
+    bad_calls = []
+
+    def bad_data(code):
+        bad_calls.append(code)
+        raise fetch_engine.BadDataError("缺少列")
+
+    results, failed, stats = fetch_engine.fetch_batch(codes[:20], bad_data, limiter=limiter, max_retries=3,
+                                                      show_progress=False)
+    check(f"记为失败 {len(failed)}/20，请求 {len(bad_calls)} 次，限速 {limiter.rate:.1f} 请求/秒",
+          len(failed) == 20 and len(bad_calls) == 20 and stats.retries == 0 and limiter.rate >= 20)
+
+
+if __name__ == '__main__':
+    raise SystemExit(pytest.main([__file__, '-s', '-q']))
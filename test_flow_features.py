@@ -0,0 +1,116 @@
+"""
+测试多日主力资金流特征：由本地资金流历史按面板计算任意窗口的净额之和与精确增仓占比（无需联网）
+"""
+import numpy as np
+import pandas as pd
+import pytest
+import database
+import flow_features
+import rank_flow as rf
+import trade_calendar
+
+# 模拟 200 只股票 × 40 个交易日的资金流历史
+rng = np.random.default_rng(11)
+end_date = '2026-03-31'
+dates = [end_date]
+while len(dates) < 40:
+    dates.insert(0, trade_calendar.previous_trading_day(dates[0]))
+codes = [f"{i:06d}" for i in range(200)]
+amount = rng.lognormal(np.log(3e8), 1.0, (len(dates), len(codes)))
+tiers = {tier: amount * rng.normal(0, 0.04, amount.shape) for tier in ['super_large', 'large', 'medium']}
+tiers['small'] = -(tiers['super_large'] + tiers['large'] + tiers['medium'])
+# 000000 在倒数第2个交易日停牌（没有数据）
+missing = (len(dates) - 2, 0)
+
+main_net = tiers['super_large'] + tiers['large']
+main_net[missing] = 0
+amount_known = amount.copy()
+amount_known[missing] = 0
+# 5日增仓占比的精确值
+expected_ratio = main_net[-5:].sum(axis=0) / amount_known[-5:].sum(axis=0) * 100
+
+
+def save_exact_amount_bars(j=1, skip_dates=()):
+    """第 j 只股票写入本地日线（含实际成交额），skip_dates 中的日期没有日线"""
+    bars = pd.DataFrame({'trade_date': dates, 'open': 10.0, 'close': 10.0, 'high': 10.0, 'low': 10.0, 'volume': 1.0,
+                         'amount': amount[:, j], 'amplitude': 0.0, 'pct_change': 0.0, 'change': 0.0, 'turnover': 1.0,
+                         'is_final': 1})
+    database.save_daily_bars(codes[j], 'qfq', bars[~bars['trade_date'].isin(skip_dates)])
+
+
+@pytest.fixture
+def history(temp_db):
+    """写入 200 只股票 × 40 个交易日的资金流历史"""
+    database.init_db()
+    for j, code in enumerate(codes):
+        rows = {'trade_date': dates, 'close': 10.0, 'pct_change': 0.0, 'is_final': 1}
+        for tier, net in tiers.items():
+            rows[f'{tier}_net'] = net[:, j]
+            rows[f'{tier}_ratio'] = np.round(net[:, j] / amount[:, j] * 100, 2)
+        rows['main_net'] = rows['super_large_net'] + rows['large_net']
+        rows['main_ratio'] = np.round(rows['main_net'] / amount[:, j] * 100, 2)
+        df = pd.DataFrame(rows)
+        if j == missing[1]:
+            df = df.drop(index=missing[0])
+        database.save_fund_flow_history(code, df)
+
+
+def test_rolling_features_match_direct(history, check):
+    """5日特征与逐只计算一致"""
+    features = flow_features.get_rolling_features(5, end_date=end_date)
+    features = features.set_index('股票代码')
+    expected_main = main_net[-5:].sum(axis=0)
+    check("窗口和截止日期", (features['窗口'] == 5).all() and (features['截止日期'] == end_date).all())
+    check("5日主力净额 = 超大单 + 大单之和", np.allclose(features.loc[codes, '主力净额'], expected_main, rtol=1e-9))
+    diff = np.abs(features.loc[codes, '增仓占比'].to_numpy() - expected_ratio)
+    check(f"由净占比反推成交额，增仓占比误差 {diff.max():.4f} 个百分点 < 0.05", diff.max() < 0.05)
+    check("停牌日不计入有效天数", features.loc['000000', '有效天数'] == 4 and features.loc['000001', '有效天数'] == 5)
+
+
+def test_exact_amount_from_daily_bars(history, check):
+    """本地日线有成交额时使用实际成交额"""
+    save_exact_amount_bars()
+    features = flow_features.get_rolling_features(5, ['000001', '000002'], end_date=end_date).set_index('股票代码')
+    exact = features.loc['000001']
+    check("000001 增仓占比精确", abs(exact['增仓占比'] - expected_ratio[1]) < 1e-9)
+    check("实际成交额天数: 有日线 5 天，无日线 0 天（近似值）",
+          exact['实际成交额天数'] == 5 and features.loc['000002', '实际成交额天数'] == 0)
+
+
+def test_feature_job_multiple_windows(history, check):
+    """一次读取计算多个窗口"""
+    job = flow_features.run_feature_job([3, 20, 60], end_date=end_date)
+    check("每个窗口各一行/股票", job.groupby('窗口').size().to_dict() == {3: 200, 20: 200, 60: 200})
+    w20 = job[job['窗口'] == 20].set_index('股票代码')
+    check("20日主力净额正确", np.allclose(w20.loc[codes, '主力净额'], main_net[-20:].sum(axis=0), rtol=1e-9))
+    w60 = job[job['窗口'] == 60].set_index('股票代码')
+    check("历史不足60天时按已有天数计算", (w60.loc[codes[1:], '有效天数'] == 40).all())
+    with pytest.raises(ValueError):
+        flow_features.run_feature_job([61], end_date=end_date)
+    with pytest.raises(ValueError):
+        flow_features.get_rolling_features(1, end_date=end_date)
+
+
+def test_features_before_end_date(history, check):
+    """截止日期之前的截面"""
+    earlier = flow_features.get_rolling_features(3, end_date=dates[-10]).set_index('股票代码')
+    check("截止日期", (earlier['截止日期'] == dates[-10]).all())
+    check("3日大单净额", np.allclose(earlier.loc[codes, '大单净额'], tiers['large'][-12:-9].sum(axis=0), rtol=1e-9))
+
+
+def test_ranking_uses_local_ratio(history, set_config, check):
+    """N日排行的增仓占比优先使用本地历史"""
+    save_exact_amount_bars()
+    save_exact_amount_bars(2, skip_dates=[dates[-2]])
+    ranking = pd.DataFrame({'股票代码': ['000000', '000001', '000002', '000003', '999999'], '增仓占比': 1.23})
+    applied = rf.apply_local_flow_ratio(ranking, '5日排行', end_date=end_date).set_index('股票代码')['增仓占比']
+    check("历史和日线完整的股票改用本地计算值", abs(applied['000001'] - expected_ratio[1]) < 1e-9)
+    check("停牌缺一天、没有历史的股票保留估算值", applied['000000'] == 1.23 and applied['999999'] == 1.23)
+    check("缺一天日线、没有日线（成交额为近似值）的股票保留估算值",
+          applied['000002'] == 1.23 and applied['000003'] == 1.23)
+    set_config(FLOW_FEATURE_RANKING_ENABLED=False)
+    check("关闭后不替换", (rf.apply_local_flow_ratio(ranking, '5日排行', end_date=end_date)['增仓占比'] == 1.23).all())
+
+
+if __name__ == '__main__':
+    raise SystemExit(pytest.main([__file__, '-s', '-q']))
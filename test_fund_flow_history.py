@@ -0,0 +1,126 @@
+"""
+测试逐只股票资金流历史：抓取主力资金流时保存接口返回的每日数据，之后只追加新的交易日（模拟接口，无需联网）
+"""
+from datetime import datetime
+import pandas as pd
+import pytest
+import database
+import data_source
+import rank_flow as rf
+import trade_calendar
+
+dates = pd.bdate_range('2026-03-02', periods=20).strftime('%Y-%m-%d').tolist()
+
+
+def make_history(dates, first_main=1.0e7):
+    n = len(dates)
+    return pd.DataFrame({
+        '日期': pd.to_datetime(dates).date,
+        '收盘价': [10.0 + i for i in range(n)],
+        '涨跌幅': [1.5] * n,
+        '主力净流入-净额': [first_main + i for i in range(n)],
+        '主力净流入-净占比': [5.25] * n,
+        '超大单净流入-净额': [6.0e6] * n,
+        '超大单净流入-净占比': [3.15] * n,
+        '大单净流入-净额': [first_main - 6.0e6 + i for i in range(n)],
+        '大单净流入-净占比': [2.1] * n,
+        '中单净流入-净额': [-4.0e6] * n,
+        '中单净流入-净占比': [-2.1] * n,
+        '小单净流入-净额': [-6.0e6] * n,
+        '小单净流入-净占比': [-3.15] * n,
+    })
+
+
+def fake_rank(indicator):
+    return pd.DataFrame({
+        '序号': [1, 2, 3], '代码': [2594, 600519, 300059], '名称': ['a', 'b', 'c'], '最新价': [250.0, 1500.0, '-'],
+        '今日涨跌幅': [2.5, -0.5, '-'],
+        '今日主力净流入-净额': ['1.5亿', '-2000万', '-'], '今日主力净流入-净占比': [8.5, -1.2, '-'],
+        '今日超大单净流入-净额': ['1.0亿', '-1500万', '-'], '今日超大单净流入-净占比': [5.5, -0.9, '-'],
+        '今日大单净流入-净额': ['5000万', '-500万', '-'], '今日大单净流入-净占比': [3.0, -0.3, '-'],
+        '今日中单净流入-净额': ['-8000万', '1000万', '-'], '今日中单净流入-净占比': [-4.5, 0.6, '-'],
+        '今日小单净流入-净额': ['-7000万', '1000万', '-'], '今日小单净流入-净占比': [-4.0, 0.6, '-'],
+    })
+
+
+@pytest.fixture
+def responses(temp_db, monkeypatch):
+    """逐只资金流接口按股票代码返回的每日数据"""
+    data = {'600000': make_history(dates[:15])}
+    monkeypatch.setattr(data_source.ak, 'stock_individual_fund_flow', lambda stock, market: data[stock].copy())
+    database.init_db()
+    return data
+
+
+def test_history_saved_and_appended(responses, check):
+    print("\n1. 首次抓取保存全部每日数据...")
+    result = rf.fetch_single_stock_main_force_flow('600000')
+    history = database.get_fund_flow_history(['600000'])
+    check(f"保存 {len(history)} 天 = 15", len(history) == 15)
+    check("返回值仍为最新一天的主力资金流", result['主力净流入'] == 6.0e6 + (1.0e7 - 6.0e6 + 14))
+    first = history.iloc[0]
+    check("各档净额和净占比按日期存储",
+          first['trade_date'] == dates[0] and first['main_net'] == 1.0e7 and first['small_ratio'] == -3.15
+          and first['is_final'] == 1)
+
+    print("\n2. 之后的抓取只追加新的交易日...")
+    # 接口返回的旧日期数据即使不同，也不改写已定稿的历史
+    responses['600000'] = make_history(dates, first_main=2.0e7)
+    rf.fetch_single_stock_main_force_flow('600000')
+    history = database.get_fund_flow_history(['600000'])
+    check(f"共 {len(history)} 天 = 20", len(history) == 20)
+    check("已定稿的日期未被改写", history.iloc[0]['main_net'] == 1.0e7)
+    check("新交易日已写入", history.iloc[-1]['main_net'] == 2.0e7 + 19)
+
+    print("\n3. 盘中的当日数据未定稿，之后被覆盖...")
+    today = '2026-04-01'
+    frame = rf.to_fund_flow_history_frame(make_history(dates[-1:] + [today]), now=datetime(2026, 4, 1, 10, 0))
+    check("盘中当日标记为未定稿", frame['is_final'].tolist() == [1, 0])
+    database.save_fund_flow_history('600000', frame)
+    frame = rf.to_fund_flow_history_frame(make_history(dates[-1:] + [today], first_main=3.0e7), now=datetime(2026, 4, 1, 15, 30))
+    written = database.save_fund_flow_history('600000', frame)
+    check(f"收盘后写入 {written} 行 = 1（只覆盖当日）",
+          written == 1 and database.get_fund_flow_history(['600000'], start_date=today)['main_net'].tolist() == [3.0e7 + 1])
+    check("当日收盘后定稿", database.get_fund_flow_history(['600000'], start_date=today)['is_final'].tolist() == [1])
+
+
+def test_read_by_code_and_date_range(responses, check):
+    """按股票和日期范围读取"""
+    rf.fetch_single_stock_main_force_flow('600000')
+    responses['000001'] = make_history(dates[:5])
+    rf.fetch_single_stock_main_force_flow('000001')
+    window = database.get_fund_flow_history(start_date=dates[3], end_date=dates[4])
+    check("日期截面包含两只股票", window['stock_code'].tolist() == ['000001', '000001', '600000', '600000'])
+    check("空代码列表返回空表", database.get_fund_flow_history([]).empty)
+
+
+def test_bulk_rank_snapshot_saved(responses, monkeypatch, check):
+    """全市场排行的今日截面同时写入"""
+    bulk_codes = ['002594', '600519', '300059']
+    monkeypatch.setattr(data_source.ak, 'stock_individual_fund_flow_rank', fake_rank)
+    df_bulk = rf.fetch_bulk_main_force_flow()
+    trade_date = trade_calendar.current_trade_date()
+    snapshot = database.get_fund_flow_history(bulk_codes, start_date=trade_date, end_date=trade_date)
+    check(f"写入 {len(snapshot)} 只 = 2（停牌股票不写入）", snapshot['stock_code'].tolist() == ['002594', '600519'])
+    row = snapshot.iloc[0]
+    check("各档净额和净占比与排行一致",
+          row['main_net'] == 1.5e8 and row['super_large_net'] == 1.0e8 and row['small_ratio'] == -4.0 and row['close'] == 250.0)
+    check("主力资金流仍从排行取得", len(df_bulk) == 2)
+
+    # 只有今日截面的股票，之后逐只获取时仍补齐更早的每日数据
+    earlier = pd.bdate_range(end=pd.Timestamp(trade_calendar.previous_trading_day(trade_date)), periods=5)
+    responses['002594'] = make_history(earlier.strftime('%Y-%m-%d').tolist())
+    rf.fetch_single_stock_main_force_flow('002594')
+    check("逐只获取补齐截面之前的交易日", len(database.get_fund_flow_history(['002594'])) == 6)
+
+
+def test_disabled_not_saved(responses, set_config, check):
+    """关闭后不保存"""
+    set_config(FUND_FLOW_HISTORY_ENABLED=False)
+    responses['300750'] = make_history(dates[:5])
+    rf.fetch_single_stock_main_force_flow('300750')
+    check("未保存 300750", database.get_fund_flow_history(['300750']).empty)
+
+
+if __name__ == '__main__':
+    raise SystemExit(pytest.main([__file__, '-s', '-q']))
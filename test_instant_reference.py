@@ -0,0 +1,60 @@
+"""
+测试N日排行的即时参考数据：冷缓存时只调用排行接口，不触发逐只股票的主力资金流抓取（模拟接口，无需联网）
+"""
+import pandas as pd
+import pytest
+import rank_flow as rf
+import data_source
+
+codes = [f"{i:06d}" for i in range(1, 301)]
+
+
+def test_reference_without_main_force(temp_db, monkeypatch, check):
+    """N日排行冷启动的接口调用次数"""
+    api_calls = []
+    main_force_calls = []
+
+    def fake_fund_flow_individual(symbol):
+        api_calls.append(symbol)
+        if symbol == '即时':
+            return pd.DataFrame({
+                '序号': range(1, len(codes) + 1), '股票代码': codes, '股票简称': codes,
+                '最新价': '10.00', '涨跌幅': '1.00%', '换手率': '5.00%',
+                '流入资金': '2.00亿', '流出资金': '1.00亿', '净额': '1.00亿', '成交额': '3.00亿',
+            })
+        return pd.DataFrame({
+            '序号': range(1, len(codes) + 1), '股票代码': codes, '股票简称': codes,
+            '最新价': '10.00', '阶段涨跌幅': '3.00%', '连续换手率': '15.00%', '资金流入净额': '6000.00万',
+        })
+
+    def fake_main_force(code, debug=False, raise_errors=False):
+        main_force_calls.append(code)
+        return {'股票代码': code, '超大单净额': 1.0, '大单净额': 1.0, '主力净流入': 2.0}
+
+    monkeypatch.setattr(data_source.ak, 'stock_fund_flow_individual', fake_fund_flow_individual)
+    monkeypatch.setattr(rf, 'fetch_single_stock_main_force_flow', fake_main_force)
+
+    print("\n1. 冷缓存获取 3日排行...")
+    df_3 = rf.get_fund_flow_data('3日排行')
+    check(f"接口调用 {api_calls} = ['3日排行', '即时']", api_calls == ['3日排行', '即时'])
+    check(f"主力资金流抓取 {len(main_force_calls)} 次 = 0", len(main_force_calls) == 0)
+    # 增仓占比 = (6000万 * 5%) / (3亿 * 15%) * 100 = 6.67
+    check("增仓占比估算正确", (df_3['增仓占比'] - 20 / 3).abs().max() < 1e-9)
+    check("流通市值来自即时参考 (3亿 / 5% = 60亿)", (df_3['流通市值'] == 60_0000_0000).all())
+
+    print("\n2. 5日排行复用同一份即时参考快照...")
+    api_calls.clear()
+    rf.get_fund_flow_data('5日排行')
+    check(f"接口调用 {api_calls} = ['5日排行']", api_calls == ['5日排行'])
+
+    print("\n3. 进程重启（清空内存缓存）后参考快照从数据库读取...")
+    rf._SNAPSHOT_CACHE.clear()
+    api_calls.clear()
+    rf.get_fund_flow_data('10日排行')
+    check(f"接口调用 {api_calls} = ['10日排行']", api_calls == ['10日排行'])
+    check("参考快照不会被当作完整即时数据", rf._SNAPSHOT_CACHE.get(rf._snapshot_key('即时')) is None)
+    check(f"主力资金流抓取 {len(main_force_calls)} 次 = 0", len(main_force_calls) == 0)
+
+
+if __name__ == '__main__':
+    raise SystemExit(pytest.main([__file__, '-s', '-q']))
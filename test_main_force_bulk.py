@@ -0,0 +1,111 @@
+"""
+测试全市场主力资金流排行：一次请求取得全部股票，排行中没有的再逐只补抓（模拟接口，无需联网）
+"""
+import numpy as np
+import pandas as pd
+import pytest
+import database
+import data_source
+import rank_flow as rf
+
+codes = [f"{i:06d}" for i in range(1, 1001)]
+# 排行中缺少最后10只，另有1只停牌（净额为 "-"）
+listed = codes[:-10]
+suspended = listed[0]
+expected_requested = {suspended, *codes[-10:]}
+
+
+class FakeMainForceApi:
+    """模拟全市场主力资金流排行接口和逐只抓取"""
+
+    def __init__(self):
+        self.bulk_calls = []
+        self.requested = []
+        self.bulk_failing = False
+
+    def rank(self, indicator):
+        self.bulk_calls.append(indicator)
+        if self.bulk_failing:
+            raise ConnectionError("模拟限流")
+        super_large = [float(i) * 1000 for i in range(len(listed))]
+        large = [float(i) * 500 for i in range(len(listed))]
+        super_large[0] = '-'
+        return pd.DataFrame({
+            '序号': range(1, len(listed) + 1),
+            '代码': [int(c) for c in listed],   # 接口可能返回去掉前导零的代码
+            '名称': listed,
+            '今日主力净流入-净额': [float(i) * 1500 for i in range(len(listed))],
+            '今日超大单净流入-净额': super_large,
+            '今日大单净流入-净额': large,
+        })
+
+    def fetch(self, code, debug=False, raise_errors=False):
+        self.requested.append(code)
+        return {'股票代码': code, '超大单净额': 1.0, '大单净额': 2.0, '主力净流入': 3.0}
+
+    def clear(self):
+        self.bulk_calls.clear()
+        self.requested.clear()
+
+
+@pytest.fixture
+def api(temp_db, set_config, monkeypatch):
+    set_config(FETCH_MAX_RETRIES=0, FETCH_INITIAL_RATE=500, FETCH_MAX_RATE=500, MAIN_FORCE_BULK_ENABLED=True)
+    fake = FakeMainForceApi()
+    monkeypatch.setattr(data_source.ak, 'stock_individual_fund_flow_rank', fake.rank)
+    monkeypatch.setattr(rf, 'fetch_single_stock_main_force_flow', fake.fetch)
+    database.init_db()
+    return fake
+
+
+def test_parse_bulk_rank(api, check):
+    """解析全市场排行"""
+    df_bulk = rf.fetch_bulk_main_force_flow()
+    check(f"停牌股票被剔除 ({len(df_bulk)} 只)", len(df_bulk) == len(listed) - 1 and suspended not in set(df_bulk['股票代码']))
+    row = df_bulk.set_index('股票代码').loc[listed[5]]
+    check("代码补齐为6位，主力净流入 = 超大单 + 大单",
+          row['超大单净额'] == 5000 and row['大单净额'] == 2500 and row['主力净流入'] == 7500)
+
+
+def test_bulk_then_fill_missing(api, check):
+    print("\n1. 排行中有的股票不再逐只请求...")
+    df = rf.fetch_all_main_force_flow(codes)
+    check(f"排行接口请求 {len(api.bulk_calls)} 次 = 1", len(api.bulk_calls) == 1)
+    check(f"逐只补抓 {len(api.requested)} 只 = 11（缺失10只 + 停牌1只）",
+          set(api.requested) == expected_requested and len(api.requested) == 11)
+    check(f"返回 {len(df)} 只 = {len(codes)}", len(df) == len(codes))
+    cache = database.get_main_force_cache()
+    check("排行数据写入主力资金流缓存（状态 ok）", (cache['status'] == 'ok').sum() == len(codes))
+
+    print("\n2. 再次运行直接命中缓存...")
+    api.clear()
+    rf.fetch_all_main_force_flow(codes)
+    check("不再请求排行接口，也不逐只请求", api.bulk_calls == [] and api.requested == [])
+
+
+def test_bulk_failure_falls_back(api, check):
+    """排行接口失败时全部逐只获取，且不重复请求排行"""
+    api.bulk_failing = True
+    rf.fetch_all_main_force_flow(codes[:300], use_cache=False)
+    rf.fetch_all_main_force_flow(codes[300:600], use_cache=False)
+    check(f"逐只请求 {len(api.requested)} 只 = 600", len(api.requested) == 600)
+    check(f"排行接口只请求 {len(api.bulk_calls)} 次 = 1", len(api.bulk_calls) == 1)
+
+
+def test_pruned_counts_bulk_as_attempted(api, check):
+    """分支定界抓取时排行中的股票全部计入已抓取"""
+    rng = np.random.default_rng(7)
+    df_market = pd.DataFrame({
+        '股票代码': codes,
+        '涨跌幅': rng.normal(0, 3, len(codes)),
+        '换手率': rng.lognormal(np.log(3), 0.8, len(codes)),
+        '成交额': rng.lognormal(np.log(3e8), 1.0, len(codes)),
+    })
+    df_main_force, attempted = rf.fetch_main_force_flow_pruned(df_market, top_n=20, batch_size=50, use_cache=False)
+    listed_codes = set(listed) - {suspended}
+    check("排行中的股票全部计入已抓取", listed_codes <= set(attempted))
+    check(f"逐只补抓 {len(api.requested)} 只 <= 11", set(api.requested) <= expected_requested)
+
+
+if __name__ == '__main__':
+    raise SystemExit(pytest.main([__file__, '-s', '-q']))
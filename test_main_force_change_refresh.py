@@ -0,0 +1,117 @@
+"""
+测试变化驱动的盘中刷新：主力资金流缓存过期后只重抓成交额/净额变化明显的股票，其余沿用上次数据（模拟接口和时间，无需联网）
+"""
+from datetime import datetime
+import numpy as np
+import pandas as pd
+import pytest
+import data_source
+import database
+import rank_flow as rf
+
+codes = [f"{i:06d}" for i in range(200)]
+rng = np.random.default_rng(5)
+amount = rng.lognormal(np.log(3e8), 1.0, len(codes))
+snapshot1 = pd.DataFrame({'股票代码': codes, '成交额': amount, '净额': amount * 0.01})
+
+
+class FakeClock(datetime):
+    current = None
+
+    @classmethod
+    def now(cls, tz=None):
+        return cls.current
+
+
+class Runner:
+    """在指定时间抓取全部股票的主力资金流，记录逐只请求的股票"""
+
+    def __init__(self):
+        self.requested = []
+
+    def fetch(self, code, debug=False, raise_errors=False):
+        self.requested.append(code)
+        return {'股票代码': code, '超大单净额': 1.0, '大单净额': 2.0, '主力净流入': 3.0}
+
+    def __call__(self, now, snapshot, **kwargs):
+        FakeClock.current = now
+        self.requested.clear()
+        return rf.fetch_all_main_force_flow(codes, snapshot=snapshot, **kwargs)
+
+
+@pytest.fixture
+def run(temp_db, set_config, monkeypatch):
+    set_config(FETCH_MAX_RETRIES=0, FETCH_INITIAL_RATE=1000, FETCH_MAX_RATE=1000, MAIN_FORCE_BULK_ENABLED=False,
+               MAIN_FORCE_STALE_MINUTES=30, MAIN_FORCE_CARRY_MAX_MINUTES=120)
+    runner = Runner()
+    monkeypatch.setattr(rf, 'datetime', FakeClock)
+    monkeypatch.setattr(rf, 'fetch_single_stock_main_force_flow', runner.fetch)
+    database.init_db()
+    return runner
+
+
+def test_intraday_change_refresh(run, check):
+    print("\n1. 10:00 首次抓取全部股票...")
+    run(datetime(2026, 3, 3, 10, 0), snapshot1)
+    check(f"请求 {len(run.requested)} 次 = 200", len(run.requested) == 200)
+    cache = database.get_main_force_cache().set_index('股票代码')
+    check("缓存记录抓取时的成交额和净额", np.allclose(cache.loc[codes, '基准成交额'], amount))
+
+    print("\n2. 10:45 缓存过期，只重抓变化明显的股票...")
+    snapshot2 = snapshot1.copy()
+    snapshot2['成交额'] = amount * 1.01            # 大部分股票几乎没有成交
+    snapshot2.loc[:19, '成交额'] = amount[:20] * 1.10   # 20只放量
+    snapshot2.loc[20:29, '净额'] = amount[20:30] * 0.03  # 10只净额明显变化
+    df = run(datetime(2026, 3, 3, 10, 45), snapshot2)
+    moved = set(codes[:30])
+    check(f"请求 {len(run.requested)} 次 = 30（变化明显的股票）", set(run.requested) == moved and len(run.requested) == 30)
+    times = df.set_index('股票代码')['主力数据时间']
+    check("重抓的股票数据时间为本次", (times[list(moved)] == '2026-03-03 10:45:00').all())
+    check("沿用的股票标记为上次的抓取时间", (times[codes[30:]] == '2026-03-03 10:00:00').all())
+    check(f"返回 {len(df)} 只 = 200", len(df) == 200)
+
+    print("\n3. 沿用超过最长时间后必须重抓...")
+    run(datetime(2026, 3, 3, 13, 45), snapshot2)   # 10:00 抓取的已过 135 个交易分钟
+    check(f"请求 {len(run.requested)} 次 = 170（10:00 抓取后一直沿用的股票）",
+          set(run.requested) == set(codes[30:]) and len(run.requested) == 170)
+
+    print("\n4. 收盘后全部重抓定稿数据...")
+    run(datetime(2026, 3, 3, 15, 30), snapshot2)
+    check(f"请求 {len(run.requested)} 次 = 200", len(run.requested) == 200)
+
+
+def test_disabled_refetches_all(run, set_config, check):
+    """关闭变化驱动刷新时过期数据全部重抓"""
+    run(datetime(2026, 3, 4, 10, 0), snapshot1)
+    set_config(MAIN_FORCE_CHANGE_REFRESH_ENABLED=False)
+    run(datetime(2026, 3, 4, 10, 45), snapshot1)
+    check(f"请求 {len(run.requested)} 次 = 200", len(run.requested) == 200)
+
+
+def test_bulk_rows_used_for_stale_stocks(run, set_config, monkeypatch, check):
+    """全市场排行中有的过期股票全部取排行的最新数据，不沿用；排行中没有的仍按变化驱动刷新"""
+    run(datetime(2026, 3, 5, 10, 0), snapshot1)
+    listed = codes[:100]
+    bulk_calls = []
+
+    def fake_rank(indicator):
+        bulk_calls.append(indicator)
+        return pd.DataFrame({'代码': listed, '名称': listed, '今日主力净流入-净额': 300.0,
+                             '今日超大单净流入-净额': 100.0, '今日大单净流入-净额': 200.0})
+
+    monkeypatch.setattr(data_source.ak, 'stock_individual_fund_flow_rank', fake_rank)
+    set_config(MAIN_FORCE_BULK_ENABLED=True)
+    snapshot2 = snapshot1.copy()
+    snapshot2.loc[100:109, '成交额'] = amount[100:110] * 1.10   # 排行中没有的10只放量
+    df = run(datetime(2026, 3, 5, 10, 45), snapshot2).set_index('股票代码')
+    check(f"排行接口请求 {len(bulk_calls)} 次 = 1", len(bulk_calls) == 1)
+    check("排行中的股票（成交额未变化）使用排行的最新数据",
+          (df.loc[listed, '主力净流入'] == 300.0).all() and (df.loc[listed, '主力数据时间'] == '2026-03-05 10:45:00').all())
+    check(f"排行中没有的股票只逐只重抓变化明显的 ({len(run.requested)} 次 = 10)",
+          sorted(run.requested) == codes[100:110])
+    check("排行中没有、变化不大的股票沿用上次数据",
+          (df.loc[codes[110:], '主力数据时间'] == '2026-03-05 10:00:00').all())
+
+
+if __name__ == '__main__':
+    raise SystemExit(pytest.main([__file__, '-s', '-q']))
@@ -0,0 +1,72 @@
+"""
+测试主力资金流增量缓存：重复运行只补抓缺失、失败或过期的股票（模拟接口，无需联网）
+"""
+from datetime import datetime
+import pytest
+import database
+import rank_flow as rf
+
+codes = [f"{i:06d}" for i in range(100)]
+
+
+def test_incremental_refetch(temp_db, set_config, monkeypatch, check):
+    set_config(FETCH_MAX_RETRIES=0, MAIN_FORCE_BULK_ENABLED=False, FETCH_INITIAL_RATE=500, FETCH_MAX_RATE=500)
+    requested = []
+    failing = set()
+
+    def fake_fetch(code, debug=False, raise_errors=False):
+        requested.append(code)
+        if code in failing:
+            raise ConnectionError("模拟限流")
+        return {'股票代码': code, '超大单净额': 100.0, '大单净额': 50.0, '主力净流入': 150.0}
+
+    monkeypatch.setattr(rf, 'fetch_single_stock_main_force_flow', fake_fetch)
+    database.init_db()
+
+    print("\n1. 首次运行，其中20只接口失败...")
+    failing.update(codes[:20])
+    df = rf.fetch_all_main_force_flow(codes)
+    check(f"首次请求 {len(requested)} 次 = 100", len(requested) == 100)
+    check(f"返回 {len(df)} 只成功数据 = 80", len(df) == 80)
+
+    cache = database.get_main_force_cache()
+    check("失败股票在缓存中标记为 failed", set(cache.loc[cache['status'] == 'failed', '股票代码']) == failing)
+
+    print("\n2. 再次运行，只补抓失败的20只...")
+    requested.clear()
+    failing.clear()
+    df = rf.fetch_all_main_force_flow(codes)
+    check(f"第二次请求 {len(requested)} 次 = 20", len(requested) == 20 and set(requested) == set(codes[:20]))
+    check(f"返回 {len(df)} 只 = 100", len(df) == 100)
+
+    print("\n3. 缓存全部有效时不发起请求...")
+    requested.clear()
+    df = rf.fetch_all_main_force_flow(codes + ['999999'])
+    check(f"只请求新增的 1 只股票 (实际 {len(requested)})", requested == ['999999'])
+
+    print("\n4. 过期数据重抓失败时保留旧值...")
+    conn = database.get_connection()
+    conn.execute("UPDATE main_force_cache SET fetched_at = '2000-01-01 10:00:00' WHERE stock_code IN ('000000', '000001')")
+    conn.commit()
+    requested.clear()
+    failing.add('000000')
+    df = rf.fetch_all_main_force_flow(codes)
+    check(f"只重抓过期的 2 只 (实际 {sorted(requested)})", sorted(requested) == ['000000', '000001'])
+    check("重抓失败的股票仍返回旧值", '000000' in set(df['股票代码']))
+
+
+def test_main_force_stale(check):
+    """过期判断"""
+    check("盘中抓取、10分钟前 -> 有效",
+          not rf.is_main_force_stale('2026-03-02 10:00:00', datetime(2026, 3, 2, 10, 10)))
+    check("盘中抓取、2小时前 -> 过期",
+          rf.is_main_force_stale('2026-03-02 10:00:00', datetime(2026, 3, 2, 12, 0)))
+    check("收盘后抓取 -> 当天不再过期",
+          not rf.is_main_force_stale('2026-03-02 15:05:00', datetime(2026, 3, 2, 23, 0)))
+    check("周末抓取（交易日为周五）-> 有效",
+          not rf.is_main_force_stale('2026-03-07 09:00:00', datetime(2026, 3, 7, 18, 0)))
+    check("缺少抓取时间的旧数据 -> 过期", rf.is_main_force_stale(None))
+
+
+if __name__ == '__main__':
+    raise SystemExit(pytest.main([__file__, '-s', '-q']))
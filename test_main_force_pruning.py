@@ -0,0 +1,126 @@
+"""
+测试主力资金流分支定界抓取：综合评分前N名与全量抓取一致，且只抓取少量股票（模拟接口，无需联网）
+"""
+import numpy as np
+import pandas as pd
+import pytest
+import database
+import rank_flow as rf
+
+# 模拟全市场（市值过滤后）约4000只股票
+num_stocks = 4000
+rng = np.random.default_rng(20240506)
+turnover = rng.lognormal(np.log(3e8), 1.2, num_stocks)
+df = pd.DataFrame({
+    '股票代码': [f"{i:06d}" for i in range(num_stocks)],
+    '涨跌幅': np.round(rng.normal(0.3, 2.5, num_stocks), 2),
+    '换手率': np.round(rng.lognormal(np.log(3), 0.8, num_stocks), 2),
+    '成交额': turnover,
+})
+# 主力净流入占成交额的比例与涨跌幅正相关（上涨股多为主力净流入），大多在 ±15% 以内
+net_ratio = df['涨跌幅'].to_numpy() * 0.02 + rng.normal(0, 0.04, num_stocks)
+true_net = dict(zip(df['股票代码'], turnover * net_ratio))
+
+
+def real_scores():
+    """全量抓取时每只股票的综合评分"""
+    full = df.copy()
+    full['增仓占比'] = df['股票代码'].map(true_net) / df['成交额'] * 100
+    return rf.calculate_comprehensive_score_vec(full)
+
+
+def top_scores(frame, n):
+    scored = rf.add_comprehensive_scores(frame.copy())
+    return scored.sort_values('综合评分', ascending=False, kind='stable').head(n)
+
+
+def merge_pruned(df_main_force, attempted):
+    merged = rf._merge_main_force(df, df_main_force, attempted)
+    merged['增仓占比'] = merged['主力净额'] / merged['成交额'] * 100
+    return merged
+
+
+@pytest.fixture
+def requested(temp_db, set_config, monkeypatch):
+    """模拟逐只抓取主力资金流，返回请求过的股票代码"""
+    set_config(FETCH_MAX_RETRIES=0, MAIN_FORCE_BULK_ENABLED=False, FETCH_INITIAL_RATE=5000, FETCH_MAX_RATE=5000)
+    calls = []
+
+    def fake_fetch(code, debug=False, raise_errors=False):
+        calls.append(code)
+        return {'股票代码': code, '超大单净额': true_net[code] / 2, '大单净额': true_net[code] / 2, '主力净流入': true_net[code]}
+
+    monkeypatch.setattr(rf, 'fetch_single_stock_main_force_flow', fake_fetch)
+    return calls
+
+
+def test_score_bounds(check):
+    """评分上界"""
+    bounds = rf.main_force_score_bounds(df)
+    check("每只股票的评分上界 >= 实际评分", bool((bounds >= real_scores()).all()))
+    check("增仓评分最高分为100", rf._SCORE_TABLES['position_increase'].max_score == 100)
+
+
+@pytest.mark.parametrize('top_n', [20, 500])
+def test_pruned_top_matches_full(requested, top_n, check):
+    """分支定界抓取 Top N"""
+    df_main_force, attempted = rf.fetch_main_force_flow_pruned(df, top_n=top_n, batch_size=100, use_cache=False)
+    merged = merge_pruned(df_main_force, attempted)
+
+    expected = np.sort(real_scores())[::-1][:top_n]
+    actual = top_scores(merged, top_n)['综合评分'].to_numpy()
+    check(f"前{top_n}名综合评分与全量抓取一致", np.array_equal(actual, expected))
+    if top_n == 20:
+        check(f"请求 {len(requested)} 次，远少于全量 {num_stocks} 次", len(requested) < num_stocks / 2)
+    else:
+        check(f"请求 {len(requested)} 次，不多于全量 {num_stocks} 次", len(requested) <= num_stocks)
+    check("被跳过的股票增仓占比为空（不按0显示）", merged.loc[~merged['股票代码'].isin(attempted), '增仓占比'].isna().all())
+
+
+def test_no_pruning_fetches_all(requested, check):
+    """关闭剪枝时全部抓取"""
+    rf.fetch_main_force_flow_pruned(df.head(300), top_n=0, use_cache=False)
+    check(f"请求 {len(requested)} 次 = 300", len(requested) == 300)
+
+
+def test_tracked_stocks_always_fetched(requested, check):
+    """曾入榜的追踪股票始终抓取，缺少增仓占比的不写入回测库"""
+    bounds = rf.main_force_score_bounds(df)
+    tracked = df['股票代码'].iloc[np.argsort(bounds, kind='stable')[:3]].tolist()
+    conn = database.get_connection()
+    conn.executemany("INSERT INTO daily_top_history (record_date, stock_code, stock_name, rank, period_type) "
+                     "VALUES ('2026-01-05', ?, '', 1, '即时')", [(c,) for c in tracked])
+    conn.commit()
+    df_main_force, attempted = rf.fetch_main_force_flow_pruned(df, top_n=20, batch_size=100, use_cache=False)
+    check("评分上界最低的追踪股票也已抓取", set(tracked) <= set(requested) and set(tracked) <= set(attempted))
+
+    merged = merge_pruned(df_main_force, attempted)
+    skipped_code = merged.loc[merged['增仓占比'].isna(), '股票代码'].iloc[0]
+    database.save_daily_data_for_backtest(merged[merged['股票代码'].isin(tracked + [skipped_code])])
+    saved = pd.read_sql("SELECT stock_code, ratio FROM daily_stock_data", database.get_history_connection())
+    check(f"写入 {len(saved)} 只追踪股票，增仓占比均有效",
+          sorted(saved['stock_code']) == sorted(tracked) and saved['ratio'].notna().all())
+
+
+def test_watchlist_stocks_always_fetched(requested, check):
+    """评分上界低的自选股也抓取，自选股页面不缺少主力资金流"""
+    bounds = rf.main_force_score_bounds(df)
+    watched = df['股票代码'].iloc[np.argsort(bounds, kind='stable')[:2]].tolist()
+    database.update_watchlist(watched)
+    merged = merge_pruned(*rf.fetch_main_force_flow_pruned(df, top_n=20, batch_size=100, use_cache=False))
+    rows = merged.set_index('股票代码').loc[watched]
+    check("评分上界最低的自选股已抓取", set(watched) <= set(requested))
+    check("自选股的主力净额和增仓占比不为空", rows['主力净额'].notna().all() and rows['增仓占比'].notna().all())
+
+
+def test_pruned_snapshot_not_used_for_full_data(requested, check):
+    """需要完整数据时不使用剪枝后的内存快照"""
+    merged = merge_pruned(*rf.fetch_main_force_flow_pruned(df, top_n=20, batch_size=100, use_cache=False))
+    cache_key = rf._snapshot_key('即时')
+    rf._SNAPSHOT_CACHE.put(cache_key, merged)
+    check("综合评分排序可直接使用", rf._get_cached_snapshot(cache_key) is merged)
+    check("按增仓占比排序时视为未命中", rf._get_cached_snapshot(cache_key, prune=False) is None)
+
+
+if __name__ == '__main__':
+    raise SystemExit(pytest.main([__file__, '-s', '-q']))
@@ -0,0 +1,94 @@
+"""
+测试接口数据入口清洗（normalize_fund_flow_frame）：与逐个单元格解析结果一致，全市场数据毫秒级完成
+"""
+import time
+import numpy as np
+import pandas as pd
+import pytest
+import rank_flow as rf
+
+num_stocks = 5200
+
+def amount_text(x):
+    if abs(x) >= 1e8:
+        return f"{x / 1e8:.2f}亿"
+    if abs(x) >= 1e4:
+        return f"{x / 1e4:.2f}万"
+    return f"{x:.2f}"
+
+def old_parse_rate(x):
+    if pd.isna(x): return np.nan
+    s = str(x).replace('%', '')
+    try: return float(s)
+    except: return np.nan
+
+
+@pytest.fixture(scope='module')
+def df_raw():
+    """模拟 ak.stock_fund_flow_individual('即时') 的原始返回（全部为字符串）"""
+    rng = np.random.default_rng(20240501)
+    df_raw = pd.DataFrame({
+        '序号': range(1, num_stocks + 1),
+        '股票代码': [str(i) for i in rng.integers(1, 699999, num_stocks)],
+        '股票简称': [f"股票{i}" for i in range(num_stocks)],
+        '最新价': [f"{x:.2f}" for x in rng.uniform(2, 200, num_stocks)],
+        '涨跌幅': [f"{x:.2f}%" for x in rng.uniform(-10, 10, num_stocks)],
+        '换手率': [f"{x:.2f}%" for x in rng.uniform(0.1, 35, num_stocks)],
+        '流入资金': [amount_text(x) for x in rng.uniform(1e3, 5e9, num_stocks)],
+        '流出资金': [amount_text(x) for x in rng.uniform(1e3, 5e9, num_stocks)],
+        '净额': [amount_text(x) for x in rng.uniform(-1e9, 1e9, num_stocks)],
+        '成交额': [amount_text(x) for x in rng.uniform(1e6, 5e10, num_stocks)],
+    })
+    df_raw.loc[:4, '净额'] = ['-', '', None, '12.5万', '-3.01亿']
+    df_raw.loc[:2, '换手率'] = ['-', None, '0%']
+    df_raw = df_raw.rename(columns={'成交额': ' 成交额 '})  # 接口偶尔带空格的列名
+    return df_raw
+
+
+def test_matches_per_cell_parsing(df_raw, check):
+    """与逐个单元格解析（convert_unit / parse_rate）结果一致"""
+    df = rf.normalize_fund_flow_frame(df_raw)
+    check("列名已去空格", '成交额' in df.columns)
+    check("股票代码补全为6位", df['股票代码'].str.len().eq(6).all())
+    for col in ['最新价', '流入资金', '流出资金', '净额', '成交额']:
+        source = df_raw[' 成交额 ' if col == '成交额' else col]
+        expected = source.apply(rf.convert_unit).to_numpy(dtype=float)
+        actual = df[col].to_numpy()
+        same = (expected == actual) | (np.isnan(expected) & np.isnan(actual))
+        check(f"{col}: float64 且一致", df[col].dtype == np.float64 and same.all())
+    for col in ['涨跌幅', '换手率']:
+        expected = df_raw[col].apply(old_parse_rate).to_numpy(dtype=float)
+        actual = df[col].to_numpy()
+        same = (expected == actual) | (np.isnan(expected) & np.isnan(actual))
+        check(f"{col}: float64 且一致", df[col].dtype == np.float64 and same.all())
+    check("已是数值的列保持不变", rf.normalize_fund_flow_frame(df)[['净额', '换手率']].equals(df[['净额', '换手率']]))
+
+
+def best_of(func, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def test_parse_speed(df_raw, check):
+    """整列解析 vs 逐个单元格解析的速度"""
+    def per_cell():
+        frame = df_raw.copy()
+        for col in ['最新价', '流入资金', '流出资金', '净额', ' 成交额 ']:
+            frame[col] = frame[col].apply(rf.convert_unit)
+        for col in ['涨跌幅', '换手率']:
+            frame[col] = frame[col].apply(old_parse_rate)
+
+    old_time = best_of(per_cell, 3)
+    new_time = best_of(lambda: rf.normalize_fund_flow_frame(df_raw), 10)
+    print(f"[STAT] 逐个单元格解析 {num_stocks} 只股票: {old_time * 1000:.1f}毫秒")
+    print(f"[STAT] 整列解析       {num_stocks} 只股票: {new_time * 1000:.1f}毫秒")
+    check("整列解析快于逐个单元格解析", new_time < old_time)
+    check("整列解析在毫秒级完成 (<50毫秒)", new_time < 0.05)
+
+
+if __name__ == '__main__':
+    raise SystemExit(pytest.main([__file__, '-s', '-q']))
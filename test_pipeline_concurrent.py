@@ -0,0 +1,87 @@
+"""
+测试 main.py 多周期并发流水线：总耗时约等于最慢周期，即时排行与N日排行共用一份即时参考快照（模拟接口，无需联网）
+"""
+import os
+import threading
+import time
+import numpy as np
+import pandas as pd
+import pytest
+import rank_flow as rf
+import data_source
+import main
+
+API_LATENCY = 1.0
+codes = [f"{i:06d}" for i in range(1, 201)]
+periods = [('即时', 'comprehensive', '综合评分')] + [(p, 'ratio', '增仓占比') for p in ['3日排行', '5日排行', '10日排行', '20日排行']]
+
+
+@pytest.fixture
+def api_calls(temp_db, set_config, monkeypatch):
+    """模拟排行接口（每次请求耗时 API_LATENCY 秒），结果目录在临时目录下；返回接口调用记录"""
+    set_config(ENABLE_PREDICTION=False, MAIN_FORCE_BULK_ENABLED=False, FETCH_MAX_RETRIES=0,
+               FETCH_INITIAL_RATE=1000, FETCH_MAX_RATE=1000)
+    monkeypatch.chdir(temp_db)
+    calls = []
+    calls_lock = threading.Lock()
+
+    def fake_fund_flow_individual(symbol):
+        with calls_lock:
+            calls.append(symbol)
+        time.sleep(API_LATENCY)
+        if symbol == '即时':
+            return pd.DataFrame({
+                '序号': range(1, len(codes) + 1), '股票代码': codes, '股票简称': codes,
+                '最新价': '10.00', '涨跌幅': '1.00%', '换手率': '5.00%',
+                '流入资金': '2.00亿', '流出资金': '1.00亿', '净额': '1.00亿', '成交额': '3.00亿',
+            })
+        return pd.DataFrame({
+            '序号': range(1, len(codes) + 1), '股票代码': codes, '股票简称': codes,
+            '最新价': '10.00', '阶段涨跌幅': '3.00%', '连续换手率': '15.00%',
+            '资金流入净额': [f"{i}万" for i in range(1, len(codes) + 1)],
+        })
+
+    monkeypatch.setattr(data_source.ak, 'stock_fund_flow_individual', fake_fund_flow_individual)
+    monkeypatch.setattr(data_source.ak, 'stock_zh_a_spot_em', lambda: pd.DataFrame({'代码': codes, '市盈率-动态': 15.0}))
+    monkeypatch.setattr(rf, 'fetch_volume_history', lambda code: np.array([100.0] * 5 + [200.0]))
+    monkeypatch.setattr(rf, 'fetch_single_stock_main_force_flow', lambda code, debug=False, raise_errors=False: {
+        '股票代码': code, '超大单净额': 1.0e6, '大单净额': 2.0e6, '主力净流入': 3.0e6})
+    return calls
+
+
+def test_periods_run_concurrently(api_calls, temp_db, check):
+    """并发处理即时和4个N日周期"""
+    start = time.time()
+    results = main.run_pipeline(periods)
+    elapsed = time.time() - start
+    sequential = API_LATENCY * len(periods)
+
+    check("所有周期均有排名结果", all(results.get(p) is not None and not results[p].empty for p, _, _ in periods))
+    check(f"即时排行与即时参考快照共用一次请求（即时排行接口调用 {api_calls.count('即时')} 次 = 1）",
+          api_calls.count('即时') == 1)
+    check(f"各N日排行接口各调用一次",
+          sorted(c for c in api_calls if c != '即时') == sorted(p for p, _, _ in periods if p != '即时'))
+    print(f"[STAT] 并发耗时 {elapsed:.2f}秒 | 串行接口耗时至少 {sequential:.2f}秒")
+    check("总耗时明显小于各周期耗时之和", elapsed < sequential * 0.6)
+
+    files = os.listdir(temp_db / 'analysis_results')
+    check(f"每个周期各写出一个CSV ({len(files)} 个)", len(files) == len(periods))
+
+
+def test_failed_period_isolated(api_calls, monkeypatch, check):
+    """单个周期失败不影响其他周期"""
+    original = rf.rank_fund_flow
+
+    def flaky_rank(df, period=None, **kwargs):
+        if period == '5日排行':
+            raise RuntimeError("模拟评分异常")
+        return original(df, period=period, **kwargs)
+
+    monkeypatch.setattr(main.rf, 'rank_fund_flow', flaky_rank)
+    results = main.run_pipeline(periods)
+    check("失败周期结果为 None", results['5日排行'] is None)
+    check("其他周期正常完成", all(results[p] is not None for p in ['即时', '3日排行', '10日排行', '20日排行']))
+
+
+if __name__ == '__main__':
+    raise SystemExit(pytest.main([__file__, '-s', '-q']))
@@ -0,0 +1,84 @@
+"""
+测试抓取过程中的临时排名：主力资金流边抓取边发布，随时可得前N名和完成度，已确定的名次与最终结果一致（模拟接口，无需联网）
+"""
+import threading
+import time
+import numpy as np
+import pandas as pd
+import pytest
+import data_source
+import rank_flow as rf
+
+num_stocks = 1500
+rng = np.random.default_rng(3)
+codes = [f"{i:06d}" for i in range(num_stocks)]
+pct = np.round(rng.normal(0.3, 2.5, num_stocks), 2)
+turnover = rng.lognormal(np.log(3e8), 1.2, num_stocks)
+net = turnover * (pct * 0.02 + rng.normal(0, 0.04, num_stocks))
+true_net = dict(zip(codes, net))
+
+
+@pytest.fixture
+def api(temp_db, set_config, monkeypatch):
+    """模拟即时排行接口和逐只抓取（每只耗时3毫秒）"""
+    set_config(FETCH_MAX_RETRIES=0, FETCH_INITIAL_RATE=1000, FETCH_MAX_RATE=1000, MAIN_FORCE_BULK_ENABLED=False,
+               MAIN_FORCE_PRUNE_TOP_N=100, MAIN_FORCE_PRUNE_BATCH_SIZE=100, TOP_N=20)
+    monkeypatch.setattr(data_source.ak, 'stock_fund_flow_individual', lambda symbol: pd.DataFrame({
+        '序号': range(1, num_stocks + 1), '股票代码': codes, '股票简称': codes, '最新价': 10.0,
+        '涨跌幅': [f"{p:.2f}%" for p in pct],
+        '换手率': [f"{t:.2f}%" for t in np.round(rng.lognormal(np.log(3), 0.8, num_stocks), 2)],
+        '流入资金': turnover / 2, '流出资金': turnover / 2, '净额': net, '成交额': turnover,
+    }))
+
+    def fake_fetch(code, debug=False, raise_errors=False):
+        time.sleep(0.003)
+        return {'股票代码': code, '超大单净额': true_net[code] / 2, '大单净额': true_net[code] / 2, '主力净流入': true_net[code]}
+
+    monkeypatch.setattr(rf, 'fetch_single_stock_main_force_flow', fake_fetch)
+
+
+def test_anytime_ranking_during_fetch(api, check):
+    print("\n1. 抓取过程中随时获取临时排名...")
+    result = {}
+    worker = threading.Thread(target=lambda: result.setdefault('df', rf.get_fund_flow_data('即时')))
+    start = time.time()
+    worker.start()
+    snapshots = []
+    while worker.is_alive():
+        progress = rf.get_main_force_progress('即时')
+        if progress is not None and not progress.done:
+            ranked, info = rf.rank_fund_flow_anytime(progress)
+            snapshots.append((time.time() - start, ranked, info))
+        time.sleep(0.02)
+    worker.join()
+    elapsed = time.time() - start
+
+    partial = [(t, r, i) for t, r, i in snapshots if 0 < i['completeness'] < 1 and not r.empty]
+    check(f"抓取完成前取得 {len(partial)} 次临时排名", len(partial) >= 3)
+    if partial:
+        first_t, _, first_info = partial[0]
+        print(f"[STAT] 首个临时排名 {first_t:.2f}秒（完成度 {first_info['completeness']:.0%}）| 抓取总耗时 {elapsed:.2f}秒")
+    completeness = [i['completeness'] for _, _, i in snapshots]
+    check("完成度单调不减", all(a <= b for a, b in zip(completeness, completeness[1:])))
+
+    print("\n2. 最终排名与完整结果一致...")
+    final, info = rf.rank_fund_flow_anytime()
+    expected = rf.add_comprehensive_scores(result['df'].copy()).sort_values('综合评分', ascending=False, kind='stable').head(20)
+    check(f"完成度 {info['completeness']:.0%}，抓取已结束", info['completeness'] == 1 and info['done'])
+    check("前20名与 rank 结果一致", final['股票代码'].tolist() == expected['股票代码'].tolist())
+    check("前20名全部已确定", bool(final['名次已确定'].all()) and info['confirmed'] == 20)
+
+    print("\n3. 临时排名中已确定的名次不会再变...")
+    final_codes = final['股票代码'].tolist()
+    stable = True
+    confirmed_seen = 0
+    for _, ranked, _ in partial:
+        confirmed = ranked[ranked['名次已确定']]['股票代码'].tolist()
+        confirmed_seen = max(confirmed_seen, len(confirmed))
+        stable = stable and confirmed == final_codes[:len(confirmed)]
+    check(f"已确定的名次与最终排名一致（抓取中最多已确定 {confirmed_seen} 名）", stable)
+    check("临时排名中有名次在抓取完成前已确定", confirmed_seen > 0)
+
+
+if __name__ == '__main__':
+    raise SystemExit(pytest.main([__file__, '-s', '-q']))
@@ -0,0 +1,67 @@
+"""
+测试数据库结构迁移与常用查询的执行计划：每个高频查询都应走索引而不是全表扫描
+"""
+import sqlite3
+import pandas as pd
+import pytest
+import config
+import database
+
+
+def test_migrates_old_schema(temp_db, check):
+    """旧版本数据库自动迁移: main_force_cache 以 stock_code 为主键，没有版本号"""
+    old = sqlite3.connect(config.DB_PATH)
+    old.execute('''CREATE TABLE main_force_cache (
+                        stock_code TEXT PRIMARY KEY,
+                        cache_date TEXT,
+                        超大单净额 REAL,
+                        大单净额 REAL,
+                        主力净流入 REAL
+                    )''')
+    old.execute("INSERT INTO main_force_cache VALUES ('600000', '2026-03-02', 1.0, 2.0, 3.0)")
+    old.commit()
+    old.close()
+
+    conn = database.get_connection()
+    check("主库迁移到最新版本", database.get_schema_version(conn) == database.SCHEMA_MIGRATIONS[-1][0])
+    pk = [row[1] for row in sorted(conn.execute("PRAGMA table_info(main_force_cache)").fetchall(), key=lambda r: r[5]) if row[5]]
+    check("main_force_cache 主键为 (cache_date, stock_code)", pk == ['cache_date', 'stock_code'], f" -> {pk}")
+    migrated = database.get_main_force_cache('2026-03-02')
+    check("旧数据迁移后保留", len(migrated) == 1 and migrated['主力净流入'].iloc[0] == 3.0 and migrated['status'].iloc[0] == 'ok')
+
+    history_conn = database.get_history_connection()
+    check("历史库迁移到最新版本", database.get_schema_version(history_conn) == database.HISTORY_SCHEMA_MIGRATIONS[-1][0])
+
+    # 两天的主力资金流数据互不覆盖
+    df = pd.DataFrame({'股票代码': ['600000'], '超大单净额': [5.0], '大单净额': [6.0], '主力净流入': [11.0]})
+    database.save_main_force_cache(df)
+    check("新交易日数据不覆盖前一天", len(database.get_main_force_cache('2026-03-02')) == 1)
+
+
+def test_hot_queries_use_index(temp_db, check):
+    """高频查询执行计划"""
+    conn = database.get_connection()
+    history_conn = database.get_history_connection()
+    hot_queries = [
+        (conn, "读取资金流缓存", "SELECT * FROM fund_flow_cache WHERE period_type = ? AND cache_date = ? AND version = ?", ('即时', '2026-03-02', 1)),
+        (conn, "清理过期资金流缓存", "DELETE FROM fund_flow_cache WHERE cache_date < ?", ('2026-03-02',)),
+        (conn, "读取原始快照", "SELECT * FROM raw_fund_flow_snapshot WHERE period_type = ? AND cache_date = ? AND version = ?", ('即时', '2026-03-02', 1)),
+        (conn, "清理过期原始快照", "SELECT rowid FROM raw_fund_flow_snapshot WHERE cache_date < ? LIMIT 5000", ('2026-03-02',)),
+        (conn, "读取旧版JSON原始数据", "SELECT stock_code, data_json FROM raw_fund_flow_cache WHERE period_type = ? AND cache_date = ? AND version = ?", ('即时', '2026-03-02', 1)),
+        (conn, "读取快照当前版本", "SELECT version FROM snapshot_pointer WHERE table_name = ? AND cache_date = ? AND period_type = ?", ('fund_flow_cache', '2026-03-02', '即时')),
+        (conn, "清理过期版本指针", "SELECT rowid FROM snapshot_pointer WHERE cache_date < ? LIMIT 5000", ('2026-03-02',)),
+        (conn, "读取主力资金流缓存", "SELECT * FROM main_force_cache WHERE cache_date = ?", ('2026-03-02',)),
+        (conn, "覆盖当日榜单", "DELETE FROM daily_top_history WHERE record_date = ? AND period_type = ?", ('2026-03-02', '即时')),
+        (conn, "回测股票池", "SELECT DISTINCT stock_code FROM daily_top_history", ()),
+        (history_conn, "按日期读取历史明细", "SELECT * FROM daily_stock_data WHERE trade_date = ?", ('2026-03-02',)),
+        (history_conn, "读取本地日线", "SELECT * FROM daily_bars WHERE stock_code = ? AND adjust = ? AND trade_date >= ? ORDER BY trade_date", ('600000', 'qfq', '2026-01-01')),
+        (history_conn, "按股票读取历史明细", "SELECT * FROM daily_stock_data WHERE stock_code = ? ORDER BY trade_date", ('600000',)),
+    ]
+    for db, label, sql, params in hot_queries:
+        plan = " | ".join(row[-1] for row in db.execute(f"EXPLAIN QUERY PLAN {sql}", params).fetchall())
+        uses_index = 'USING' in plan and 'INDEX' in plan or 'PRIMARY KEY' in plan
+        check(label, uses_index, f" -> {plan}")
+
+
+if __name__ == '__main__':
+    raise SystemExit(pytest.main([__file__, '-s', '-q']))
@@ -0,0 +1,69 @@
+"""
+测试原始数据缓存的读写速度：按列存储 vs 旧版逐行JSON（使用模拟数据，临时数据库）
+"""
+import time
+import numpy as np
+import pandas as pd
+import pytest
+import database
+
+num_stocks = 5000
+
+
+def make_raw_frame():
+    """模拟 stock_fund_flow_individual('即时') 经单位转换后的原始数据（百分比仍为字符串）"""
+    rng = np.random.default_rng(20240301)
+    df_raw = pd.DataFrame({
+        '股票代码': [f"{i:06d}" for i in range(num_stocks)],
+        '股票简称': [f"股票{i}" for i in range(num_stocks)],
+        '最新价': rng.uniform(2, 200, num_stocks).round(2),
+        '涨跌幅': [f"{x:.2f}%" for x in rng.uniform(-10, 10, num_stocks)],
+        '换手率': [f"{x:.2f}%" for x in rng.uniform(0.1, 35, num_stocks)],
+        '流入资金': rng.uniform(1e7, 5e9, num_stocks).round(0),
+        '流出资金': rng.uniform(1e7, 5e9, num_stocks).round(0),
+        '净额': rng.uniform(-1e8, 1e8, num_stocks).round(0),
+        '成交额': rng.uniform(1e7, 5e9, num_stocks).round(0),
+    })
+    df_raw.loc[:9, '最新价'] = np.nan
+    return df_raw
+
+def best_of(func, repeat=5):
+    timings = []
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        timings.append(time.perf_counter() - start)
+    return min(timings), result
+
+
+def test_columnar_vs_json(temp_db, check):
+    df_raw = make_raw_frame()
+    timings = {}
+    loaded = {}
+    for storage in ['json', 'columnar']:
+        save_time, _ = best_of(lambda: database.save_raw_fund_flow_cache(df_raw, '即时', storage=storage), repeat=3)
+        load_time, df_loaded = best_of(lambda: database.get_raw_fund_flow_cache('即时', storage=storage))
+        timings[storage] = (save_time, load_time)
+        loaded[storage] = df_loaded
+
+    for storage, (save_time, load_time) in timings.items():
+        print(f"[STAT] {storage:8s} 写入: {save_time * 1000:7.1f}毫秒 | 读取: {load_time * 1000:7.1f}毫秒")
+    print(f"[STAT] 读取加速比: {timings['json'][1] / timings['columnar'][1]:.1f}x | "
+          f"写入加速比: {timings['json'][0] / timings['columnar'][0]:.1f}x")
+
+    # 正确性：两种存储读出的数据一致（按列存储的百分比已转为数值）
+    df_json, df_col = loaded['json'], loaded['columnar']
+    check(f"行数一致 ({len(df_col)})", len(df_json) == len(df_col) == num_stocks)
+    check("股票代码保留前导0", df_col['股票代码'].tolist() == df_raw['股票代码'].tolist())
+    for col in ['最新价', '流入资金', '流出资金', '净额', '成交额']:
+        check(f"{col} 数值一致", np.allclose(df_col[col], pd.to_numeric(df_json[col]), equal_nan=True))
+    for col in ['涨跌幅', '换手率']:
+        expected = df_raw[col].str.rstrip('%').astype(float)
+        check(f"{col} 转为数值", pd.api.types.is_float_dtype(df_col[col]) and np.allclose(df_col[col], expected))
+    check("N日排行专有字段不出现在即时数据中", '资金流入净额' not in df_col.columns)
+    check("按列存储读取快于逐行JSON", timings['columnar'][1] < timings['json'][1])
+
+
+if __name__ == '__main__':
+    raise SystemExit(pytest.main([__file__, '-s', '-q']))
@@ -0,0 +1,68 @@
+"""
+测试过期数据清理：覆盖所有缓存表、分批删除、增量回收空间、按计划执行
+"""
+import sqlite3
+import time
+from datetime import datetime, timedelta
+import pytest
+import config
+import database
+
+
+def test_retention_cleanup(temp_db, set_config, check):
+    set_config(RETENTION_BATCH_SIZE=1000)
+    conn = database.get_connection()
+    today = datetime.now()
+    old_dates = [(today - timedelta(days=d)).strftime("%Y-%m-%d") for d in (10, 20, 30)]
+    new_date = today.strftime("%Y-%m-%d")
+
+    print("\n1. 写入模拟数据（3个过期交易日 + 1个有效交易日，每天3000只股票）...")
+    for date in old_dates + [new_date]:
+        codes = [f"{i:06d}" for i in range(3000)]
+        conn.executemany("INSERT INTO fund_flow_cache (stock_code, period_type, cache_date, 净额) VALUES (?, '即时', ?, 1.0)",
+                         [(c, date) for c in codes])
+        conn.executemany('INSERT INTO raw_fund_flow_snapshot (period_type, cache_date, "股票代码", "净额") VALUES (\'即时\', ?, ?, 1.0)',
+                         [(date, c) for c in codes])
+        conn.executemany("INSERT INTO raw_fund_flow_cache (stock_code, period_type, cache_date, data_json) VALUES (?, '即时', ?, ?)",
+                         [(c, date, '{"股票代码": "%s"}' % c) for c in codes])
+        conn.executemany("INSERT INTO main_force_cache (cache_date, stock_code, 主力净流入, status) VALUES (?, ?, 1.0, 'ok')",
+                         [(date, c) for c in codes])
+        conn.execute("INSERT INTO fund_flow_snapshot_meta (cache_date, period_type, fetched_at) VALUES (?, '即时', ?)",
+                     (date, f"{date} 15:30:00"))
+        conn.executemany("INSERT INTO snapshot_pointer (table_name, cache_date, period_type, version) VALUES (?, ?, '即时', 0)",
+                         [(table, date) for table in ('fund_flow_cache', 'raw_fund_flow_snapshot', 'raw_fund_flow_cache')])
+    conn.commit()
+    check("新建数据库为增量回收模式", conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2)
+
+    print("\n2. 执行清理...")
+    start = time.perf_counter()
+    deleted = database.run_retention_if_due(force=True)
+    elapsed = time.perf_counter() - start
+    print(f"[STAT] 清理耗时: {elapsed * 1000:.1f}毫秒")
+    for table, _ in database.RETENTION_TABLES:
+        # 快照获取时间表每天每个周期只有一行，版本指针表每天每个周期每张快照表一行
+        rows_per_day = {'fund_flow_snapshot_meta': 1, 'snapshot_pointer': 3}.get(table, 3000)
+        remaining = conn.execute(f"SELECT COUNT(*), MIN(cache_date) FROM {table}").fetchone()
+        check(f"{table}: 删除 {deleted[table]} 行，保留 {remaining[0]} 行",
+              deleted[table] == rows_per_day * 3 and remaining == (rows_per_day, new_date))
+    check("空闲页已回收", conn.execute("PRAGMA freelist_count").fetchone()[0] < 2000)
+
+    print("\n3. 按计划执行...")
+    check("间隔未到时跳过", database.run_retention_if_due() is None)
+
+
+def test_old_database_not_vacuumed(temp_db, check):
+    """旧数据库默认不做整库 VACUUM"""
+    old = sqlite3.connect(config.DB_PATH)
+    old.execute("CREATE TABLE watchlist (stock_code TEXT PRIMARY KEY, added_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)")
+    old.commit()
+    old.close()
+    conn = database.get_connection()
+    database.run_retention_if_due(force=True)
+    check("清理后仍为原回收模式", conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 0)
+    check("手动转换为增量回收模式", database.enable_incremental_vacuum()
+          and conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2)
+
+
+if __name__ == '__main__':
+    raise SystemExit(pytest.main([__file__, '-s', '-q']))
@@ -0,0 +1,50 @@
+"""
+测试评分分档配置（config.py 中的分档表）的编译与热更新
+"""
+import copy
+import numpy as np
+import pytest
+import config
+import rank_flow as rf
+
+
+def test_threshold_boundaries(check):
+    """包含/不包含阈值的边界（换手率 5-10% 为最理想区间，两端均包含）"""
+    check.equal("换手率 5%", rf.calculate_turnover_rate_score(5), 100)
+    check.equal("换手率 10%", rf.calculate_turnover_rate_score(10), 100)
+    check.equal("换手率 10.01%", rf.calculate_turnover_rate_score(10.01), 80)
+    check.equal("换手率 30%", rf.calculate_turnover_rate_score(30), 40)
+    check.equal("换手率 30.01%", rf.calculate_turnover_rate_score(30.01), 20)
+    check.equal("成交额 0", rf.calculate_turnover_amount_score(0), 0)
+    check.equal("成交额 1元", rf.calculate_turnover_amount_score(1), 20)
+    check.equal("增仓占比 -2%（线性扣分）", rf.calculate_position_increase_score(-2), 4)
+    check.equal("增仓占比 -10%（扣到0为止）", rf.calculate_position_increase_score(-10), 0)
+    check.equal("放量等级 成交额缺失", rf.classify_turnover_level({'成交额': np.nan, '换手率': 5}), "数据缺失")
+
+    vec = rf.calculate_turnover_rate_score_vec([5, 10, 10.01, 30, 30.01, np.nan])
+    check.equal("换手率整列查表", vec.tolist(), [100, 100, 80, 40, 20, 0])
+
+
+def test_reload_after_config_change(check, monkeypatch):
+    """修改成交额分档配置并重新编译，无需改代码"""
+    bins = copy.deepcopy(config.TURNOVER_AMOUNT_SCORE_BINS)
+    bins['bins'][-1] = (15_0000_0000, 100, True)  # 20亿 -> 15亿
+    try:
+        with monkeypatch.context() as m:
+            m.setattr(config, 'TURNOVER_AMOUNT_SCORE_BINS', bins)
+            rf.reload_score_tables()
+            check.equal("调整后 成交额 16亿", rf.calculate_turnover_amount_score(16_0000_0000), 100)
+            check.equal("调整后 成交额 16亿(整列)", rf.calculate_turnover_amount_score_vec([16_0000_0000]).tolist(), [100])
+    finally:
+        rf.reload_score_tables()
+    check.equal("恢复后 成交额 16亿", rf.calculate_turnover_amount_score(16_0000_0000), 85)
+
+
+def test_unordered_thresholds_rejected():
+    """阈值未递增时编译报错"""
+    with pytest.raises(ValueError):
+        rf.ScoreBinTable({'below': 0, 'bins': [(2, 10, True), (1, 20, True)]}, 'bad')
+
+
+if __name__ == '__main__':
+    raise SystemExit(pytest.main([__file__, '-s', '-q']))
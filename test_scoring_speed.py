@@ -1,80 +1,135 @@
 """
-测试新评分系统的计算速度（使用模拟数据）
+测试评分引擎的计算速度与正确性（使用模拟数据）
+
+对比两种实现：
+- 逐行评分函数 (calculate_*_score + df.apply)
+- 向量化评分引擎 (calculate_*_score_vec，add_comprehensive_scores 实际使用)
+要求两者结果完全一致，且向量化引擎在 5000 只股票上达到毫秒级
 """
 import time
 import pandas as pd
 import numpy as np
+import pytest
 import rank_flow as rf
 
-print("=" * 60)
-print("测试新版多维度评分系统计算速度")
-print("=" * 60)
-
-# 创建模拟数据（5000只股票）
-print("\n1. 生成模拟数据（模拟5000只股票）...")
-num_stocks = 5000
-
-mock_data = {
-    '股票代码': [f"{i:06d}" for i in range(num_stocks)],
-    '股票简称': [f"股票{i}" for i in range(num_stocks)],
-    '增仓占比': np.random.uniform(-10, 30, num_stocks),  # -10% 到 30%
-    '涨跌幅': np.random.uniform(-10, 10, num_stocks),     # -10% 到 10%
-    '换手率': np.random.uniform(0.1, 30, num_stocks),     # 0.1% 到 30%
-    '成交额': np.random.uniform(1000_0000, 50_0000_0000, num_stocks),  # 1000万 到 50亿
-    '净额': np.random.uniform(-1000_0000, 5000_0000, num_stocks),
-    '流通市值': np.random.uniform(10_0000_0000, 800_0000_0000, num_stocks),  # 10亿到800亿
-}
-
-df = pd.DataFrame(mock_data)
-print(f"[OK] 生成 {len(df)} 只股票的模拟数据")
-
-# 测试评分速度
-print("\n2. 测试综合评分计算速度...")
-start_time = time.time()
-
-df_with_scores = rf.add_comprehensive_scores(df)
-
-calc_time = time.time() - start_time
-
-print(f"\n[OK] 评分计算完成！")
-print(f"[STAT] 计算 {len(df)} 只股票耗时: {calc_time:.3f}秒")
-print(f"[STAT] 平均每只股票: {calc_time/len(df)*1000:.3f}毫秒")
-
-# 显示评分分布
-print("\n" + "=" * 60)
-print("[CHART] 综合评分分布:")
-print("=" * 60)
-
-score_ranges = [
-    ('优秀(>=80分)', len(df_with_scores[df_with_scores['综合评分'] >= 80])),
-    ('良好(70-79分)', len(df_with_scores[(df_with_scores['综合评分'] >= 70) & (df_with_scores['综合评分'] < 80)])),
-    ('中等(60-69分)', len(df_with_scores[(df_with_scores['综合评分'] >= 60) & (df_with_scores['综合评分'] < 70)])),
-    ('一般(<60分)', len(df_with_scores[df_with_scores['综合评分'] < 60]))
-]
-
-for label, count in score_ranges:
-    percentage = count / len(df_with_scores) * 100
-    print(f"{label}: {count:4d}只 ({percentage:5.2f}%)")
-
-# 显示Top 10
-print("\n" + "=" * 60)
-print("[TOP] 综合评分 Top 10:")
-print("=" * 60)
-
-top10 = df_with_scores.nlargest(10, '综合评分')
-display_cols = ['股票代码', '综合评分', '增仓占比', '涨跌幅', '换手率', '成交额']
-
-# 格式化输出
-for idx, row in top10.iterrows():
-    print(f"{row['股票代码']} | 综合: {row['综合评分']:.1f} | "
-          f"增仓: {row['增仓占比']:.1f}% | 涨幅: {row['涨跌幅']:.2f}% | "
-          f"换手: {row['换手率']:.2f}% | 成交额: {row['成交额']/1_0000_0000:.2f}亿")
-
-print("\n" + "=" * 60)
-print("[OK] 性能测试完成！")
-print("=" * 60)
-print("\n结论:")
-print("1. 新评分系统无需调用API，速度极快")
-print("2. 5000只股票评分计算在毫秒级完成")
-print("3. 相比之前逐个计算量比（需要5000次API调用），速度提升约1000倍+")
-print("=" * 60)
+
+@pytest.fixture(scope='module')
+def df():
+    """5000只股票的模拟数据，混入正好落在分档阈值上的边界值"""
+    num_stocks = 5000
+    rng = np.random.default_rng(20240201)
+
+    mock_data = {
+        '股票代码': [f"{i:06d}" for i in range(num_stocks)],
+        '股票简称': [f"股票{i}" for i in range(num_stocks)],
+        '增仓占比': rng.uniform(-10, 30, num_stocks),  # -10% 到 30%
+        '涨跌幅': rng.uniform(-10, 10, num_stocks),     # -10% 到 10%
+        '换手率': rng.uniform(0.1, 35, num_stocks),     # 0.1% 到 35%
+        '成交额': rng.uniform(1000_0000, 50_0000_0000, num_stocks),  # 1000万 到 50亿
+        '净额': rng.uniform(-1000_0000, 5000_0000, num_stocks),
+        '流通市值': rng.uniform(10_0000_0000, 800_0000_0000, num_stocks),  # 10亿到800亿
+        '当日量比': rng.uniform(0, 6, num_stocks),
+    }
+    df = pd.DataFrame(mock_data)
+
+    # 混入边界值：正好落在分档阈值上的数据、缺失值、字符串百分比、无量比
+    edge_ratio = [25, 20, 15, 12, 10, 8, 6, 4, 2, 0, -0.5, -3.4, np.nan]
+    edge_pct = [9.9, 8, 6, 4, 2, 1, 0, -2, -4, -6, -6.01, np.nan, 10]
+    edge_rate = [5, 10, 3, 15, 2, 20, 1, 30, 0.99, 30.01, np.nan, 0, 4.99]
+    edge_amount = [20_0000_0000, 10_0000_0000, 5_0000_0000, 2_0000_0000, 1_0000_0000, 0, -1, np.nan, 1, 9999_9999, 3e9, 1e9, 5e8]
+    edge_volume = [5, 3, 2, 1.5, 1.2, 0.8, 0.79, 0, -1, np.nan, np.nan, 10, 1]
+    n_edge = len(edge_ratio)
+    df.loc[:n_edge - 1, '增仓占比'] = edge_ratio
+    df.loc[:n_edge - 1, '涨跌幅'] = edge_pct
+    df.loc[:n_edge - 1, '换手率'] = edge_rate
+    df.loc[:n_edge - 1, '成交额'] = edge_amount
+    df.loc[:n_edge - 1, '当日量比'] = edge_volume
+    # 一半股票没有量比（模拟两步筛选的第一步）
+    df.loc[num_stocks // 2:, '当日量比'] = np.nan
+    return df
+
+
+def test_vectorized_matches_scalar(df, check):
+    """向量化评分与逐行评分结果一致"""
+    checks = [
+        ('增仓评分', df['增仓占比'].apply(rf.calculate_position_increase_score), rf.calculate_position_increase_score_vec(df['增仓占比'])),
+        ('动量评分', df['涨跌幅'].apply(rf.calculate_price_momentum_score), rf.calculate_price_momentum_score_vec(df['涨跌幅'])),
+        ('活跃度评分', df['换手率'].apply(rf.calculate_turnover_rate_score), rf.calculate_turnover_rate_score_vec(df['换手率'])),
+        ('流动性评分', df['成交额'].apply(rf.calculate_turnover_amount_score), rf.calculate_turnover_amount_score_vec(df['成交额'])),
+        ('量比评分', df['当日量比'].apply(rf.calculate_volume_ratio_score), rf.calculate_volume_ratio_score_vec(df['当日量比'])),
+        ('综合评分', df.apply(rf.calculate_comprehensive_score, axis=1), rf.calculate_comprehensive_score_vec(df)),
+    ]
+    for label, expected, actual in checks:
+        mismatch = int((expected.to_numpy(dtype=float) != actual).sum())
+        check(f"{label}: 不一致 {mismatch}/{len(df)}", mismatch == 0)
+
+    expected_level = df.apply(rf.classify_turnover_level, axis=1).to_numpy()
+    mismatch = int((expected_level != rf.classify_turnover_level_vec(df)).sum())
+    check(f"放量等级: 不一致 {mismatch}/{len(df)}", mismatch == 0)
+
+    # 字符串百分比（数据库旧缓存中常见）
+    df_str = df.head(200).copy()
+    df_str['换手率'] = df_str['换手率'].apply(lambda x: f"{x}%" if pd.notna(x) else x)
+    df_str['涨跌幅'] = df_str['涨跌幅'].apply(lambda x: f"{x}%" if pd.notna(x) else x)
+    expected_str = df_str.apply(rf.calculate_comprehensive_score, axis=1).to_numpy(dtype=float)
+    mismatch = int((expected_str != rf.calculate_comprehensive_score_vec(df_str)).sum())
+    check(f"字符串百分比输入: 不一致 {mismatch}/{len(df_str)}", mismatch == 0)
+
+
+def scalar_scoring(frame):
+    frame['综合评分'] = frame.apply(rf.calculate_comprehensive_score, axis=1)
+    frame['增仓评分'] = frame['增仓占比'].apply(rf.calculate_position_increase_score)
+    frame['动量评分'] = frame['涨跌幅'].apply(rf.calculate_price_momentum_score)
+    frame['活跃度评分'] = frame['换手率'].apply(rf.calculate_turnover_rate_score)
+    frame['流动性评分'] = frame['成交额'].apply(rf.calculate_turnover_amount_score)
+    frame['放量等级'] = frame.apply(rf.classify_turnover_level, axis=1)
+    return frame
+
+def vector_scoring(frame):
+    sub_scores = rf.calculate_sub_scores_vec(frame)
+    frame['综合评分'] = rf.calculate_comprehensive_score_vec(frame, sub_scores)
+    for col, scores in sub_scores.items():
+        frame[col] = scores
+    frame['放量等级'] = rf.classify_turnover_level_vec(frame)
+    return frame
+
+def best_of(func, df, repeat):
+    """多次运行取最快一次"""
+    timings = []
+    for _ in range(repeat):
+        frame = df.copy()
+        start_time = time.perf_counter()
+        func(frame)
+        timings.append(time.perf_counter() - start_time)
+    return min(timings)
+
+
+def test_vectorized_speed(df, check):
+    """逐行评分 vs 向量化评分的速度"""
+    scalar_time = best_of(scalar_scoring, df, 3)
+    vector_time = best_of(vector_scoring, df, 20)
+
+    print(f"[STAT] 逐行评分   {len(df)} 只股票耗时: {scalar_time * 1000:.1f}毫秒")
+    print(f"[STAT] 向量化评分 {len(df)} 只股票耗时: {vector_time * 1000:.1f}毫秒")
+    print(f"[STAT] 加速比: {scalar_time / vector_time:.0f}x")
+    check("向量化评分耗时 < 10毫秒", vector_time < 0.010)
+
+
+def test_add_comprehensive_scores(df, check):
+    """add_comprehensive_scores 完整流程"""
+    start_time = time.perf_counter()
+    df_with_scores = rf.add_comprehensive_scores(df.copy())
+    calc_time = time.perf_counter() - start_time
+    print(f"[STAT] 含分布统计输出共耗时: {calc_time * 1000:.1f}毫秒")
+    check("每只股票都有综合评分", len(df_with_scores) == len(df) and df_with_scores['综合评分'].notna().all())
+
+    print("[TOP] 综合评分 Top 10:")
+    top10 = df_with_scores.nlargest(10, '综合评分')
+    for idx, row in top10.iterrows():
+        print(f"{row['股票代码']} | 综合: {row['综合评分']:.1f} | "
+              f"增仓: {row['增仓占比']:.1f}% | 涨幅: {row['涨跌幅']:.2f}% | "
+              f"换手: {row['换手率']:.2f}% | 成交额: {row['成交额']/1_0000_0000:.2f}亿")
+
+
+if __name__ == '__main__':
+    raise SystemExit(pytest.main([__file__, '-s', '-q']))
@@ -0,0 +1,154 @@
+"""
+测试请求合并：冷缓存时多个线程同时请求同一份数据，只执行一次获取，其余等待并共享结果（模拟接口，无需联网）
+"""
+import threading
+import time
+from datetime import datetime
+import numpy as np
+import pandas as pd
+import pytest
+import bar_store
+import data_source
+import database
+import predictor
+import rank_flow as rf
+import single_flight
+
+
+def run_concurrently(func, n=6):
+    """n 个线程同时调用 func，返回各线程的结果（异常作为结果返回）"""
+    results = [None] * n
+    barrier = threading.Barrier(n)
+
+    def worker(i):
+        barrier.wait()
+        try:
+            results[i] = func()
+        except Exception as e:
+            results[i] = e
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(n)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return results
+
+
+@pytest.fixture
+def offline(temp_db, set_config):
+    set_config(FETCH_MAX_RETRIES=0, FETCH_INITIAL_RATE=1000, FETCH_MAX_RATE=1000, MAIN_FORCE_BULK_ENABLED=False)
+    database.init_db()
+
+
+def test_single_flight_basics(check):
+    """SingleFlight 基本行为"""
+    flights = single_flight.SingleFlight()
+    calls = []
+
+    def slow(value):
+        calls.append(value)
+        time.sleep(0.2)
+        return [value]
+
+    results = run_concurrently(lambda: flights.do('a', slow, 1))
+    check(f"同键并发 6 次只执行 {len(calls)} 次 = 1", calls == [1])
+    check("所有调用者得到同一个结果", all(r is results[0] for r in results))
+    check(f"统计: {flights.stats()}", flights.stats() == {'in_flight': 0, 'executed': 1, 'shared': 5})
+
+    calls.clear()
+    keys = iter(['x', 'y', 'x', 'y'])
+    key_lock = threading.Lock()
+
+    def next_key():
+        with key_lock:
+            return next(keys)
+
+    start = time.time()
+    run_concurrently(lambda: flights.do(next_key(), slow, 2), n=4)
+    elapsed = time.time() - start
+    check(f"不同键各执行一次并互不等待 ({len(calls)} 次，耗时 {elapsed:.2f}秒)", len(calls) == 2 and elapsed < 0.35)
+
+    calls.clear()
+    flights.do('a', slow, 3)
+    check("结束后同键重新执行", calls == [3])
+
+    def failing():
+        calls.append('x')
+        time.sleep(0.2)
+        raise ConnectionError("模拟限流")
+
+    calls.clear()
+    results = run_concurrently(lambda: flights.do('b', failing))
+    check("异常由所有等待者共享，只请求一次",
+          calls == ['x'] and all(isinstance(r, ConnectionError) for r in results))
+
+    check("同一线程重入不会死锁", flights.do('c', lambda: flights.do('c', lambda: 'inner')) == 'inner')
+
+
+def test_cold_instant_fetch_once(offline, monkeypatch, check):
+    """冷缓存时并发获取即时数据只抓取一次"""
+    num_stocks = 300
+    rng = np.random.default_rng(11)
+    codes = [f"{i:06d}" for i in range(num_stocks)]
+    turnover = rng.lognormal(np.log(3e8), 1.0, num_stocks)
+    list_calls = []
+    requested = []
+
+    def fake_rank(symbol):
+        list_calls.append(symbol)
+        time.sleep(0.2)
+        return pd.DataFrame({
+            '序号': range(1, num_stocks + 1), '股票代码': codes, '股票简称': codes, '最新价': 10.0,
+            '涨跌幅': [f"{p:.2f}%" for p in rng.normal(0, 2, num_stocks)], '换手率': '3.00%',
+            '流入资金': turnover / 2, '流出资金': turnover / 2, '净额': turnover * 0.01, '成交额': turnover,
+        })
+
+    def fake_fetch(code, debug=False, raise_errors=False):
+        requested.append(code)
+        return {'股票代码': code, '超大单净额': 1.0, '大单净额': 2.0, '主力净流入': 3.0}
+
+    monkeypatch.setattr(data_source.ak, 'stock_fund_flow_individual', fake_rank)
+    monkeypatch.setattr(rf, 'fetch_single_stock_main_force_flow', fake_fetch)
+
+    results = run_concurrently(lambda: rf.get_fund_flow_data('即时'))
+    check(f"排行接口请求 {len(list_calls)} 次 = 1", len(list_calls) == 1)
+    check(f"主力资金流请求 {len(requested)} 次 <= {num_stocks}（未重复抓取）", 0 < len(requested) <= num_stocks)
+    check("所有线程得到同一份数据", all(isinstance(r, pd.DataFrame) and r is results[0] for r in results))
+
+
+def test_daily_bars_fetch_once(offline, monkeypatch, check):
+    """并发读取同一只股票的日线只补抓一次"""
+    bar_calls = []
+    now = datetime(2026, 3, 3, 16, 0)
+
+    def fake_hist(symbol, period, start_date, end_date, adjust):
+        bar_calls.append(symbol)
+        time.sleep(0.2)
+        days = pd.bdate_range(start_date, min(pd.Timestamp(end_date), pd.Timestamp(now.date())))
+        return pd.DataFrame({'日期': days.date, '开盘': 10.0, '收盘': 10.0, '最高': 10.0, '最低': 10.0,
+                             '成交量': 1000, '成交额': 1.0e4, '振幅': 1.0, '涨跌幅': 0.5, '涨跌额': 0.05, '换手率': 1.2})
+
+    monkeypatch.setattr(data_source.ak, 'stock_zh_a_hist', fake_hist)
+    results = run_concurrently(lambda: bar_store.get_daily_bars('600000', days=60, now=now))
+    check(f"日线接口请求 {len(bar_calls)} 次 = 1", len(bar_calls) == 1)
+    check("所有线程读到相同的日线", all(len(r) == len(results[0]) > 0 for r in results))
+
+
+def test_basic_info_fetch_once(offline, monkeypatch, check):
+    """并发预测同一只股票时基本面只请求一次"""
+    info_calls = []
+
+    def fake_info(symbol):
+        info_calls.append(symbol)
+        time.sleep(0.2)
+        return pd.DataFrame({'item': ['行业', '总市值'], 'value': ['银行', 1.0e11]})
+
+    monkeypatch.setattr(data_source.ak, 'stock_individual_info_em', fake_info)
+    results = run_concurrently(lambda: predictor.StockPredictor().fetch_basic_info('600000'))
+    check(f"基本面接口请求 {len(info_calls)} 次 = 1", len(info_calls) == 1)
+    check("所有线程得到相同的基本面摘要", all(r == '行业: 银行 | 总市值: 100000000000.0' for r in results))
+
+
+if __name__ == '__main__':
+    raise SystemExit(pytest.main([__file__, '-s', '-q']))
@@ -0,0 +1,80 @@
+"""
+测试进程内快照缓存：过期时间、容量/内存上限、按交易日换键、主动失效和命中计数
+"""
+import pandas as pd
+import pytest
+import rank_flow as rf
+import data_source
+from snapshot_cache import SnapshotCache, estimate_size
+
+df = pd.DataFrame({'股票代码': [f"{i:06d}" for i in range(1000)], '净额': range(1000)})
+
+
+def test_ttl(check):
+    """过期时间"""
+    cache = SnapshotCache(max_entries=10, max_bytes=None, ttl_seconds=60)
+    key = cache.make_key('即时', '2024-05-06')
+    cache.put(key, df, now=0)
+    check("未过期时命中", cache.get(key, now=59) is df)
+    check("过期后未命中", cache.get(key, now=61) is None)
+    check("过期条目已删除", len(cache) == 0)
+
+
+def test_key_per_trade_date(check):
+    """交易日不同则键不同（隔天不会返回昨天的快照）"""
+    cache = SnapshotCache(max_entries=10, max_bytes=None, ttl_seconds=60)
+    cache.put(cache.make_key('即时', '2024-05-06'), df)
+    check("新交易日未命中", cache.get(cache.make_key('即时', '2024-05-07')) is None)
+
+
+def test_capacity_limits(check):
+    """条目数与内存上限（LRU 淘汰）"""
+    size = estimate_size(df)
+    cache = SnapshotCache(max_entries=3, max_bytes=size * 2, ttl_seconds=None)
+    cache.put('a', df)
+    cache.put('b', df)
+    cache.get('a')                 # a 最近使用过
+    cache.put('c', df)             # 超出内存上限，淘汰最久未用的 b
+    check("内存上限淘汰最久未用的条目", cache.get('b') is None and cache.get('a') is df and cache.get('c') is df)
+    check(f"占用 {cache.stats()['bytes']} 字节 <= 上限 {size * 2}", cache.stats()['bytes'] <= size * 2)
+    small = SnapshotCache(max_entries=2, max_bytes=None, ttl_seconds=None)
+    for k in 'xyz':
+        small.put(k, k)
+    check("条目数上限", len(small) == 2 and small.get('x') is None)
+    big = SnapshotCache(max_entries=3, max_bytes=10, ttl_seconds=None)
+    big.put('big', df)
+    check("超过内存上限的单个值不缓存", len(big) == 0)
+
+
+def test_invalidate_bumps_version(check):
+    """主动失效与数据版本"""
+    cache = SnapshotCache(max_entries=10, max_bytes=None, ttl_seconds=None)
+    old_key = cache.make_key('3日排行', '2024-05-06')
+    cache.put(old_key, df)
+    cache.put(cache.make_key('5日排行', '2024-05-06'), df)
+    check("失效 3日排行 删除1条", cache.invalidate('3日排行') == 1)
+    new_key = cache.make_key('3日排行', '2024-05-06')
+    check("失效后数据版本递增", new_key != old_key)
+    cache.put(old_key, df)  # 失效前开始获取的数据晚到写回
+    check("晚到的旧版本数据不会被读到", cache.get(new_key) is None)
+    check("其他周期不受影响", cache.get(cache.make_key('5日排行', '2024-05-06')) is df)
+
+
+def test_rank_flow_integration(temp_db, monkeypatch, check):
+    """rank_flow 接入与命中计数"""
+    calls = []
+    monkeypatch.setattr(data_source.ak, 'stock_fund_flow_individual', lambda symbol: calls.append(symbol) or pd.DataFrame({
+        '序号': [1], '股票代码': ['600000'], '股票简称': ['浦发银行'], '最新价': '10.00',
+        '阶段涨跌幅': '3.00%', '连续换手率': '15.00%', '资金流入净额': '6000.00万'}))
+    monkeypatch.setattr(rf, 'get_instant_reference_data', lambda: pd.DataFrame())
+    rf.get_fund_flow_data('3日排行')
+    rf.get_fund_flow_data('3日排行')
+    stats = rf.get_snapshot_cache_stats()
+    check(f"第二次读取命中内存缓存 (命中 {stats['hits']} / 未命中 {stats['misses']})", stats['hits'] == 1 and calls == ['3日排行'])
+    df_new = rf.refresh_fund_flow_data('3日排行')
+    check("刷新数据时跳过缓存重新请求接口", calls == ['3日排行', '3日排行'])
+    check("刷新后读取命中新数据", rf.get_fund_flow_data('3日排行') is df_new and calls == ['3日排行', '3日排行'])
+
+
+if __name__ == '__main__':
+    raise SystemExit(pytest.main([__file__, '-s', '-q']))
@@ -0,0 +1,125 @@
+"""
+测试资金流快照按版本写入：写入过程中、写入失败时和刷新数据失败时，读取方始终读到完整的旧快照，不会读到空缓存
+"""
+import sqlite3
+import threading
+import pandas as pd
+import pytest
+import config
+import data_source
+import database
+import rank_flow as rf
+import trade_calendar
+
+num = 3000
+
+
+def make_snapshot(n, net):
+    return pd.DataFrame({'股票代码': [f"{i:06d}" for i in range(n)], '股票简称': 'x', '最新价': 10.0,
+                         '涨跌幅': 1.0, '换手率': 2.0, '净额': net, '成交额': 1.0e8})
+
+
+def versions(conn, table):
+    trade_date = trade_calendar.current_trade_date()
+    return [row[0] for row in conn.execute(f"SELECT DISTINCT version FROM {table} WHERE cache_date = ?", (trade_date,))]
+
+
+@pytest.fixture
+def snapshot_db(temp_db, set_config):
+    set_config(RAW_CACHE_STORAGE='columnar')
+
+
+@pytest.fixture
+def old_db(snapshot_db):
+    """模拟升级前的数据库: 快照表没有版本列，当天已有数据（在首次连接前创建）"""
+    old = sqlite3.connect(config.DB_PATH)
+    old.execute('''CREATE TABLE fund_flow_cache (
+                        stock_code TEXT, period_type TEXT, cache_date TEXT, "净额" REAL,
+                        PRIMARY KEY (stock_code, period_type, cache_date))''')
+    old.executemany("INSERT INTO fund_flow_cache VALUES (?, '即时', ?, 1.0)",
+                    [(f"{i:06d}", trade_calendar.current_trade_date()) for i in range(10)])
+    old.commit()
+    old.close()
+
+
+def test_old_db_migrated_and_unpublished_version_hidden(old_db, monkeypatch, check):
+    print("\n1. 旧数据库迁移后已有快照仍可读取...")
+    conn = database.get_connection()
+    check("主库迁移到最新版本", database.get_schema_version(conn) == database.SCHEMA_MIGRATIONS[-1][0])
+    df_old = database.get_fund_flow_cache('即时')
+    check(f"迁移前的 {len(df_old)} 行快照仍可读取（无 version 列）", len(df_old) == 10 and 'version' not in df_old.columns)
+
+    print("\n2. 切换版本前读取方仍读到旧快照...")
+    database.save_raw_fund_flow_cache(make_snapshot(num, 1.0), '即时')
+    check("首个版本可读取", len(database.get_raw_fund_flow_cache('即时')) == num)
+    check("记录快照获取时间", database.get_fund_flow_snapshot_time('即时') is not None)
+
+    def interrupted_publish(*args, **kwargs):
+        raise sqlite3.OperationalError("模拟写入中断")
+
+    with monkeypatch.context() as m:
+        m.setattr(database, '_publish_snapshot', interrupted_publish)
+        database.save_raw_fund_flow_cache(make_snapshot(num, 2.0), '即时')
+        database.save_fund_flow_cache(make_snapshot(num, 2.0), '即时')
+    df = database.get_raw_fund_flow_cache('即时')
+    check("新版本已写入但未切换时读到完整的旧快照", len(df) == num and (df['净额'] == 1.0).all())
+    check("资金流缓存仍为迁移前的快照", len(database.get_fund_flow_cache('即时')) == 10)
+
+
+def test_concurrent_reads_and_pruning(snapshot_db, check):
+    print("\n1. 写入期间并发读取不会读到空快照或半个快照...")
+    conn = database.get_connection()
+    database.save_raw_fund_flow_cache(make_snapshot(num, 2.0), '即时')
+    seen = []
+    stop = threading.Event()
+
+    def reader():
+        while not stop.is_set():
+            df = database.get_raw_fund_flow_cache('即时')
+            seen.append((len(df), df['净额'].nunique() if not df.empty else 0))
+
+    thread = threading.Thread(target=reader)
+    thread.start()
+    for i in range(20):
+        database.save_raw_fund_flow_cache(make_snapshot(num, float(i + 3)), '即时')
+    stop.set()
+    thread.join()
+    check(f"并发读取 {len(seen)} 次，每次都是某个完整版本", len(seen) > 0 and all(s == (num, 1) for s in seen))
+    check("切换后读到最新版本", (database.get_raw_fund_flow_cache('即时')['净额'] == 22.0).all())
+
+    print("\n2. 旧版本按保留数清理，指针只前进不后退...")
+    kept = versions(conn, 'raw_fund_flow_snapshot')
+    check(f"保留 {len(kept)} 个版本 = {config.SNAPSHOT_KEEP_VERSIONS}", len(kept) == config.SNAPSHOT_KEEP_VERSIONS)
+    check("较旧的版本不能覆盖当前版本",
+          not database._publish_snapshot(conn, 'raw_fund_flow_snapshot', '即时',
+                                         trade_calendar.current_trade_date(), min(kept))
+          and (database.get_raw_fund_flow_cache('即时')['净额'] == 22.0).all())
+
+    database.save_fund_flow_cache(make_snapshot(num, 5.0), '即时')
+    df = database.get_fund_flow_cache('即时')
+    check("计算结果表切换到新版本", len(df) == num and (df['净额'] == 5.0).all() and 'version' not in df.columns)
+
+
+def test_failed_refresh_keeps_snapshot(snapshot_db, monkeypatch, check):
+    """刷新数据不清除缓存，获取失败时保留当前快照"""
+    state = {'failing': True}
+
+    def fake_rank(symbol):
+        if state['failing']:
+            raise ConnectionError("模拟限流")
+        return pd.DataFrame({'序号': [1], '股票代码': ['600000'], '股票简称': ['浦发银行'], '最新价': '10.00',
+                             '阶段涨跌幅': '3.00%', '连续换手率': '15.00%', '资金流入净额': '6000.00万'})
+
+    monkeypatch.setattr(data_source.ak, 'stock_fund_flow_individual', fake_rank)
+    monkeypatch.setattr(rf, 'get_instant_reference_data', lambda: pd.DataFrame())
+    database.save_raw_fund_flow_cache(make_snapshot(num, 7.0), '3日排行')
+    check("刷新失败时返回空表", rf.refresh_fund_flow_data('3日排行').empty)
+    df = database.get_raw_fund_flow_cache('3日排行')
+    check("数据库仍为刷新前的完整快照", len(df) == num and (df['净额'] == 7.0).all())
+    state['failing'] = False
+    df = rf.refresh_fund_flow_data('3日排行')
+    check("刷新成功后切换为新快照", len(df) == 1 and len(database.get_raw_fund_flow_cache('3日排行')) == 1)
+
+
+if __name__ == '__main__':
+    raise SystemExit(pytest.main([__file__, '-s', '-q']))
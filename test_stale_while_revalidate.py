@@ -0,0 +1,98 @@
+"""
+测试 stale-while-revalidate：刷新时立即返回上一次的快照，后台重新获取，完成后整体切换为新数据（模拟接口，无需联网）
+"""
+import time
+import numpy as np
+import pandas as pd
+import pytest
+import data_source
+import database
+import rank_flow as rf
+
+num_stocks = 200
+codes = [f"{i:06d}" for i in range(num_stocks)]
+turnover = np.random.default_rng(2).lognormal(np.log(3e8), 1.0, num_stocks)
+
+
+class FakeRankApi:
+    """模拟耗时的即时排行接口（每次请求的最新价递增）和逐只抓取"""
+
+    def __init__(self):
+        self.calls = []
+        self.failing = False
+
+    def rank(self, symbol):
+        self.calls.append(symbol)
+        time.sleep(1.0)   # 模拟耗时的全量获取
+        if self.failing:
+            raise ConnectionError("模拟限流")
+        return pd.DataFrame({
+            '序号': range(1, num_stocks + 1), '股票代码': codes, '股票简称': codes, '最新价': 10.0 + len(self.calls),
+            '涨跌幅': '1.00%', '换手率': '3.00%',
+            '流入资金': turnover / 2, '流出资金': turnover / 2, '净额': turnover * 0.01, '成交额': turnover,
+        })
+
+    def fetch(self, code, debug=False, raise_errors=False):
+        return {'股票代码': code, '超大单净额': 1.0, '大单净额': 2.0, '主力净流入': 3.0}
+
+
+def wait_revalidation(timeout=10):
+    deadline = time.time() + timeout
+    while rf.is_revalidating('即时') and time.time() < deadline:
+        time.sleep(0.05)
+
+
+@pytest.fixture
+def api(temp_db, set_config, monkeypatch):
+    set_config(FETCH_MAX_RETRIES=0, FETCH_INITIAL_RATE=1000, FETCH_MAX_RATE=1000, MAIN_FORCE_BULK_ENABLED=False)
+    fake = FakeRankApi()
+    monkeypatch.setattr(data_source.ak, 'stock_fund_flow_individual', fake.rank)
+    monkeypatch.setattr(rf, 'fetch_single_stock_main_force_flow', fake.fetch)
+    database.init_db()
+    yield fake
+    # 等后台获取结束，避免线程在恢复接口和临时数据库后继续写入
+    wait_revalidation()
+
+
+def test_serve_stale_while_revalidating(api, check):
+    print("\n1. 冷启动时没有可立即返回的数据...")
+    df, info = rf.serve_fund_flow_data('即时')
+    check("返回 None，需同步获取", df is None and info['fetched_at'] is None)
+    first = rf.get_fund_flow_data('即时')
+    check(f"同步获取 {len(first)} 只", len(first) > 0)
+
+    print("\n2. 刷新时立即返回旧快照，后台重新获取...")
+    start = time.time()
+    df, info = rf.serve_fund_flow_data('即时', refresh=True)
+    elapsed = time.time() - start
+    check(f"{elapsed * 1000:.0f}ms 内返回（< 1秒）", elapsed < 1.0)
+    check("返回上一次的快照及其获取时间", df is first and info['fetched_at'] is not None and info['age_seconds'] >= 0)
+    check("后台正在获取", info['revalidating'])
+
+    df_again, info = rf.serve_fund_flow_data('即时', refresh=True)
+    check("获取期间再次请求仍返回旧快照", df_again is first and info['revalidating'])
+    check("不重复启动后台获取", not rf.revalidate_fund_flow_data('即时', refresh=True))
+    check("获取期间其他读取方仍读到旧快照（缓存未被清除）",
+          rf.get_fund_flow_data('即时') is first and len(database.get_raw_fund_flow_cache('即时')) == len(first))
+
+    wait_revalidation()
+    df, info = rf.serve_fund_flow_data('即时')
+    check("后台获取完成后切换为新数据", df is not first and df['最新价'].iloc[0] == 12.0)
+    check("不再处于后台获取状态", not info['revalidating'] and info['error'] is None)
+    check(f"共请求排行接口 {len(api.calls)} 次 = 2", len(api.calls) == 2)
+
+    print("\n3. 后台获取失败时继续返回旧数据...")
+    api.failing = True
+    current = df
+    rf.serve_fund_flow_data('即时', refresh=True)
+    wait_revalidation()
+    df, info = rf.serve_fund_flow_data('即时')
+    check("仍返回失败前的数据", df is current)
+    check(f"记录失败原因: {info['error']}", info['error'] is not None)
+    df_db = database.get_raw_fund_flow_cache('即时')
+    check("数据库缓存仍为失败前的完整快照", len(df_db) == len(current) and (df_db['最新价'] == 12.0).all())
+    check("其他读取方仍读到失败前的数据", rf.get_fund_flow_data('即时') is current)
+
+
+if __name__ == '__main__':
+    raise SystemExit(pytest.main([__file__, '-s', '-q']))
@@ -0,0 +1,106 @@
+"""
+测试离线交易日历：节假日、交易时段、缓存交易日和按时段判断快照是否过期
+"""
+from datetime import datetime
+import pandas as pd
+import pytest
+import database
+import rank_flow as rf
+import data_source
+import trade_calendar as tc
+
+
+def test_trading_days(check):
+    """交易日与节假日"""
+    check.equal("2025-10-08 国庆休市", tc.is_trading_day('2025-10-08'), False)
+    check.equal("2025-10-09 国庆后开市", tc.is_trading_day('2025-10-09'), True)
+    check.equal("2025-09-28 调休周日不开市", tc.is_trading_day('2025-09-28'), False)
+    check.equal("春节前最后一个交易日", tc.previous_trading_day('2026-02-24'), '2026-02-13')
+    check.equal("春节后第一个交易日", tc.next_trading_day('2026-02-13'), '2026-02-24')
+
+
+def test_missing_year_warns_once(set_config, monkeypatch, capsys, check):
+    """未收录休市安排的年份按仅周末休市处理，并提示一次"""
+    monkeypatch.setattr(tc, '_WARNED_YEARS', set())
+    check.equal("未收录年份的工作日视为交易日", tc.is_trading_day('2099-01-05'), True)
+    check.equal("未收录年份的周末不开市", tc.is_trading_day('2099-01-03'), False)
+    tc.next_trading_day('2099-01-05')
+    output = capsys.readouterr().out
+    check.equal("提示缺少 2099 年的休市安排（只提示一次）", output.count("未收录 2099 年"), 1)
+    tc.is_trading_day('2026-03-02')
+    check("已收录的年份不提示", "未收录" not in capsys.readouterr().out)
+
+    set_config(EXTRA_MARKET_HOLIDAYS=['2098-01-01'])
+    check.equal("config 中补充了休市日的年份", tc.has_holiday_schedule(2098), True)
+    check.equal("补充的休市日不开市", tc.is_trading_day('2098-01-01'), False)
+    check("补充了休市日的年份不提示", "未收录" not in capsys.readouterr().out)
+
+
+def test_session_phase(check):
+    """交易时段"""
+    check.equal("09:00 开盘前", tc.session_phase(datetime(2026, 3, 2, 9, 0)), tc.PRE_OPEN)
+    check.equal("10:00 上午", tc.session_phase(datetime(2026, 3, 2, 10, 0)), tc.MORNING)
+    check.equal("12:00 午休", tc.session_phase(datetime(2026, 3, 2, 12, 0)), tc.LUNCH_BREAK)
+    check.equal("14:00 下午", tc.session_phase(datetime(2026, 3, 2, 14, 0)), tc.AFTERNOON)
+    check.equal("15:30 收盘后", tc.session_phase(datetime(2026, 3, 2, 15, 30)), tc.CLOSED)
+    check.equal("节假日全天休市", tc.session_phase(datetime(2026, 10, 6, 10, 0)), tc.CLOSED)
+
+
+def test_cache_trade_date(check):
+    """缓存使用的交易日"""
+    check.equal("盘中为当天", tc.current_trade_date(datetime(2026, 3, 2, 10, 0)), '2026-03-02')
+    check.equal("开盘前为上一交易日", tc.current_trade_date(datetime(2026, 3, 3, 8, 0)), '2026-03-02')
+    check.equal("国庆期间为节前最后一个交易日", tc.current_trade_date(datetime(2025, 10, 5, 10, 0)), '2025-09-30')
+    check.equal("盘中最近已收盘交易日为前一天", tc.last_closed_trade_date(datetime(2026, 3, 3, 10, 0)), '2026-03-02')
+    check.equal("收盘后最近已收盘交易日为当天", tc.last_closed_trade_date(datetime(2026, 3, 3, 15, 0)), '2026-03-03')
+
+
+def test_snapshot_stale(check):
+    """快照是否过期"""
+    check.equal("交易分钟: 11:00 -> 13:30 (午休不计)",
+                tc.trading_minutes_between(datetime(2026, 3, 2, 11, 0), datetime(2026, 3, 2, 13, 30)), 60.0)
+    starts = ['2026-03-02 11:00:00', '2026-03-02 09:00:00', '2026-02-27 14:30:00', '', None]
+    check.equal("批量计算交易分钟（同日、开盘前、跨日、无法解析）",
+                [None if pd.isna(m) else float(m) for m in tc.trading_minutes_since(starts, datetime(2026, 3, 2, 13, 30))],
+                [60.0, 150.0, 180.0, None, None])
+    check.equal("盘中10分钟前获取 -> 有效",
+                tc.is_snapshot_stale('2026-03-02 10:00:00', datetime(2026, 3, 2, 10, 10), 30), False)
+    check.equal("11:20 获取、午休中 -> 有效",
+                tc.is_snapshot_stale('2026-03-02 11:20:00', datetime(2026, 3, 2, 12, 50), 30), False)
+    check.equal("11:20 获取、13:30 -> 过期",
+                tc.is_snapshot_stale('2026-03-02 11:20:00', datetime(2026, 3, 2, 13, 30), 30), True)
+    check.equal("14:50 获取、收盘后 -> 过期（可取定稿数据）",
+                tc.is_snapshot_stale('2026-03-02 14:50:00', datetime(2026, 3, 2, 15, 10), 30), True)
+    check.equal("收盘后获取、当晚 -> 定稿不过期",
+                tc.is_snapshot_stale('2026-03-02 15:10:00', datetime(2026, 3, 2, 23, 0), 30), False)
+    check.equal("收盘后获取、次日开盘前 -> 不过期",
+                tc.is_snapshot_stale('2026-03-02 15:10:00', datetime(2026, 3, 3, 9, 0), 30), False)
+    check.equal("收盘后获取、次日开盘后 -> 过期",
+                tc.is_snapshot_stale('2026-03-02 15:10:00', datetime(2026, 3, 3, 9, 35), 30), True)
+    check.equal("节前获取、假期中 -> 不过期",
+                tc.is_snapshot_stale('2025-09-30 16:00:00', datetime(2025, 10, 6, 10, 0), 30), False)
+    check.equal("没有获取时间 -> 过期", tc.is_snapshot_stale(None), True)
+
+
+def test_db_snapshot_by_fetch_time(temp_db, monkeypatch, check):
+    """数据库快照按获取时间决定是否重新请求"""
+    calls = []
+    monkeypatch.setattr(data_source.ak, 'stock_fund_flow_individual', lambda symbol: calls.append(symbol) or pd.DataFrame({
+        '序号': [1], '股票代码': ['600000'], '股票简称': ['浦发银行'], '最新价': '10.00',
+        '阶段涨跌幅': '3.00%', '连续换手率': '15.00%', '资金流入净额': '6000.00万'}))
+    monkeypatch.setattr(rf, 'get_instant_reference_data', lambda: pd.DataFrame())
+    rf.get_fund_flow_data('3日排行')
+    rf._SNAPSHOT_CACHE.clear()
+    rf.get_fund_flow_data('3日排行')
+    check.equal("刚获取的快照直接使用数据库缓存", calls, ['3日排行'])
+
+    conn = database.get_connection()
+    conn.execute("UPDATE fund_flow_snapshot_meta SET fetched_at = '2000-01-03 10:00:00'")
+    conn.commit()
+    rf._SNAPSHOT_CACHE.clear()
+    rf.get_fund_flow_data('3日排行')
+    check.equal("过期的快照重新请求接口", calls, ['3日排行', '3日排行'])
+
+
+if __name__ == '__main__':
+    raise SystemExit(pytest.main([__file__, '-s', '-q']))
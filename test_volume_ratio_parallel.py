@@ -0,0 +1,68 @@
+"""
+测试量比并发计算：向量化量比与逐只计算一致、截止时间到达后未完成的股票退回4维度评分（模拟接口，无需联网）
+"""
+import time
+import numpy as np
+import pandas as pd
+import pytest
+import rank_flow as rf
+
+
+def scalar_ratio(volumes):
+    """原 calculate_volume_ratio_local 的 pandas 写法"""
+    s = pd.Series(volumes, dtype=float)
+    if len(s) < 2:
+        return np.nan
+    avg = s.iloc[-6:-1].mean() if len(s) >= 6 else s.iloc[:-1].mean()
+    if avg == 0 or pd.isna(avg):
+        return np.nan
+    return round(s.iloc[-1] / avg, 2)
+
+
+def test_vectorized_matches_scalar(check):
+    """向量化量比与逐只计算一致"""
+    rng = np.random.default_rng(20240401)
+    histories = [rng.integers(1000, 100000, size=rng.integers(0, 12)).astype(float) for _ in range(3000)]
+    histories += [np.array([0.0, 0.0, 5.0]), np.array([100.0, 100.0, 100.0, 100.0, 100.0, 112.5]), None]
+    expected = np.array([scalar_ratio(h) if h is not None else np.nan for h in histories])
+    actual = rf.calculate_volume_ratio_vec(histories)
+    mismatch = int((~((expected == actual) | (np.isnan(expected) & np.isnan(actual)))).sum())
+    check(f"不一致 {mismatch}/{len(histories)}", mismatch == 0)
+
+
+def test_deadline_falls_back_to_4d(temp_db, set_config, monkeypatch, check):
+    """截止时间内未完成的股票（日线接口很慢）使用4维度评分"""
+    set_config(FETCH_INITIAL_RATE=200, FETCH_MAX_RATE=200)
+    rng = np.random.default_rng(20240401)
+    slow_codes = {f"{i:06d}" for i in range(0, 200, 10)}
+
+    def fake_fetch_volume_history(code):
+        time.sleep(5 if code in slow_codes else 0.02)
+        return np.array([1000.0, 1100.0, 900.0, 1000.0, 1000.0, 2500.0])
+
+    monkeypatch.setattr(rf, 'fetch_volume_history', fake_fetch_volume_history)
+
+    df = pd.DataFrame({
+        '股票代码': [f"{i:06d}" for i in range(200)],
+        '增仓占比': rng.uniform(-5, 25, 200),
+        '涨跌幅': rng.uniform(-5, 9, 200),
+        '换手率': rng.uniform(0.5, 20, 200),
+        '成交额': rng.uniform(1e8, 3e9, 200),
+    })
+    df_4d = rf.add_comprehensive_scores(df.copy())
+
+    start = time.perf_counter()
+    df_result = rf.add_volume_ratio_for_top_stocks(df_4d.copy(), deadline_seconds=1.5)
+    elapsed = time.perf_counter() - start
+    print(f"[STAT] 200只股票量比耗时: {elapsed:.2f}秒")
+
+    timed_out = df_result['股票代码'].isin(slow_codes)
+    check("在截止时间附近返回，不被慢请求阻塞", elapsed < 2.5)
+    check("按时完成的股票已计算量比", (df_result.loc[~timed_out, '当日量比'] == 2.5).all())
+    check("超时的股票量比为空", df_result.loc[timed_out, '当日量比'].isna().all())
+    check("超时的股票保持4维度评分",
+          (df_result.loc[timed_out, '综合评分'].to_numpy() == df_4d.loc[timed_out, '综合评分'].to_numpy()).all())
+
+
+if __name__ == '__main__':
+    raise SystemExit(pytest.main([__file__, '-s', '-q']))
@@ -0,0 +1,206 @@
+# A股交易日历（离线）: 节假日休市表 + 交易时段划分
+# 缓存键的交易日、数据是否已收盘定稿、盘中快照何时过期，统一由这里判断
+
+from datetime import date, datetime, time as dtime, timedelta
+
+import pandas as pd
+
+import config
+
+# 沪深交易所节假日休市安排（周末本来就休市，调休上班的周六日也不开市，这里只列工作日休市）
+# 未收录的年份按“仅周末休市”处理（首次用到时提示一次，春节等休市日会被当作交易日），
+# 交易所公布次年安排后在这里补充；临时休市可在 config.EXTRA_MARKET_HOLIDAYS 中补充
+_HOLIDAYS = {
+    2024: ['01-01', '02-09', '02-12', '02-13', '02-14', '02-15', '02-16', '04-04', '04-05',
+           '05-01', '05-02', '05-03', '06-10', '09-16', '09-17',
+           '10-01', '10-02', '10-03', '10-04', '10-07'],
+    2025: ['01-01', '01-28', '01-29', '01-30', '01-31', '02-03', '02-04', '04-04',
+           '05-01', '05-02', '05-05', '06-02', '10-01', '10-02', '10-03', '10-06', '10-07', '10-08'],
+    2026: ['01-01', '01-02', '02-16', '02-17', '02-18', '02-19', '02-20', '02-23', '04-06',
+           '05-01', '05-04', '05-05', '06-19', '09-25', '10-01', '10-02', '10-05', '10-06', '10-07'],
+}
+MARKET_HOLIDAYS = frozenset(f"{year}-{day}" for year, days in _HOLIDAYS.items() for day in days)
+# 已提示过缺少休市安排的年份
+_WARNED_YEARS = set()
+
+# 交易时段
+PRE_OPEN = 'pre_open'        # 交易日开盘前
+MORNING = 'morning'          # 上午连续竞价
+LUNCH_BREAK = 'lunch_break'  # 午间休市
+AFTERNOON = 'afternoon'      # 下午连续竞价
+CLOSED = 'closed'            # 收盘后或非交易日
+
+INTRADAY_PHASES = (MORNING, LUNCH_BREAK, AFTERNOON)
+
+
+def _parse_time(value: str) -> dtime:
+    return datetime.strptime(value, "%H:%M").time()
+
+
+def _as_date(day) -> date:
+    if isinstance(day, datetime):
+        return day.date()
+    if isinstance(day, date):
+        return day
+    return datetime.strptime(str(day)[:10], "%Y-%m-%d").date()
+
+
+def has_holiday_schedule(year: int) -> bool:
+    """是否收录了该年的节假日休市安排（内置表或 config.EXTRA_MARKET_HOLIDAYS 中有该年的日期）"""
+    return year in _HOLIDAYS or any(str(d).startswith(f"{year}-") for d in config.EXTRA_MARKET_HOLIDAYS)
+
+
+def _warn_missing_year(year: int):
+    if year in _WARNED_YEARS or has_holiday_schedule(year):
+        return
+    _WARNED_YEARS.add(year)
+    print(f"[交易日历] Warning: 未收录 {year} 年的节假日休市安排，暂按仅周末休市处理，节假日会被当作交易日；"
+          f"请在 trade_calendar._HOLIDAYS 或 config.EXTRA_MARKET_HOLIDAYS 中补充")
+
+
+def is_trading_day(day) -> bool:
+    """是否为交易日（day 可为 date/datetime/'YYYY-MM-DD'）"""
+    day = _as_date(day)
+    if day.weekday() >= 5:
+        return False
+    _warn_missing_year(day.year)
+    key = day.strftime("%Y-%m-%d")
+    return key not in MARKET_HOLIDAYS and key not in config.EXTRA_MARKET_HOLIDAYS
+
+
+def previous_trading_day(day) -> str:
+    """day 之前（不含）最近的交易日"""
+    day = _as_date(day) - timedelta(days=1)
+    while not is_trading_day(day):
+        day -= timedelta(days=1)
+    return day.strftime("%Y-%m-%d")
+
+
+def next_trading_day(day) -> str:
+    """day 之后（不含）最近的交易日"""
+    day = _as_date(day) + timedelta(days=1)
+    while not is_trading_day(day):
+        day += timedelta(days=1)
+    return day.strftime("%Y-%m-%d")
+
+
+def session_phase(now: datetime = None) -> str:
+    """当前所处的交易时段: PRE_OPEN / MORNING / LUNCH_BREAK / AFTERNOON / CLOSED"""
+    now = now or datetime.now()
+    if not is_trading_day(now):
+        return CLOSED
+    t = now.time()
+    if t < _parse_time(config.MARKET_OPEN_TIME):
+        return PRE_OPEN
+    if t < _parse_time(config.MARKET_LUNCH_START):
+        return MORNING
+    if t < _parse_time(config.MARKET_LUNCH_END):
+        return LUNCH_BREAK
+    if t < _parse_time(config.MARKET_CLOSE_TIME):
+        return AFTERNOON
+    return CLOSED
+
+
+def is_intraday(now: datetime = None) -> bool:
+    """当前是否处于交易日的开盘后、收盘前（含午间休市）"""
+    return session_phase(now) in INTRADAY_PHASES
+
+
+def current_trade_date(now: datetime = None) -> str:
+    """
+    当前行情数据所属的交易日
+    交易日开盘后为当天；开盘前、周末和节假日为上一个交易日（接口此时返回的仍是上一交易日的数据）
+    """
+    now = now or datetime.now()
+    if is_trading_day(now) and now.time() >= _parse_time(config.MARKET_OPEN_TIME):
+        return now.strftime("%Y-%m-%d")
+    return previous_trading_day(now)
+
+
+def last_closed_trade_date(now: datetime = None) -> str:
+    """最近一个已收盘的交易日（该日及之前的数据不会再变化）"""
+    now = now or datetime.now()
+    if is_trading_day(now) and now.time() >= _parse_time(config.MARKET_CLOSE_TIME):
+        return now.strftime("%Y-%m-%d")
+    return previous_trading_day(now)
+
+
+def market_close_at(trade_date) -> datetime:
+    """某个交易日的收盘时间"""
+    return datetime.combine(_as_date(trade_date), _parse_time(config.MARKET_CLOSE_TIME))
+
+
+def is_final_snapshot(fetched_at: datetime) -> bool:
+    """快照是否在其所属交易日收盘后获取（当天数据已定稿，不再变化）"""
+    return fetched_at >= market_close_at(current_trade_date(fetched_at))
+
+
+def trading_minutes_between(start: datetime, end: datetime) -> float:
+    """[start, end) 之间处于连续竞价时段的分钟数（午休、收盘后、非交易日不计）"""
+    if end <= start:
+        return 0.0
+    sessions = [(config.MARKET_OPEN_TIME, config.MARKET_LUNCH_START),
+                (config.MARKET_LUNCH_END, config.MARKET_CLOSE_TIME)]
+    total = 0.0
+    day = start.date()
+    while day <= end.date():
+        if is_trading_day(day):
+            for open_at, close_at in sessions:
+                lo = max(start, datetime.combine(day, _parse_time(open_at)))
+                hi = min(end, datetime.combine(day, _parse_time(close_at)))
+                if hi > lo:
+                    total += (hi - lo).total_seconds() / 60
+        day += timedelta(days=1)
+    return total
+
+
+def trading_minutes_since(starts, end: datetime):
+    """
+    trading_minutes_between 的向量化版本：多个开始时间到同一结束时间的连续竞价分钟数
+
+    与 end 同一天的开始时间按交易时段截取整列计算；其他日期的按不同取值逐个计算（同一批抓取的时间相同，通常只有几个）
+    :param starts: 开始时间序列（字符串或时间），无法解析的为 NaN
+    :return: numpy 数组
+    """
+    starts = pd.to_datetime(pd.Series(starts).reset_index(drop=True), errors='coerce')
+    minutes = pd.Series(float('nan'), index=starts.index)
+    same_day = starts.notna() & (starts.dt.normalize() == pd.Timestamp(end.date()))
+    if same_day.any():
+        total = pd.Series(0.0, index=starts.index[same_day])
+        if is_trading_day(end):
+            for open_at, close_at in [(config.MARKET_OPEN_TIME, config.MARKET_LUNCH_START),
+                                      (config.MARKET_LUNCH_END, config.MARKET_CLOSE_TIME)]:
+                lo = starts[same_day].clip(lower=pd.Timestamp(datetime.combine(end.date(), _parse_time(open_at))))
+                hi = pd.Timestamp(min(end, datetime.combine(end.date(), _parse_time(close_at))))
+                total += ((hi - lo).dt.total_seconds() / 60).clip(lower=0)
+        minutes[same_day] = total
+    other = starts.notna() & ~same_day
+    for start in starts[other].unique():
+        minutes[starts == start] = trading_minutes_between(pd.Timestamp(start).to_pydatetime(), end)
+    return minutes.to_numpy()
+
+
+def is_snapshot_stale(fetched_at, now: datetime = None, max_age_minutes: float = None) -> bool:
+    """
+    按交易时段判断行情快照是否需要重新获取
+
+    - 没有获取时间的快照视为过期
+    - 已进入新的交易日（开盘后）时，上一交易日的快照过期
+    - 收盘后获取的快照当天已定稿，不会过期
+    - 盘中获取的快照：收盘后过期（可取定稿数据）；盘中经过的交易分钟数超过 max_age_minutes 过期，
+      午间休市、开盘前不计时
+    """
+    if fetched_at is None or pd.isna(fetched_at) or fetched_at == '':
+        return True
+    fetched_at = pd.Timestamp(fetched_at).to_pydatetime()
+    now = now or datetime.now()
+    max_age_minutes = max_age_minutes if max_age_minutes is not None else config.SNAPSHOT_STALE_MINUTES
+
+    trade_date = current_trade_date(fetched_at)
+    if current_trade_date(now) != trade_date:
+        return True
+    if is_final_snapshot(fetched_at):
+        return False
+    if now >= market_close_at(trade_date):
+        return True
+    return trading_minutes_between(fetched_at, now) > max_age_minutes